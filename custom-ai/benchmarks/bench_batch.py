@@ -0,0 +1,38 @@
+# Skalabilitas batch generation (NDJSON, seperti CLI) terhadap jumlah worker (offline, tanpa panggilan Gemini).
+#   cd custom-ai && python benchmarks/bench_batch.py [--count 3000] [--workers 1,2,4,8]
+import os, sys, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main
+
+def main_(argv=None) -> int:
+    cpus = os.cpu_count() or 1
+    default_workers = ",".join(str(w) for w in sorted({1, 2, 4, 8, cpus}) if w <= max(cpus, 1) * 2)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--count", type=int, default=3000)
+    ap.add_argument("--workers", default=default_workers)
+    args = ap.parse_args(argv)
+
+    jobs = main._batch_jobs(args.count, ["memory", "spatial", "numerical"], ["easy", "medium", "hard"], 0, False)
+    print(f"cpu_count={cpus} count={args.count}")
+    base = None
+    for w in [int(x) for x in args.workers.split(",")]:
+        if w <= 1:
+            run = lambda js: main.run_batch(js, 1, encode=True)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=w)
+            run = lambda js, pool=pool, w=w: main._run_windowed(pool, js, w, encode=True)
+        list(run(jobs[: max(w * 16, 16)]))   # pemanasan: spawn worker & import main di luar pengukuran
+        t0 = time.perf_counter()
+        n = sum(1 for _ in run(jobs))
+        rate = n / (time.perf_counter() - t0)
+        if pool: pool.shutdown()
+        base = base or rate
+        print(f"workers={w:<3} {rate:9.1f} bundle/s  speedup {rate/base:5.2f}x  efisiensi {rate/base/w:6.1%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,51 @@
+# Bandingkan pembuatan bundle challenge via LLM: lima panggilan per item vs satu prompt batch per bundle.
+#   cd custom-ai && python benchmarks/bench_bundle.py [--runs 10] [--type memory]
+# Default memakai backend Gemini palsu (GEMINI_BACKEND=fake): latensi round-trip diambil dari
+# FAKE_GEMINI_LATENCY_MS, token dihitung dari panjang prompt/respons. Reuse hasil LLM dimatikan agar
+# setiap bundle benar-benar memanggil upstream. Set GEMINI_BACKEND=google untuk API asli.
+import os, sys, argparse, statistics, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+import main
+from fastapi.testclient import TestClient
+
+def _tokens() -> dict:
+    out = {"prompt": 0, "completion": 0}
+    for (priority, _model, kind), v in list(main.M_LLM_TOKENS._values.items()):
+        if priority == "background": out[kind] += v
+    return out
+
+def run(c: TestClient, mode: str, t: str, runs: int) -> dict:
+    main.LLM_BUNDLE_MODE = mode
+    tok0, st0 = _tokens(), main.llm_shared_stats()
+    ts, fallbacks = [], 0
+    for i in range(runs):
+        t0 = time.perf_counter()
+        r = c.post("/v1/challenges/new", json={"type": t, "difficulty": "medium", "use_llm": True, "seed": i}).json()
+        ts.append(time.perf_counter() - t0)
+        fallbacks += bool(main.load_challenge_local(r["challengeId"]).get("llm_fallback"))
+    tok1, st1 = _tokens(), main.llm_shared_stats()
+    return {"median_ms": statistics.median(ts) * 1000, "calls": (st1["upstream"] - st0["upstream"]) / runs,
+            "in": (tok1["prompt"] - tok0["prompt"]) / runs, "out": (tok1["completion"] - tok0["completion"]) / runs,
+            "fallback": fallbacks}
+
+def main_(argv=None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--type", choices=["memory", "spatial", "numerical"], help="default: semua")
+    args = ap.parse_args(argv)
+    main.LLM_REUSE_RATE = 0.0
+
+    c = TestClient(main.app)
+    print(f"backend={main.GEMINI_BACKEND} runs={args.runs} (nilai per bundle)")
+    print(f"{'tipe':<11}{'mode':<7}{'median ms':>10}{'panggilan':>10}{'token in':>10}{'token out':>10}{'fallback':>9}")
+    for t in [args.type] if args.type else ["memory", "spatial", "numerical"]:
+        for mode in ("items", "batch"):
+            r = run(c, mode, t, args.runs)
+            print(f"{t:<11}{mode:<7}{r['median_ms']:>10.0f}{r['calls']:>10.1f}{r['in']:>10.0f}{r['out']:>10.0f}{r['fallback']:>9}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
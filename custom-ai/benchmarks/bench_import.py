@@ -0,0 +1,35 @@
+# Waktu cold import main.py di interpreter baru (yang dibayar setiap worker autoscale / proses batch).
+#   cd custom-ai && python benchmarks/bench_import.py [--runs 7] [--budget 1.0]
+# Melaporkan IMPORT_SECONDS yang diukur main.py sendiri dan wall-clock proses; keluar dengan kode 1 bila
+# median melebihi anggaran (default IMPORT_BUDGET_SEC atau 1.0 s).
+import os, sys, json, argparse, statistics, subprocess, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+_PROBE = "import json, main; print(json.dumps({'import': main.IMPORT_SECONDS, 'localOnly': main.LOCAL_ONLY}))"
+
+def main_(argv=None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET_SEC", "1.0")))
+    args = ap.parse_args(argv)
+
+    env = dict(os.environ)
+    env.pop("GEMINI_API_KEY", None)      # worker lokal: tanpa key, mode local-only
+    imports, walls = [], []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", _PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        walls.append(time.perf_counter() - t0)
+        imports.append(json.loads(out.stdout.strip().splitlines()[-1])["import"])
+
+    med = statistics.median(imports)
+    print(f"import main.py: median {med*1000:.0f} ms  max {max(imports)*1000:.0f} ms  "
+          f"(proses: median {statistics.median(walls)*1000:.0f} ms)  anggaran {args.budget*1000:.0f} ms")
+    if med > args.budget:
+        print("MELEBIHI ANGGARAN", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
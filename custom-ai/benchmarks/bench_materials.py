@@ -0,0 +1,57 @@
+# Bandingkan alur "summary lalu quiz" (dua request) dengan /materials/process (combined & parallel).
+#   cd custom-ai && python benchmarks/bench_materials.py [--runs 5] [--file handout.pdf]
+# Default memakai backend Gemini palsu (GEMINI_BACKEND=fake) sehingga hanya struktur biaya yang diukur:
+# jumlah upload, byte terunggah, waktu ACTIVE + generate, dan token. Set GEMINI_BACKEND=google untuk API asli.
+import os, sys, argparse, statistics, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+import main
+from fastapi.testclient import TestClient
+
+_PDF = (b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj "
+        b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 200 200]>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n")
+
+def _files(data: bytes, name: str):
+    return {"files": (name, data, "application/pdf")}
+
+def _separate(c: TestClient, data: bytes, name: str, n: int) -> dict:
+    r1 = c.post("/summary/from-files", files=_files(data, name)).json()
+    r2 = c.post(f"/quiz/from-files?n={n}", files=_files(data, name)).json()
+    u1, u2 = r1["meta"]["usage"], r2["meta"]["usage"]
+    return {"uploads": 2, "bytes": u1["bytesUploaded"] + u2["bytesUploaded"],
+            "inTok": (u1["inputTokens"] or 0) + (u2["inputTokens"] or 0),
+            "outTok": (u1["outputTokens"] or 0) + (u2["outputTokens"] or 0)}
+
+def _process(mode: str):
+    def run(c: TestClient, data: bytes, name: str, n: int) -> dict:
+        u = c.post(f"/materials/process?n={n}&mode={mode}", files=_files(data, name)).json()["meta"]["usage"]
+        return {"uploads": 1, "bytes": u["bytesUploaded"], "inTok": u["inputTokens"] or 0, "outTok": u["outputTokens"] or 0}
+    return run
+
+def main_(argv=None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--n", type=int, default=10)
+    ap.add_argument("--file", help="PDF materi (default PDF kosong 1 halaman)")
+    args = ap.parse_args(argv)
+    data = Path(args.file).read_bytes() if args.file else _PDF
+    name = Path(args.file).name if args.file else "handout.pdf"
+
+    c = TestClient(main.app)
+    print(f"backend={main.GEMINI_BACKEND} runs={args.runs} n={args.n} file={name} ({len(data)} B)")
+    print(f"{'alur':<22}{'median ms':>10}{'upload':>8}{'byte':>10}{'token in':>10}{'token out':>10}")
+    for label, fn in (("summary + quiz", _separate), ("process combined", _process("combined")),
+                      ("process parallel", _process("parallel"))):
+        ts, last = [], None
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            last = fn(c, data, name, args.n)
+            ts.append(time.perf_counter() - t0)
+        print(f"{label:<22}{statistics.median(ts)*1000:>10.0f}{last['uploads']:>8}{last['bytes']:>10}"
+              f"{last['inTok']:>10}{last['outTok']:>10}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,43 @@
+# Benchmark solver & generator number maze (offline, tanpa panggilan Gemini).
+#   cd custom-ai && python benchmarks/bench_maze.py [--grid 5] [--steps 8] [--runs 50]
+import os, sys, time, random, argparse, statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main
+
+def _timeit(fn, runs: int):
+    ts = []
+    for i in range(runs):
+        t0 = time.perf_counter(); fn(i); ts.append(time.perf_counter() - t0)
+    return statistics.mean(ts) * 1000, statistics.median(ts) * 1000, max(ts) * 1000
+
+def _worst_case_grid(grid: int):
+    # semua op '×'/'+' dengan angka besar: ruang nilai paling lebar
+    cells = [[9] * grid for _ in range(grid)]
+    edges = {"h": [["×"] * (grid-1) for _ in range(grid)], "v": [["+"] * grid for _ in range(grid-1)]}
+    return cells, edges, [grid // 2, grid // 2]
+
+def main_(argv=None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--grid", type=int, default=5)
+    ap.add_argument("--steps", type=int, default=8)
+    ap.add_argument("--runs", type=int, default=50)
+    args = ap.parse_args(argv)
+    g, s, n = args.grid, args.steps, args.runs
+
+    cells, edges, start = _worst_case_grid(g)
+    mean, med, mx = _timeit(lambda i: main._maze_layers(cells, edges, start, s), n)
+    print(f"dp worst-case {g}x{g}/{s}: mean {mean:.2f} ms  median {med:.2f} ms  max {mx:.2f} ms")
+
+    for d in ("easy", "medium", "hard"):
+        mean, med, mx = _timeit(lambda i: main._gen_num_maze(random.Random(i), 1, grid=g, max_steps=s, difficulty=d), n)
+        print(f"generate {g}x{g}/{s} {d:<6}: mean {mean:.2f} ms  median {med:.2f} ms  max {mx:.2f} ms")
+
+    items = [main._gen_num_maze(random.Random(i), 1, grid=g, max_steps=s) for i in range(n)]
+    mean, med, mx = _timeit(lambda i: main._maze_check_path(items[i]["render"], items[i]["solution"]["pathCells"]), n)
+    print(f"grade path {g}x{g}/{s}: mean {mean*1000:.1f} µs  median {med*1000:.1f} µs")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,161 @@
+# Microbenchmark generator lokal, renderer, evaluator, sanitasi, scoring & persistensi (offline, tanpa Gemini).
+#   cd custom-ai && python benchmarks/bench_micro.py [--filter gen.num] [--save base.json] [--compare base.json]
+# Per kasus: ops/s (terbaik dari --repeat putaran, tiap putaran minimal --min-time detik) dan puncak alokasi
+# per operasi (tracemalloc, median). --compare menandai regresi bila ops/s turun atau alokasi naik melebihi
+# --threshold (default 10%) dan keluar dengan kode 1.
+import os, sys, json, time, random, argparse, platform, statistics, tempfile, tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main
+
+# ---------- kasus: setiap factory menyiapkan state sekali, lalu mengembalikan fungsi tanpa argumen ----------
+def _gen(fn, *args, **kw):
+    def factory():
+        rnd = random.Random(0)
+        return lambda: fn(rnd, 1, *args, **kw)
+    return factory
+
+def _render_svg():
+    base = main._gen_spatial_map_base(random.Random(0), 5)
+    return lambda: main._render_map_svg(5, base["roads"], base["river"], base["landmarks"], base["north"])
+
+def _safe_eval():
+    return lambda: main._safe_eval_expr("(8÷(3-8÷3))×1")
+
+def _verify_24():
+    return lambda: main._verify_24_expression("8/(3-8/3)", [3, 3, 8, 8])
+
+def _bundle(n: int = 15) -> list:
+    rnd = random.Random(0)
+    return (main.generate_memory_bundle(rnd, "medium") + main.generate_spatial_bundle(rnd, "medium")
+            + main.generate_numerical_bundle(rnd, "medium"))[:n]
+
+def _sanitize():
+    items = _bundle()
+    return lambda: main.sanitize_items(items)
+
+def _answer_hash():
+    payload = {"itemId": "num_maze_1", "solution": {"pathCells": [[1, 1], [1, 2], [2, 2], [2, 1]], "steps": 3}}
+    return lambda: main._answer_hash(payload)
+
+def _score():
+    rnd = random.Random(0)
+    items = [{"id": f"q{i}", "jawaban": rnd.choice("ABCD")} for i in range(1, 21)]
+    answers = []
+    for i in range(1, 21):
+        order = [0, 1, 2, 3]; rnd.shuffle(order)
+        answers.append(main.AnswerIn(question_id=f"q{i}", chosen_index=rnd.randrange(4), order=order,
+                                     time_sec=rnd.randrange(20)))
+    return lambda: main.score_attempt(items, answers, 20)
+
+def _store_factory(read: bool):
+    def factory():
+        tmp = Path(tempfile.mkdtemp(prefix="bench-micro-"))
+        path = tmp / "doc.json"
+        doc = {"_id": "x", "items": _bundle(5), "meta": {"source": "bench"}}
+        main._atomic_write(path, doc)
+        return (lambda: main._read_json(path)) if read else (lambda: main._atomic_write(path, doc))
+    return factory
+
+CASES = {
+    "gen.memory.lexicon": _gen(main._gen_memory_lexicon, None),
+    "gen.memory.sequence_missing": _gen(main._gen_memory_sequence_missing),
+    "gen.memory.scene_recall": _gen(main._gen_memory_scene_recall),
+    "gen.spatial.rotate": _gen(main._gen_spatial_rotate),
+    "gen.spatial.route": _gen(main._gen_spatial_route),
+    "gen.spatial.reflect": _gen(main._gen_spatial_reflect),
+    "gen.num.24": _gen(main._gen_num_24),
+    "gen.num.maze": _gen(main._gen_num_maze),
+    "gen.num.equation_fill": _gen(main._gen_num_equation_fill),
+    "gen.num.function_machine": _gen(main._gen_num_function_machine),
+    "gen.num.modular": _gen(main._gen_num_modular),
+    "gen.num.base_convert": _gen(main._gen_num_base_convert),
+    "gen.num.prob_ratio": _gen(main._gen_num_prob_ratio),
+    "render.map_svg": _render_svg,
+    "eval.safe_eval_expr": _safe_eval,
+    "eval.verify_24": _verify_24,
+    "sanitize.items": _sanitize,
+    "sanitize.answer_hash": _answer_hash,
+    "score.attempt": _score,
+    "store.atomic_write": _store_factory(read=False),
+    "store.read_json": _store_factory(read=True),
+}
+
+# ---------- pengukuran ----------
+def _ops_per_sec(fn, min_time: float) -> float:
+    n, t0 = 0, time.perf_counter()
+    while True:
+        for _ in range(16): fn()
+        n += 16
+        dt = time.perf_counter() - t0
+        if dt >= min_time:
+            return n / dt
+
+def _alloc_peak(fn, samples: int) -> int:
+    # puncak memori ekstra selama satu operasi; diukur terpisah karena tracemalloc memperlambat eksekusi
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return int(statistics.median(peaks))
+
+def run(names, repeat: int, min_time: float, alloc_samples: int) -> dict:
+    results = {}
+    for name in names:
+        fn = CASES[name]()
+        for _ in range(8): fn()   # pemanasan: cache lru, impor malas, dsb.
+        ops = max(_ops_per_sec(fn, min_time) for _ in range(repeat))
+        results[name] = {"ops_per_sec": round(ops, 1), "alloc_peak_bytes": _alloc_peak(fn, alloc_samples)}
+        print(f"{name:<28} {ops:>12,.0f} ops/s  {results[name]['alloc_peak_bytes']:>10,} B/op", flush=True)
+    return results
+
+def compare(base: dict, cur: dict, threshold: float) -> list:
+    regressions = []
+    for name, r in cur.items():
+        b = base.get(name)
+        if not b: continue
+        speed = r["ops_per_sec"] / b["ops_per_sec"] - 1 if b["ops_per_sec"] else 0.0
+        alloc = r["alloc_peak_bytes"] / b["alloc_peak_bytes"] - 1 if b["alloc_peak_bytes"] else 0.0
+        flag = speed < -threshold or alloc > threshold
+        print(f"{'REGRESI' if flag else 'ok':<8} {name:<28} ops/s {speed:+.1%}  alloc {alloc:+.1%}")
+        if flag: regressions.append(name)
+    return regressions
+
+def main_(argv=None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--filter", default="", help="substring nama kasus")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--min-time", type=float, default=0.2)
+    ap.add_argument("--alloc-samples", type=int, default=50)
+    ap.add_argument("--save", help="simpan hasil sebagai baseline JSON")
+    ap.add_argument("--compare", help="baseline JSON pembanding")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args(argv)
+
+    names = [n for n in CASES if args.filter in n]
+    if not names:
+        print(f"tidak ada kasus cocok: {args.filter!r}", file=sys.stderr)
+        return 2
+    results = run(names, args.repeat, args.min_time, args.alloc_samples)
+
+    if args.save:
+        doc = {"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "created_at": main._now_iso()},
+               "results": results}
+        Path(args.save).write_text(json.dumps(doc, indent=2), encoding="utf-8")
+        print(f"baseline disimpan: {args.save}")
+    if args.compare:
+        base = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(base.get("results", {}), results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,173 @@
+# Load driver end-to-end: memutar campuran trafik realistis ke server yang berjalan, lalu melaporkan
+# throughput & persentil latensi per endpoint. Pakai bersama backend palsu agar tidak memakan kuota:
+#   cd custom-ai && GEMINI_BACKEND=fake FAKE_GEMINI_LATENCY_MS=400:2000 uvicorn main:app --port 8000
+#   python benchmarks/load_driver.py --url http://localhost:8000 --concurrency 16 --duration 60
+# Hanya stdlib (urllib + thread), jadi bisa dijalankan dari mesin mana pun.
+import sys, json, time, uuid, random, argparse, threading, urllib.request, urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# bobot kira-kira mengikuti pola pemakaian: chat & challenge paling sering, upload file paling jarang
+MIX = {
+    "quiz_text": 2, "quiz_files": 1, "summary": 1, "chat": 3,
+    "challenge_new": 4, "challenge_submit": 2, "attempt": 2,
+}
+
+# PDF satu halaman minimal, cukup untuk lolos validasi mime & diunggah
+_PDF = (b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj "
+        b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 200 200]>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n")
+_TEXT = ("Fotosintesis adalah proses tumbuhan hijau mengubah energi cahaya menjadi energi kimia. "
+         "Klorofil menyerap cahaya; air dan karbon dioksida diubah menjadi glukosa dan oksigen. ") * 20
+
+def _multipart(fields: Dict[str, str], files: List[Tuple[str, str, str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    out = []
+    for k, v in fields.items():
+        out.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+    for field, name, ctype, data in files:
+        out.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+                   f'Content-Type: {ctype}\r\n\r\n'.encode() + data + b"\r\n")
+    out.append(f"--{boundary}--\r\n".encode())
+    return b"".join(out), f"multipart/form-data; boundary={boundary}"
+
+class Driver:
+    def __init__(self, url: str, timeout: float):
+        self.url, self.timeout = url.rstrip("/"), timeout
+        self.lock = threading.Lock()
+        self.lat: Dict[str, List[float]] = {}
+        self.status: Dict[str, Dict[str, int]] = {}
+        self.quizzes: List[dict] = []       # quiz yang sudah dibuat, untuk trafik attempt
+        self.challenges: List[dict] = []    # challenge yang sudah dibuat, untuk trafik submit
+
+    def _request(self, name: str, path: str, body: Optional[bytes], ctype: Optional[str]) -> Optional[dict]:
+        req = urllib.request.Request(self.url + path, data=body, method="POST" if body is not None else "GET")
+        if ctype: req.add_header("Content-Type", ctype)
+        t0 = time.perf_counter()
+        data, code = None, "error"
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                code = str(resp.status)
+                data = json.loads(resp.read() or b"null")
+        except urllib.error.HTTPError as e:
+            code = str(e.code)
+        except Exception as e:
+            code = type(e).__name__
+        dt = time.perf_counter() - t0
+        with self.lock:
+            self.lat.setdefault(name, []).append(dt)
+            st = self.status.setdefault(name, {})
+            st[code] = st.get(code, 0) + 1
+        return data
+
+    def _json(self, name: str, path: str, obj: dict) -> Optional[dict]:
+        return self._request(name, path, json.dumps(obj).encode(), "application/json")
+
+    def _remember(self, bucket: List[dict], item: dict) -> None:
+        with self.lock:
+            bucket.append(item)
+            if len(bucket) > 200: del bucket[:100]
+
+    # ---------- skenario ----------
+    def quiz_text(self, rnd: random.Random):
+        body, ctype = _multipart({"text": _TEXT}, [])
+        d = self._request("quiz_text", f"/quiz/from-text?n={rnd.choice([5, 10])}", body, ctype)
+        if d and d.get("quiz_id"): self._remember(self.quizzes, d)
+
+    def quiz_files(self, rnd: random.Random):
+        body, ctype = _multipart({}, [("files", "materi.pdf", "application/pdf", _PDF)])
+        d = self._request("quiz_files", "/quiz/from-files?n=5", body, ctype)
+        if d and d.get("quiz_id"): self._remember(self.quizzes, d)
+
+    def summary(self, rnd: random.Random):
+        body, ctype = _multipart({}, [("files", "materi.pdf", "application/pdf", _PDF)])
+        self._request("summary", "/summary/from-files", body, ctype)
+
+    def chat(self, rnd: random.Random):
+        body, ctype = _multipart({"text": "Jelaskan fotosintesis.", "avatar": rnd.choice(["teacher", "student"])}, [])
+        self._request("chat", "/chat/completion", body, ctype)
+
+    def challenge_new(self, rnd: random.Random):
+        d = self._json("challenge_new", "/v1/challenges/new", {
+            "type": rnd.choice(["memory", "spatial", "numerical"]),
+            "difficulty": rnd.choice(["easy", "medium", "hard"]),
+            "use_llm": rnd.random() < 0.5,
+        })
+        if d and d.get("challengeId"): self._remember(self.challenges, d)
+
+    def challenge_submit(self, rnd: random.Random):
+        with self.lock:
+            ch = rnd.choice(self.challenges) if self.challenges else None
+        if ch is None:
+            return self.challenge_new(rnd)
+        answers = [{"itemId": it["itemId"], "answer": None, "time_sec": rnd.randrange(30)} for it in ch.get("items", [])]
+        self._json("challenge_submit", "/v1/challenges/submit", {"challengeId": ch["challengeId"], "answers": answers})
+
+    def attempt(self, rnd: random.Random):
+        with self.lock:
+            q = rnd.choice(self.quizzes) if self.quizzes else None
+        if q is None:
+            return self.quiz_text(rnd)
+        answers = [{"question_id": it.get("id", ""), "chosen_index": rnd.randrange(4), "time_sec": rnd.randrange(20)}
+                   for it in q.get("items", [])]
+        self._json("attempt", "/quiz/attempts", {"quiz_id": q["quiz_id"], "max_time_sec": 20, "answers": answers})
+
+def _pct(xs: List[float], p: float) -> float:
+    if not xs: return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+def report(d: Driver, elapsed: float) -> dict:
+    out = {}
+    print(f"{'endpoint':<18}{'n':>7}{'rps':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}  status")
+    for name in MIX:
+        xs = d.lat.get(name, [])
+        if not xs: continue
+        row = {"count": len(xs), "rps": len(xs) / elapsed, "status": d.status.get(name, {}),
+               **{f"p{p}_ms": _pct(xs, p) * 1000 for p in (50, 90, 99)}, "max_ms": max(xs) * 1000}
+        out[name] = row
+        print(f"{name:<18}{row['count']:>7}{row['rps']:>8.2f}{row['p50_ms']:>10.0f}{row['p90_ms']:>10.0f}"
+              f"{row['p99_ms']:>10.0f}{row['max_ms']:>10.0f}  {row['status']}")
+    total = sum(len(v) for v in d.lat.values())
+    print(f"total {total} request dalam {elapsed:.1f}s = {total / elapsed:.2f} rps")
+    return out
+
+def main_(argv=None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=30.0, help="detik")
+    ap.add_argument("--timeout", type=float, default=240.0)
+    ap.add_argument("--mix", default="", help="override bobot, mis. chat=5,quiz_files=0")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="tulis laporan JSON ke path ini")
+    args = ap.parse_args(argv)
+
+    mix = dict(MIX)
+    for kv in filter(None, args.mix.split(",")):
+        k, v = kv.split("=")
+        if k not in mix:
+            print(f"skenario tidak dikenal: {k}", file=sys.stderr)
+            return 2
+        mix[k] = int(v)
+    names = [k for k, w in mix.items() if w > 0]
+    weights = [mix[k] for k in names]
+
+    d = Driver(args.url, args.timeout)
+    stop_at = time.monotonic() + args.duration
+
+    def worker(i: int):
+        rnd = random.Random(args.seed * 1000 + i)
+        while time.monotonic() < stop_at:
+            getattr(d, rnd.choices(names, weights)[0])(rnd)
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        list(ex.map(worker, range(args.concurrency)))
+    out = report(d, time.monotonic() - t0)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"args": vars(args), "endpoints": out}, fh, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,249 @@
+# Pengganti lokal google.generativeai untuk uji beban & pengembangan tanpa kuota (GEMINI_BACKEND=fake).
+# Meniru permukaan SDK yang dipakai main.py: configure, upload_file, get_file (PROCESSING -> ACTIVE/FAILED),
+# delete_file, GenerativeModel.generate_content / count_tokens. Respons dibuat sesuai skema prompt (kuis, ringkasan, chat,
+# tiap varian item challenge) atau diambil dari file canned. Latensi & error bisa diatur lewat env:
+#   FAKE_GEMINI_LATENCY_MS   "median:p99" generate_content (lognormal), default "800:4000"
+#   FAKE_GEMINI_UPLOAD_MS    "median:p99" upload_file, default "150:600"
+#   FAKE_GEMINI_ACTIVE_SEC   lama file PROCESSING sebelum ACTIVE, default 1.0
+#   FAKE_GEMINI_ERROR_RATE   peluang generate_content melempar error 503, default 0
+#   FAKE_GEMINI_BAD_JSON_RATE peluang respons JSON terpotong, default 0
+#   FAKE_GEMINI_FILE_FAIL_RATE peluang file berakhir FAILED, default 0
+#   FAKE_GEMINI_CANNED       file JSON {"quiz"|"summary"|"materials"|"chat"|<variant>: respons} untuk menimpa sintesis
+#   FAKE_GEMINI_SEED         seed RNG (default acak)
+import os, re, json, math, time, uuid, random, threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+def _latency_spec(env: str, default: str) -> Tuple[float, float]:
+    med, p99 = (float(x) for x in os.getenv(env, default).split(":"))
+    sigma = math.log(max(p99, med) / med) / 2.326 if med > 0 else 0.0
+    return med / 1000.0, sigma
+
+_GEN_LATENCY = _latency_spec("FAKE_GEMINI_LATENCY_MS", "800:4000")
+_UPLOAD_LATENCY = _latency_spec("FAKE_GEMINI_UPLOAD_MS", "150:600")
+_ACTIVE_SEC = float(os.getenv("FAKE_GEMINI_ACTIVE_SEC", "1.0"))
+_ERROR_RATE = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0"))
+_BAD_JSON_RATE = float(os.getenv("FAKE_GEMINI_BAD_JSON_RATE", "0"))
+_FILE_FAIL_RATE = float(os.getenv("FAKE_GEMINI_FILE_FAIL_RATE", "0"))
+_CANNED: Dict[str, Any] = {}
+if os.getenv("FAKE_GEMINI_CANNED"):
+    with open(os.environ["FAKE_GEMINI_CANNED"], encoding="utf-8") as fh:
+        _CANNED = json.load(fh)
+
+_rnd = random.Random(os.getenv("FAKE_GEMINI_SEED"))
+_rnd_lock = threading.Lock()
+
+def _sample(spec: Tuple[float, float]) -> float:
+    med, sigma = spec
+    with _rnd_lock:
+        return med * math.exp(_rnd.gauss(0.0, sigma)) if sigma else med
+
+def _chance(p: float) -> bool:
+    if p <= 0: return False
+    with _rnd_lock:
+        return _rnd.random() < p
+
+class FakeAPIError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+# ---------- SDK surface ----------
+def configure(api_key: Optional[str] = None, **kw) -> None:
+    pass
+
+def GenerationConfig(**kw) -> dict:
+    return dict(kw)
+
+class _State:
+    # meniru enum SDK: main.py membaca .name
+    def __init__(self, name: str): self.name = name
+    def __repr__(self): return self.name
+
+class File(SimpleNamespace):
+    pass
+
+types = SimpleNamespace(File=File)
+
+_files: Dict[str, dict] = {}
+_files_lock = threading.Lock()
+
+def _file_view(rec: dict) -> File:
+    st = rec["final"] if time.monotonic() >= rec["ready_at"] else "PROCESSING"
+    return File(name=rec["name"], uri=rec["uri"], mime_type=rec["mime_type"], display_name=rec["display_name"],
+                size_bytes=rec["size_bytes"], state=_State(st))
+
+def upload_file(path: str, mime_type: Optional[str] = None, display_name: Optional[str] = None, **kw) -> File:
+    time.sleep(_sample(_UPLOAD_LATENCY))
+    name = f"files/fake-{uuid.uuid4().hex[:12]}"
+    rec = {"name": name, "uri": f"https://fake-gemini.local/v1beta/{name}", "mime_type": mime_type,
+           "display_name": display_name, "size_bytes": os.path.getsize(path),
+           "ready_at": time.monotonic() + _ACTIVE_SEC, "final": "FAILED" if _chance(_FILE_FAIL_RATE) else "ACTIVE"}
+    with _files_lock:
+        _files[name] = rec
+    return _file_view(rec)
+
+def get_file(name: str) -> File:
+    with _files_lock:
+        rec = _files.get(name)
+    if rec is None:
+        raise FakeAPIError(404, f"file {name} tidak ada")
+    return _file_view(rec)
+
+def delete_file(name: str) -> None:
+    with _files_lock:
+        if _files.pop(getattr(name, "name", name), None) is None:
+            raise FakeAPIError(404, f"file {name} tidak ada")
+
+def list_files():
+    with _files_lock:
+        recs = list(_files.values())
+    return [_file_view(r) for r in recs]
+
+# ---------- sintesis respons sesuai skema ----------
+def _num(pattern: str, text: str, default: int) -> int:
+    m = re.search(pattern, text)
+    return int(m.group(1)) if m else default
+
+def _quiz(prompt: str, rnd: random.Random) -> list:
+    n = _num(r"Buat (\d+) soal", prompt, 5)
+    out = []
+    for i in range(1, n + 1):
+        a, b = rnd.randrange(2, 20), rnd.randrange(2, 20)
+        right = a + b
+        opts = [right, right + 1, right - 1, right + 2]
+        rnd.shuffle(opts)
+        out.append({"pertanyaan": f"Berapa {a} + {b}?", "opsi": [f"{L}. {v}" for L, v in zip("ABCD", opts)],
+                    "jawaban": "ABCD"[opts.index(right)], "penjelasan": f"{a} + {b} = {right}."})
+    return out
+
+def _summary(prompt: str, rnd: random.Random) -> dict:
+    return {"summary": "## Tujuan\n- Ringkasan uji dari backend palsu.\n\n## Konsep Kunci\n- Poin satu\n- Poin dua"}
+
+def _materials(prompt: str, rnd: random.Random) -> dict:
+    return {"summary": _summary(prompt, rnd)["summary"], "items": _quiz(prompt, rnd)}
+
+def _lexicon(prompt: str, rnd: random.Random) -> dict:
+    n = _num(r"- (\d+) pasangan", prompt, 4)
+    return {"variant": "lexicon_match", "region": "Jawa",
+            "pairs": [{"term": f"istilah{i}", "definition": f"arti nomor {i}"} for i in range(1, n + 1)],
+            "distractors": ["arti pengecoh satu", "arti pengecoh dua"]}
+
+def _sequence(prompt: str, rnd: random.Random) -> dict:
+    length = _num(r"Panjang (\d+)", prompt, 7)
+    masked = _num(r"maskIndices (\d+) posisi", prompt, 2)
+    a, d = rnd.randrange(1, 10), rnd.randrange(1, 6)
+    return {"variant": "sequence_missing", "sequence": [a + d * i for i in range(length)],
+            "maskIndices": rnd.sample(range(length), masked)}
+
+def _scene(prompt: str, rnd: random.Random) -> dict:
+    grid = _num(r'"grid": (\d+)', prompt, 4)
+    cnt = _num(r"Tepat (\d+) objek", prompt, 3)
+    cells = rnd.sample([(r, c) for r in range(grid) for c in range(grid)], cnt + 1)
+    objs = [{"id": f"o{i}", "icon": rnd.choice(["house", "tree", "car", "shop"]), "pos": list(cells[i]),
+             "color": "#%06x" % rnd.randrange(0x1000000)} for i in range(cnt)]
+    if rnd.random() < 0.5:
+        change = {"type": "removed", "targetId": "o0"}
+    else:
+        change = {"type": "moved", "targetId": "o0", "to": list(cells[cnt])}
+    return {"variant": "scene_recall", "grid": grid, "objects": objs, "change": change}
+
+def _map_base(grid: int, rnd: random.Random) -> dict:
+    cells = rnd.sample([(r, c) for r in range(grid) for c in range(grid)], 3)
+    return {"roads": [[[0, 0], [grid - 1, grid - 1]]], "river": [[0, rnd.randrange(grid)], [grid - 1, rnd.randrange(grid)]],
+            "landmarks": [{"name": n, "pos": list(p), "icon": i}
+                          for n, p, i in zip(["Sekolah", "Pasar", "Rumah"], cells, ["square", "circle", "triangle"])],
+            "north": "up"}
+
+def _rotate(prompt: str, rnd: random.Random) -> dict:
+    grid = _num(r'"grid": (\d+)', prompt, 4)
+    return {"variant": "map_rotate", "grid": grid, "base": _map_base(grid, rnd),
+            "action": {"type": "rotate", "deg": _num(r'"deg": (\d+)', prompt, 90)}}
+
+def _route(prompt: str, rnd: random.Random) -> dict:
+    grid = _num(r'"grid": (\d+)', prompt, 5)
+    steps = _num(r"steps (\d+),", prompt, 4)
+    return {"variant": "route_nav", "grid": grid, "base": _map_base(grid, rnd),
+            "action": {"type": "path", "from": "Sekolah", "steps": [[rnd.choice("NSEW"), 1] for _ in range(steps)]}}
+
+def _reflect(prompt: str, rnd: random.Random) -> dict:
+    grid = _num(r'"grid": (\d+)', prompt, 5)
+    axis = grid // 2
+    return {"variant": "mirror_reflect", "grid": grid,
+            "base": {"roads": [], "river": [], "north": "up",
+                     "landmarks": [{"name": "Pasar", "pos": [rnd.randrange(grid), rnd.randrange(grid)], "icon": "circle"}]},
+            "action": {"type": "reflect", "target": "Pasar", "axis": {"type": "vertical", "x": axis}}}
+
+def _target24(prompt: str, rnd: random.Random) -> dict:
+    nums, sol = rnd.choice([([3, 3, 8, 8], "8/(3-8/3)"), ([1, 2, 3, 4], "1*2*3*4"), ([2, 3, 4, 6], "6*4*(3-2)")])
+    return {"variant": "target_24", "numbers": nums, "target": 24, "oneSolution": sol}
+
+def _equation(prompt: str, rnd: random.Random) -> dict:
+    a, b = rnd.randrange(1, 10), rnd.randrange(1, 10)
+    return {"variant": "equation_fill", "left": "□ + □", "right": str(a + b), "solutions": [a, b]}
+
+def _function(prompt: str, rnd: random.Random) -> dict:
+    x = rnd.randrange(1, 10) * 2
+    return {"variant": "function_machine", "functions": {"f": "2*x+3", "g": "x/2"}, "query": f"f(g({x}))",
+            "steps": [f"g({x})={x // 2}", f"f({x // 2})={x + 3}"], "answer": x + 3}
+
+_VARIANTS = {
+    "lexicon_match": _lexicon, "sequence_missing": _sequence, "scene_recall": _scene,
+    "map_rotate": _rotate, "route_nav": _route, "mirror_reflect": _reflect,
+    "target_24": _target24, "equation_fill": _equation, "function_machine": _function,
+}
+
+def _classify(prompt: str) -> str:
+    m = re.search(r'"variant"\s*:\s*"(\w+)"', prompt)
+    if m and m.group(1) in _VARIANTS: return m.group(1)
+    if "meringkas materi dan membuat soal" in prompt: return "materials"
+    if "generator soal" in prompt: return "quiz"
+    if "ringkasan materi" in prompt: return "summary"
+    return "chat"
+
+def respond(prompt: str, rnd: random.Random) -> str:
+    if "### TUGAS 1\n" in prompt:
+        # prompt batch bundle: jawab tiap tugas sendiri-sendiri lalu bungkus {"items": [...]}
+        tasks = re.split(r"### TUGAS \d+\n", prompt)[1:]
+        return json.dumps({"items": [json.loads(respond(t, rnd)) for t in tasks]}, ensure_ascii=False)
+    kind = _classify(prompt)
+    if kind in _CANNED:
+        data = _CANNED[kind]
+        return data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    if kind == "chat":
+        return "Ini jawaban dari backend Gemini palsu. " + prompt[-200:]
+    fn = {"quiz": _quiz, "summary": _summary, "materials": _materials}.get(kind) or _VARIANTS[kind]
+    return json.dumps(fn(prompt, rnd), ensure_ascii=False)
+
+def _input_tokens(parts: list) -> int:
+    # kira-kira seperti Gemini: ~4 karakter per token teks, 258 token per part file
+    return sum(len(p) // 4 if isinstance(p, str) else 258 for p in parts)
+
+class GenerativeModel:
+    def __init__(self, model_name: str = "fake", generation_config: Any = None, **kw):
+        self.model_name, self.generation_config = model_name, generation_config
+
+    def generate_content(self, contents, request_options: Optional[dict] = None, **kw):
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = "\n\n".join(p for p in parts if isinstance(p, str))
+        timeout = (request_options or {}).get("timeout")
+        delay = _sample(_GEN_LATENCY)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise FakeAPIError(504, "Deadline Exceeded")
+        time.sleep(delay)
+        if _chance(_ERROR_RATE):
+            raise FakeAPIError(503, "The service is currently unavailable.")
+        with _rnd_lock:
+            rnd = random.Random(_rnd.random())
+        text = respond(prompt, rnd)
+        if _chance(_BAD_JSON_RATE):
+            text = text[: max(1, len(text) // 2)]
+        usage = SimpleNamespace(prompt_token_count=_input_tokens(parts),
+                                candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def count_tokens(self, contents, request_options: Optional[dict] = None, **kw):
+        parts = contents if isinstance(contents, list) else [contents]
+        time.sleep(0.02)
+        return SimpleNamespace(total_tokens=_input_tokens(parts))
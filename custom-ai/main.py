@@ -1,17 +1,23 @@
-import os, io, json, time, tempfile, uuid
-from datetime import datetime
+import os, io, sys, gzip, json, time, tempfile, queue, uuid, argparse, itertools, threading, contextlib, contextvars, asyncio, functools, bisect
+_IMPORT_T0 = time.perf_counter()
+from collections import deque, OrderedDict
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait as futures_wait, FIRST_COMPLETED
+from datetime import datetime, timezone
 from typing import List, Optional
 from pathlib import Path
 
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 import re
 import math, random, ast, base64, hashlib, hmac
+from fractions import Fraction
+from types import MappingProxyType
 from typing import Any, Dict, Tuple
 # ====== ENV ======
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
@@ -21,23 +27,787 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
 ALLOW_ORIGINS = [o.strip() for o in os.getenv("ALLOW_ORIGINS", "http://localhost:8080").split(",")]
 DATA_DIR = Path(os.getenv("DATA_DIR", Path(__file__).resolve().parent / "data"))
-
-if not API_KEY:
-    raise RuntimeError("Set GEMINI_API_KEY")
-
-genai.configure(api_key=API_KEY)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "google").strip().lower()   # google | fake (uji beban lokal)
+# Tanpa API key (atau LOCAL_ONLY=1) server tetap boot: endpoint LLM menjawab 503,
+# challenge prosedural, attempt & grading tetap jalan.
+LOCAL_ONLY = os.getenv("LOCAL_ONLY", "0") == "1" or (GEMINI_BACKEND != "fake" and not API_KEY)
 
 GEN_CONFIG = {"response_mime_type": "application/json", "temperature": 0.2}
-model = genai.GenerativeModel(model_name=MODEL_NAME, generation_config=genai.GenerationConfig(**GEN_CONFIG))
 
 app = FastAPI(title="Quiz Generator via Gemini")
 app.add_middleware(CORSMiddleware, allow_origins=ALLOW_ORIGINS, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-# siapkan folder data
+# folder data (dibuat saat tulis pertama oleh _atomic_write)
 QUIZ_DIR = DATA_DIR / "quizzes"
 ATTEMPT_DIR = DATA_DIR / "attempts"
-for d in (QUIZ_DIR, ATTEMPT_DIR):
-    d.mkdir(parents=True, exist_ok=True)
+
+# ====== Gemini client (lazy) ======
+# SDK (import ~0.5 s) & objek model baru dibuat pada panggilan LLM pertama, bukan saat import,
+# sehingga worker lokal (batch, challenge prosedural) boot cepat. Model di-cache per konfigurasi.
+class LLMUnavailable(Exception):
+    pass
+
+_genai_lock = threading.Lock()
+_genai_mod = None
+_models: Dict[tuple, Any] = {}
+
+def get_genai():
+    global _genai_mod
+    if LOCAL_ONLY:
+        raise LLMUnavailable("mode local-only: Gemini tidak dikonfigurasi")
+    if _genai_mod is None:
+        with _genai_lock:
+            if _genai_mod is None:
+                if GEMINI_BACKEND == "fake":
+                    import fake_gemini as mod
+                else:
+                    import google.generativeai as mod
+                mod.configure(api_key=API_KEY)
+                _genai_mod = mod
+    return _genai_mod
+
+def get_model(temperature: float = GEN_CONFIG["temperature"], json_mode: bool = True, model_name: str = MODEL_NAME):
+    key = (model_name, temperature, json_mode)
+    m = _models.get(key)
+    if m is None:
+        genai = get_genai()
+        with _genai_lock:
+            m = _models.get(key)
+            if m is None:
+                cfg = {"temperature": temperature}
+                if json_mode: cfg["response_mime_type"] = "application/json"
+                m = _models[key] = genai.GenerativeModel(model_name=model_name, generation_config=genai.GenerationConfig(**cfg))
+    return m
+
+# ====== Routing model per tugas ======
+# Tiap tugas (quiz, summary, chat per avatar, tiap varian item challenge) dipetakan ke model + konfigurasi.
+# Prompt JSON kecil memakai model cepat; bila validasi builder item gagal, item dicoba ulang sekali
+# dengan model berat (MODEL_ESCALATE=1). Override lewat MODEL_ROUTES="tugas=model[:temperature],...",
+# mis. MODEL_ROUTES="chat.student=gemini-2.5-flash-lite,item.route_nav=gemini-2.5-flash:0.4".
+FAST_MODEL_NAME = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash")
+MODEL_ESCALATE = os.getenv("MODEL_ESCALATE", "1") == "1"
+
+def _route(model: str, temperature: float = GEN_CONFIG["temperature"], json_mode: bool = True) -> dict:
+    return {"model": model, "temperature": temperature, "json": json_mode,
+            "escalate": MODEL_NAME if model != MODEL_NAME else None}
+
+MODEL_ROUTES: Dict[str, dict] = {
+    "quiz": _route(MODEL_NAME),
+    "summary": _route(MODEL_NAME),
+    "materials": _route(MODEL_NAME),
+    "chat.teacher": _route(MODEL_NAME, 0.7, json_mode=False),
+    "chat.student": _route(FAST_MODEL_NAME, 0.7, json_mode=False),
+    # item challenge: prompt pendek & tervalidasi ketat -> model cepat, eskalasi bila gagal
+    "item": _route(FAST_MODEL_NAME),
+    "item.lexicon_match": _route(FAST_MODEL_NAME),
+    "item.sequence_missing": _route(FAST_MODEL_NAME),
+    "item.target_24": _route(FAST_MODEL_NAME),
+    "item.equation_fill": _route(FAST_MODEL_NAME),
+    "item.function_machine": _route(FAST_MODEL_NAME),
+    # penalaran grid/peta lebih sering gagal validasi di model kecil
+    "item.scene_recall": _route(MODEL_NAME),
+    "item.map_rotate": _route(MODEL_NAME),
+    "item.route_nav": _route(MODEL_NAME),
+    "item.mirror_reflect": _route(MODEL_NAME),
+    # satu prompt untuk seluruh bundle (LLM_BUNDLE_MODE=batch): ikut model terberat di dalamnya
+    "item.bundle_memory": _route(MODEL_NAME),
+    "item.bundle_spatial": _route(MODEL_NAME),
+    "item.bundle_numerical": _route(FAST_MODEL_NAME),
+}
+for _kv in filter(None, (x.strip() for x in os.getenv("MODEL_ROUTES", "").split(","))):
+    _task, _, _spec = _kv.partition("=")
+    _model, _, _temp = _spec.strip().partition(":")
+    _base = MODEL_ROUTES.get(_task.strip(), _route(MODEL_NAME))
+    MODEL_ROUTES[_task.strip()] = _route(_model, float(_temp) if _temp else _base["temperature"], _base["json"])
+
+_escalated: contextvars.ContextVar[bool] = contextvars.ContextVar("escalated", default=False)
+
+def route_for(task: str) -> dict:
+    # "item.map_rotate" -> rute varian, lalu "item", lalu default model utama
+    r = MODEL_ROUTES.get(task) or MODEL_ROUTES.get(task.split(".", 1)[0]) or _route(MODEL_NAME)
+    if _escalated.get() and r["escalate"]:
+        r = dict(r, model=r["escalate"], escalate=None)
+    return r
+
+def model_for(task: str) -> Tuple[Any, str]:
+    r = route_for(task)
+    return get_model(r["temperature"], r["json"], r["model"]), r["model"]
+
+@app.exception_handler(LLMUnavailable)
+async def _llm_unavailable_handler(request, exc: LLMUnavailable):
+    return JSONResponse({"error": str(exc), "local_only": True}, status_code=503)
+
+# ====== Metrics (format eksposisi teks Prometheus) ======
+# Registry in-process: counter, gauge, histogram ber-bucket tetap. observe() cukup bisect + 2 penambahan
+# di bawah lock per metrik, sehingga murah dipanggil di jalur panas.
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, Any] = {}
+        _METRICS.append(self)
+
+    def _fmt_labels(self, values: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{str(v)}"' for k, v in zip(self.labelnames, values)]
+        if extra: parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def expose(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            out.append(f"{self.name}{self._fmt_labels(lv)} {v}")
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = _LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            st = self._values.get(labels)
+            if st is None:
+                st = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            st[0][i] += 1
+            st[1] += value
+
+    def expose(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(lv, list(st[0]), st[1]) for lv, st in self._values.items()]
+        for lv, counts, total in items:
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                le = 'le="%s"' % b
+                out.append(f"{self.name}_bucket{self._fmt_labels(lv, le)} {acc}")
+            acc += counts[-1]
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{self._fmt_labels(lv, le)} {acc}")
+            out.append(f"{self.name}_sum{self._fmt_labels(lv)} {round(total, 6)}")
+            out.append(f"{self.name}_count{self._fmt_labels(lv)} {acc}")
+        return out
+
+_METRICS: List[_Metric] = []
+
+M_HTTP_REQUESTS = Counter("http_requests_total", "Jumlah request HTTP", ("endpoint", "method", "status"))
+M_HTTP_LATENCY = Histogram("http_request_duration_seconds", "Durasi request HTTP", ("endpoint", "method"))
+M_UPLOAD = Histogram("gemini_upload_duration_seconds", "Durasi upload file ke Gemini", ("mime",))
+M_UPLOAD_BYTES = Counter("gemini_upload_bytes_total", "Byte yang diunggah ke Gemini", ("mime",))
+M_ACTIVE_WAIT = Histogram("gemini_active_wait_seconds", "Waktu tunggu file sampai ACTIVE", ("result",))
+M_LLM_LATENCY = Histogram("llm_request_duration_seconds", "Durasi generate_content", ("priority", "model", "outcome"))
+M_LLM_TOKENS = Counter("llm_tokens_total", "Token yang dipakai generate_content", ("priority", "model", "kind"))
+M_LLM_ITEM = Histogram("llm_item_duration_seconds", "Durasi panggilan upstream item challenge", ("variant", "outcome"))
+M_CHALLENGES = Counter("challenges_created_total", "Challenge dibuat per sumber (llm|local|fallback)", ("type", "source"))
+M_CHALLENGE_ITEMS = Counter("challenge_items_total", "Item challenge per varian & sumber", ("type", "variant", "source"))
+M_PARSE = Counter("llm_parse_total", "Hasil parse respons model", ("parser", "result"))
+M_GAUGE = Gauge("app_runtime", "Status runtime (scheduler, breaker, cache LLM)", ("component", "key"))
+
+def _collect_runtime_gauges() -> None:
+    # dibaca saat scrape saja: tidak ada biaya di jalur request
+    sch = _gemini_scheduler.stats()
+    M_GAUGE.set("scheduler", "running", value=sch["running"])
+    for p, st in sch["classes"].items():
+        for k in ("queueDepth", "admitted", "rejected", "timedOut", "waitAvgMs", "waitP95Ms"):
+            M_GAUGE.set("scheduler", f"{p}.{k}", value=st[k])
+    for k, v in llm_shared_stats().items():
+        M_GAUGE.set("llm_shared", k, value=v)
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    cs = circuit_stats()
+    M_GAUGE.set("circuit", "gemini", value=states[cs["gemini"]["state"]])
+    for v, st in cs["variants"].items():
+        M_GAUGE.set("circuit", v, value=states[st["state"]])
+    fs = _file_registry.stats()
+    for k in ("files", "bytes", "usedRatio", "inUse"):
+        M_GAUGE.set("gemini_files", k, value=fs[k] or 0)
+    for k, v in rooms_stats().items():
+        M_GAUGE.set("quiz_rooms", k, value=v)
+
+def render_metrics() -> str:
+    _collect_runtime_gauges()
+    lines: List[str] = []
+    for m in list(_METRICS):
+        lines.extend(m.expose())
+    return "\n".join(lines) + "\n"
+
+# ====== Idempotency-Key untuk POST generasi ======
+# Klien mobile mengulang POST saat jaringan putus; tanpa kunci setiap ulangan memicu generate LLM baru dan
+# dokumen duplikat. Dengan header Idempotency-Key, ulangan saat request pertama masih berjalan menunggu hasil
+# request itu, dan ulangan setelah selesai mendapat respons tersimpan (header Idempotent-Replayed: true).
+# Rekaman disimpan sebagai file JSON di DATA_DIR seperti dokumen lain dan kedaluwarsa setelah
+# IDEMPOTENCY_TTL_SEC. Kunci yang sama dengan isi request berbeda ditolak 422; respons 5xx/409/429 tidak
+# disimpan agar klien bisa mencoba lagi.
+IDEMPOTENCY_DIR = DATA_DIR / "idempotency"
+IDEMPOTENCY_TTL_SEC = float(os.getenv("IDEMPOTENCY_TTL_SEC", "86400"))
+IDEMPOTENCY_SWEEP_SEC = float(os.getenv("IDEMPOTENCY_SWEEP_SEC", "600"))
+IDEMPOTENCY_LINGER_SEC = 30.0          # hasil tetap di memori sebentar: menutup celah baca-file vs simpan
+IDEMPOTENT_PATHS = {"/quiz/from-files": "quiz", "/summary/from-files": "summary",
+                    "/materials/process": "quiz", "/v1/challenges/new": "challenge"}   # -> jenis deadline (lama tunggu)
+
+M_IDEMPOTENCY = Counter("idempotency_requests_total", "Request ber-Idempotency-Key per hasil", ("result",))
+
+_idem_inflight: Dict[str, Tuple[str, Future]] = {}
+_idem_routes: Dict[str, Any] = {}
+_idem_last_sweep = 0.0
+
+def _idem_load(skey: str) -> Optional[dict]:
+    path = IDEMPOTENCY_DIR / f"{skey}.json"
+    rec = _read_json(path)
+    if rec is not None and rec["expires"] < time.time():
+        try: path.unlink()
+        except OSError: pass
+        return None
+    return rec
+
+def _idem_sweep() -> None:
+    # rekaman kedaluwarsa yang tidak pernah dibaca lagi
+    cutoff = time.time() - IDEMPOTENCY_TTL_SEC
+    for p in IDEMPOTENCY_DIR.glob("*.json"):
+        try:
+            if p.stat().st_mtime < cutoff: p.unlink()
+        except OSError:
+            pass
+
+def _idem_fingerprint(request: Request, body: bytes) -> str:
+    # boundary multipart berbeda di tiap ulangan: dibuang agar isi yang sama menghasilkan sidik yang sama
+    m = re.search(r'boundary="?([^";]+)', request.headers.get("content-type", ""))
+    if m:
+        body = body.replace(m.group(1).encode("latin-1"), b"")
+    h = hashlib.sha256(f"{request.url.path}?{request.url.query}\n".encode("utf-8"))
+    h.update(body)
+    return h.hexdigest()
+
+def _idem_reply(request: Request, content: Any, status: int, headers: Optional[dict] = None, raw: bool = False):
+    # dijawab tanpa masuk router: tandai rute agar metrics tetap berlabel endpoint yang benar
+    path = request.url.path
+    if path not in _idem_routes:
+        _idem_routes[path] = next((r for r in app.router.routes if getattr(r, "path", None) == path
+                                   and "POST" in (getattr(r, "methods", None) or ())), None)
+    if _idem_routes[path] is not None:
+        request.scope["route"] = _idem_routes[path]
+    if raw:
+        return Response(content["body"].encode("utf-8"), status_code=content["status"],
+                        media_type=content["contentType"], headers=headers)
+    return JSONResponse(content, status_code=status, headers=headers)
+
+# didaftarkan sebelum middleware metrics & trace: Starlette membungkus middleware yang didaftarkan belakangan
+# di luar, jadi ini yang paling dalam dan respons replay tetap mendapat X-Request-ID serta tercatat di metrics
+@app.middleware("http")
+async def _idempotency_middleware(request: Request, call_next):
+    global _idem_last_sweep
+    key = request.headers.get("idempotency-key")
+    kind = IDEMPOTENT_PATHS.get(request.url.path)
+    if key is None or kind is None or request.method != "POST":
+        return await call_next(request)
+    if not 1 <= len(key) <= 255:
+        return _idem_reply(request, {"error": "Idempotency-Key harus 1..255 karakter"}, 400)
+    skey = hashlib.sha256(f"{request.url.path}\n{key}".encode("utf-8")).hexdigest()
+    fp = _idem_fingerprint(request, await request.body())
+    mismatch = {"error": "Idempotency-Key sudah dipakai untuk request dengan isi berbeda"}
+    while True:
+        if skey in _idem_inflight:
+            ifp, fut = _idem_inflight[skey]
+            if ifp != fp:
+                M_IDEMPOTENCY.inc("mismatch")
+                return _idem_reply(request, mismatch, 422)
+            try:
+                rec = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), DEADLINE_SEC[kind])
+            except asyncio.TimeoutError:
+                M_IDEMPOTENCY.inc("conflict")
+                return _idem_reply(request, {"error": "request dengan Idempotency-Key ini masih diproses"}, 409,
+                                   {"Retry-After": "5"})
+            except RuntimeError:
+                continue            # request pertama gagal/tidak disimpan: ulangan ini yang menjalankan
+            M_IDEMPOTENCY.inc("attached")
+            return _idem_reply(request, rec, rec["status"], {"Idempotent-Replayed": "true"}, raw=True)
+        rec = await run_in_threadpool(_idem_load, skey)
+        if rec is not None:
+            if rec["fingerprint"] != fp:
+                M_IDEMPOTENCY.inc("mismatch")
+                return _idem_reply(request, mismatch, 422)
+            M_IDEMPOTENCY.inc("replayed")
+            return _idem_reply(request, rec, rec["status"], {"Idempotent-Replayed": "true"}, raw=True)
+        if skey not in _idem_inflight:
+            break                   # tidak ada await sejak cek ini: request ini jadi pemimpin
+
+    fut: Future = Future()
+    _idem_inflight[skey] = (fp, fut)
+    stored = False
+    try:
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        rec = {"key": key, "path": request.url.path, "fingerprint": fp, "status": response.status_code,
+               "contentType": response.headers.get("content-type"), "body": body.decode("utf-8"),
+               "created_at": _now_iso(), "expires": time.time() + IDEMPOTENCY_TTL_SEC}
+        if response.status_code < 500 and response.status_code not in (409, 429):
+            await run_in_threadpool(_atomic_write, IDEMPOTENCY_DIR / f"{skey}.json", rec)
+            stored = True
+            fut.set_result(rec)
+        else:
+            # tidak disimpan = boleh diulang: penunggu menjalankan ulang, bukan menerima replay 5xx/409/429
+            fut.set_exception(RuntimeError(f"respons {response.status_code} tidak disimpan"))
+    except BaseException:
+        if not fut.done():
+            fut.set_exception(RuntimeError("request idempotent gagal"))
+        raise
+    finally:
+        if stored:
+            asyncio.get_running_loop().call_later(IDEMPOTENCY_LINGER_SEC, lambda: _idem_inflight.get(skey, (None, None))[1] is fut
+                            and _idem_inflight.pop(skey, None))
+        else:
+            _idem_inflight.pop(skey, None)
+    M_IDEMPOTENCY.inc("new")
+    if stored and time.time() - _idem_last_sweep > IDEMPOTENCY_SWEEP_SEC:
+        _idem_last_sweep = time.time()
+        await run_in_threadpool(_idem_sweep)
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    return Response(body, status_code=response.status_code, headers=headers)
+
+@app.middleware("http")
+async def _metrics_middleware(request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", None) or "unmatched"
+        M_HTTP_REQUESTS.inc(endpoint, request.method, status)
+        M_HTTP_LATENCY.observe(endpoint, request.method, value=time.perf_counter() - t0)
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# ====== Tracing per request (span ringan, diekspor JSONL / OTLP) ======
+# Setiap request mendapat request id (header X-Request-ID, dipakai ulang bila dikirim klien). Hanya
+# sebagian request yang di-sampling (TRACE_SAMPLE_RATE); request lain cukup membayar satu ContextVar.get()
+# per span. Span dikumpulkan di memori selama request lalu diserahkan ke thread eksportir lewat antrean
+# terbatas: bila antrean penuh, trace dibuang (dihitung di /metrics), request tidak pernah menunggu.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "off").strip().lower()          # off | jsonl | otlp (opt-in)
+TRACE_PATH = Path(os.getenv("TRACE_PATH", DATA_DIR / "traces.jsonl"))
+TRACE_OTLP_URL = os.getenv("TRACE_OTLP_URL", "http://localhost:4318/v1/traces")
+TRACE_QUEUE_MAX = int(os.getenv("TRACE_QUEUE_MAX", "1000"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "256"))
+
+M_TRACES = Counter("traces_total", "Trace yang diekspor / dibuang", ("result",))
+
+class _Trace:
+    __slots__ = ("trace_id", "request_id", "spans")
+
+    def __init__(self, trace_id: str, request_id: str):
+        self.trace_id, self.request_id, self.spans = trace_id, request_id, []
+
+    def add(self, rec: dict) -> None:
+        # list.append atomik di CPython; batas jumlah span mencegah trace raksasa dari loop panjang
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(rec)
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_trace_ctx: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar("trace_ctx", default=None)
+_span_parent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span_parent", default=None)
+_trace_rnd = random.Random()
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    tr = _trace_ctx.get()
+    if tr is None:
+        yield None
+        return
+    sid = os.urandom(8).hex()
+    rec = {"traceId": tr.trace_id, "spanId": sid, "parentSpanId": _span_parent.get(), "name": name,
+           "start": time.time_ns(), "end": None, "status": "ok", "attrs": attrs}
+    tok = _span_parent.set(sid)
+    try:
+        yield rec
+    except BaseException as e:
+        rec["status"] = "error"
+        rec["attrs"]["error"] = type(e).__name__
+        raise
+    finally:
+        _span_parent.reset(tok)
+        rec["end"] = time.time_ns()
+        tr.add(rec)
+
+def traced(name: str):
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            if _trace_ctx.get() is None:
+                return fn(*a, **kw)
+            with span(name):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+def _otlp_payload(traces: List[_Trace]) -> dict:
+    # bentuk OTLP/JSON minimal (resourceSpans -> scopeSpans -> spans)
+    def val(v):
+        if isinstance(v, bool): return {"boolValue": v}
+        if isinstance(v, int): return {"intValue": str(v)}
+        if isinstance(v, float): return {"doubleValue": v}
+        return {"stringValue": str(v)}
+    spans = []
+    for tr in traces:
+        for s in tr.spans:
+            attrs = dict(s["attrs"], **{"request.id": tr.request_id})
+            spans.append({
+                "traceId": s["traceId"], "spanId": s["spanId"], "parentSpanId": s["parentSpanId"] or "",
+                "name": s["name"], "startTimeUnixNano": str(s["start"]), "endTimeUnixNano": str(s["end"]),
+                "status": {"code": 2 if s["status"] == "error" else 1},
+                "attributes": [{"key": k, "value": val(v)} for k, v in attrs.items()],
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "custom-ai"}}]},
+        "scopeSpans": [{"scope": {"name": "custom-ai.main"}, "spans": spans}],
+    }]}
+
+class _TraceExporter:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.q: "queue.Queue[_Trace]" = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def submit(self, tr: _Trace) -> None:
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+                    self._started = True
+        try:
+            self.q.put_nowait(tr)
+        except queue.Full:
+            M_TRACES.inc("dropped")
+
+    def _drain(self, first: _Trace) -> List[_Trace]:
+        batch = [first]
+        while len(batch) < 64:
+            try: batch.append(self.q.get_nowait())
+            except queue.Empty: break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._drain(self.q.get())
+            try:
+                self.export(batch)
+                M_TRACES.inc("exported", amount=len(batch))
+            except Exception:
+                M_TRACES.inc("error", amount=len(batch))
+
+    def export(self, batch: List[_Trace]) -> None:
+        if self.mode == "otlp":
+            import urllib.request
+            body = json.dumps(_otlp_payload(batch)).encode("utf-8")
+            req = urllib.request.Request(TRACE_OTLP_URL, data=body, headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(req, timeout=5).close()
+            return
+        TRACE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(TRACE_PATH, "a", encoding="utf-8") as fh:
+            for tr in batch:
+                fh.write(json.dumps({"traceId": tr.trace_id, "requestId": tr.request_id, "spans": tr.spans},
+                                    ensure_ascii=False) + "\n")
+
+_trace_exporter = _TraceExporter(TRACE_EXPORT)
+
+def _parse_traceparent(h: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    # W3C traceparent: 00-<trace-id 32 hex>-<parent-id 16 hex>-<flags>
+    parts = (h or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+@app.middleware("http")
+async def _trace_middleware(request, call_next):
+    rid = (request.headers.get("x-request-id") or "")[:64] or uuid.uuid4().hex
+    rid_tok = _request_id.set(rid)
+    tp = _parse_traceparent(request.headers.get("traceparent"))
+    sampled = TRACE_EXPORT != "off" and (tp[2] if tp else _trace_rnd.random() < TRACE_SAMPLE_RATE)
+    try:
+        if not sampled:
+            response = await call_next(request)
+            response.headers["X-Request-ID"] = rid
+            return response
+        tr = _Trace(tp[0] if tp else os.urandom(16).hex(), rid)
+        tr_tok = _trace_ctx.set(tr)
+        parent_tok = _span_parent.set(tp[1] if tp else None)
+        try:
+            with span("http.request", method=request.method) as root:
+                response = await call_next(request)
+                route = request.scope.get("route")
+                root["attrs"]["route"] = getattr(route, "path", None) or request.url.path
+                root["attrs"]["status"] = response.status_code
+        finally:
+            _span_parent.reset(parent_tok)
+            _trace_ctx.reset(tr_tok)
+            _trace_exporter.submit(tr)
+        response.headers["X-Request-ID"] = rid
+        return response
+    finally:
+        _request_id.reset(rid_tok)
+
+# ====== Deadline per request ======
+# Endpoint memasang deadline absolut; setiap panggilan LLM memakai sisa waktu sebagai batas timeout,
+# sehingga timeout mengecil otomatis menjelang deadline. Nilai per endpoint bisa diatur lewat env.
+DEADLINE_SEC = {
+    "quiz": float(os.getenv("DEADLINE_QUIZ_SEC", "180")),
+    "summary": float(os.getenv("DEADLINE_SUMMARY_SEC", "180")),
+    "chat": float(os.getenv("DEADLINE_CHAT_SEC", "60")),
+    "challenge": float(os.getenv("DEADLINE_CHALLENGE_SEC", "60")),
+}
+LLM_MIN_BUDGET_SEC = float(os.getenv("LLM_MIN_BUDGET_SEC", "1.0"))
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+_request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+@contextlib.contextmanager
+def request_deadline(seconds: float):
+    # deadline yang lebih ketat dari luar tetap berlaku
+    outer = _request_deadline.get()
+    dl = time.monotonic() + seconds
+    token = _request_deadline.set(min(dl, outer) if outer else dl)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+def remaining_time() -> Optional[float]:
+    dl = _request_deadline.get()
+    return None if dl is None else dl - time.monotonic()
+
+def budget(default: float, reserve: float = 0.5) -> float:
+    rem = remaining_time()
+    if rem is None:
+        return default
+    rem -= reserve
+    if rem < LLM_MIN_BUDGET_SEC:
+        raise DeadlineExceeded("sisa waktu request tidak cukup")
+    return min(default, rem)
+
+def with_deadline(kind: str):
+    # dekorator endpoint (async maupun sync): deadline berlaku selama handler berjalan
+    def deco(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with request_deadline(DEADLINE_SEC[kind]):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with request_deadline(DEADLINE_SEC[kind]):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+@app.exception_handler(DeadlineExceeded)
+async def _deadline_handler(request, exc: DeadlineExceeded):
+    return JSONResponse({"error": "batas waktu request terlampaui", "detail": str(exc)}, status_code=504)
+
+# ====== Gemini scheduler: batas konkurensi, token bucket per model, kelas prioritas ======
+# interactive (chat) > standard (quiz/summary) > background (item challenge). Antrean tiap kelas
+# dibatasi; bila penuh atau menunggu terlalu lama, request langsung ditolak 429 + Retry-After.
+GEMINI_PRIORITIES = ("interactive", "standard", "background")
+
+def _parse_kv(spec: str) -> Dict[str, str]:
+    return {k.strip(): v.strip() for k, _, v in (p.partition("=") for p in spec.split(",") if "=" in p)}
+
+def _parse_rate(spec: str) -> Tuple[float, float]:
+    rate, _, burst = spec.partition(":")
+    return float(rate), float(burst or rate)
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_RATE_DEFAULT = _parse_rate(os.getenv("GEMINI_RATE_DEFAULT", "2:6"))          # req/detik : burst
+GEMINI_RATE_LIMITS = {m: _parse_rate(v) for m, v in _parse_kv(os.getenv("GEMINI_RATE_LIMITS", "")).items()}
+GEMINI_QUEUE_LIMITS = {**{"interactive": 16, "standard": 16, "background": 32},
+                       **{k: int(v) for k, v in _parse_kv(os.getenv("GEMINI_QUEUE_LIMITS", "")).items()}}
+GEMINI_MAX_WAIT = {**{"interactive": 10.0, "standard": 30.0, "background": 20.0},
+                   **{k: float(v) for k, v in _parse_kv(os.getenv("GEMINI_MAX_WAIT", "")).items()}}
+
+class GeminiSaturated(Exception):
+    def __init__(self, priority: str, retry_after: float, reason: str):
+        super().__init__(f"gemini {priority} jenuh: {reason}")
+        self.priority, self.retry_after, self.reason = priority, retry_after, reason
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.ts = burst, time.monotonic()
+
+    def take(self, now: float) -> float:
+        # 0 bila token diambil, selain itu detik sampai token berikutnya tersedia
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def wait(self, now: float) -> float:
+        # seperti take() tanpa mengambil token
+        tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+class _GeminiScheduler:
+    def __init__(self):
+        self._cv = threading.Condition()
+        self._queues = {p: deque() for p in GEMINI_PRIORITIES}
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self._running = 0
+        self._waits = {p: deque(maxlen=512) for p in GEMINI_PRIORITIES}
+        self._counts = {p: {"admitted": 0, "rejected": 0, "timedOut": 0} for p in GEMINI_PRIORITIES}
+
+    def _bucket(self, model_name: str) -> _TokenBucket:
+        b = self._buckets.get(model_name)
+        if b is None:
+            b = self._buckets[model_name] = _TokenBucket(*GEMINI_RATE_LIMITS.get(model_name, GEMINI_RATE_DEFAULT))
+        return b
+
+    def _is_next(self, ticket: list, now: float) -> bool:
+        # tiket pertama (urut prioritas, lalu FIFO) yang bucket modelnya punya token; tiket yang menunggu
+        # token model lain tidak menahan model yang masih punya token
+        for p in GEMINI_PRIORITIES:
+            for t in self._queues[p]:
+                if t is ticket:
+                    return True
+                if self._bucket(t[0]).wait(now) == 0:
+                    return False
+        return False
+
+    def _retry_after(self, priority: str, model_name: str) -> int:
+        rate = GEMINI_RATE_LIMITS.get(model_name, GEMINI_RATE_DEFAULT)[0] or 0.1
+        ahead = sum(len(self._queues[p]) for p in GEMINI_PRIORITIES[:GEMINI_PRIORITIES.index(priority) + 1])
+        return max(1, math.ceil(ahead / rate))
+
+    def acquire(self, priority: str, model_name: str, max_wait: Optional[float] = None) -> None:
+        with self._cv:
+            q = self._queues[priority]
+            if len(q) >= GEMINI_QUEUE_LIMITS[priority]:
+                self._counts[priority]["rejected"] += 1
+                raise GeminiSaturated(priority, self._retry_after(priority, model_name), "antrean penuh")
+            ticket = [model_name]
+            q.append(ticket)
+            t0 = time.monotonic()
+            deadline = t0 + (GEMINI_MAX_WAIT[priority] if max_wait is None else max_wait)
+            while True:
+                now = time.monotonic()
+                timeout = deadline - now
+                wait = self._bucket(model_name).wait(now)
+                if wait == 0 and self._running < GEMINI_MAX_CONCURRENCY and self._is_next(ticket, now):
+                    self._bucket(model_name).take(now)
+                    q.remove(ticket)
+                    self._running += 1
+                    self._counts[priority]["admitted"] += 1
+                    self._waits[priority].append(now - t0)
+                    self._cv.notify_all()
+                    return
+                if wait > 0:
+                    timeout = min(timeout, wait)
+                if deadline - now <= 0:
+                    q.remove(ticket)
+                    self._counts[priority]["timedOut"] += 1
+                    self._cv.notify_all()
+                    raise GeminiSaturated(priority, self._retry_after(priority, model_name), "waktu tunggu habis")
+                self._cv.wait(max(0.001, timeout))
+
+    def idle(self) -> bool:
+        # tidak ada tiket menunggu & slot konkurensi tersisa: panggilan tambahan tidak menggeser siapa pun
+        with self._cv:
+            return self._running < GEMINI_MAX_CONCURRENCY and not any(self._queues.values())
+
+    def release(self) -> None:
+        with self._cv:
+            self._running -= 1
+            self._cv.notify_all()
+
+    def stats(self) -> dict:
+        with self._cv:
+            out = {"running": self._running, "maxConcurrency": GEMINI_MAX_CONCURRENCY, "classes": {}}
+            for p in GEMINI_PRIORITIES:
+                w = sorted(self._waits[p])
+                out["classes"][p] = {
+                    "queueDepth": len(self._queues[p]), "queueLimit": GEMINI_QUEUE_LIMITS[p], **self._counts[p],
+                    "waitAvgMs": round(sum(w) / len(w) * 1000, 1) if w else 0.0,
+                    "waitP95Ms": round(w[int(len(w) * 0.95) - 1 if len(w) > 1 else 0] * 1000, 1) if w else 0.0,
+                }
+            return out
+
+_gemini_scheduler = _GeminiScheduler()
+
+@contextlib.contextmanager
+def gemini_slot(priority: str, model_name: str = MODEL_NAME, max_wait: Optional[float] = None):
+    _gemini_scheduler.acquire(priority, model_name, max_wait)
+    try:
+        yield
+    finally:
+        _gemini_scheduler.release()
+
+def gemini_generate(m, parts: list, priority: str, model_name: str = MODEL_NAME, **kw):
+    # blocking: dari endpoint async panggil lewat run_in_threadpool agar antrean tidak menahan event loop
+    rem = remaining_time()
+    # sisa deadline hanya boleh memperpendek batas tunggu antrean kelas, bukan memperpanjangnya
+    max_wait = GEMINI_MAX_WAIT[priority] if rem is None else min(GEMINI_MAX_WAIT[priority], max(0.0, rem))
+    with gemini_slot(priority, model_name, max_wait):
+        t0 = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("gemini.generate_content", priority=priority, model=model_name):
+                resp = m.generate_content(parts, **kw)
+            outcome = "ok"
+        finally:
+            M_LLM_LATENCY.observe(priority, model_name, outcome, value=time.perf_counter() - t0)
+    elapsed = time.perf_counter() - t0
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is not None:
+        tin = getattr(usage, "prompt_token_count", 0) or 0
+        tout = getattr(usage, "candidates_token_count", 0) or 0
+        M_LLM_TOKENS.inc(priority, model_name, "prompt", amount=tin)
+        M_LLM_TOKENS.inc(priority, model_name, "completion", amount=tout)
+        if tout: _latency_model.observe(model_name, tin, tout, elapsed)
+    return resp
+
+@app.exception_handler(GeminiSaturated)
+async def _gemini_saturated_handler(request, exc: GeminiSaturated):
+    return JSONResponse({"error": "layanan AI sedang sibuk, coba lagi", "priority": exc.priority, "reason": exc.reason},
+                        status_code=429, headers={"Retry-After": str(int(exc.retry_after))})
 
 # ====== Constants & prompts ======
 ALLOWED_MIME = {"application/pdf", "image/jpeg", "image/png", "image/webp"}
@@ -73,7 +843,8 @@ def build_user_prompt(n:int, difficulty:str, include_explanation:bool, topic_fil
         f"Kunci JSON tetap: pertanyaan, opsi, jawaban, penjelasan. Output HARUS JSON array. {expl}"
     )
 
-def parse_json_or_fallback(text: str):
+@traced("parse.quiz")
+def parse_quiz_items(text: str) -> Optional[List[dict]]:
     # normalisasi key en -> id
     def normalize(item: dict):
         if "pertanyaan" not in item and "question" in item: item["pertanyaan"] = item.pop("question")
@@ -88,50 +859,583 @@ def parse_json_or_fallback(text: str):
         for i, it in enumerate(normed, 1):
             it.setdefault("id", f"q{i}")
             it.setdefault("opsi", ["A", "B", "C", "D"])
+        M_PARSE.inc("quiz", "ok")
         return normed
     except Exception:
+        M_PARSE.inc("quiz", "fallback")
+        return None
+
+def parse_json_or_fallback(text: str):
+    items = parse_quiz_items(text)
+    if items is None:
         return [{
             "id":"q1","pertanyaan":"Gagal parse JSON dari model.","opsi":["A","B","C","D"],"jawaban":"A",
             "penjelasan": (text[:600] + ("..." if len(text) > 600 else "")),
         }]
+    return items
 
-def upload_to_gemini(upload: UploadFile):
+# ====== Registry file Gemini: refcount, reuse, reaper ======
+# upload_to_gemini tidak pernah menghapus file remote, padahal file menumpuk di kuota storage proyek sampai
+# kedaluwarsa sendiri (48 jam). Setiap file dicatat per hash isi: upload identik memakai ulang file remote
+# yang masih jauh dari kedaluwarsa, dan request memegang referensi sampai handler selesai (@track_uploads).
+# Reaper latar belakang menghapus berkelompok file tanpa referensi yang sudah idle FILE_IDLE_SEC, gagal
+# diproses, atau kedaluwarsa; bila pemakaian melewati FILE_HIGH_WATER dari kuota, file idle tertua ikut dihapus.
+FILE_REMOTE_TTL_SEC = 48 * 3600
+FILE_REUSE = os.getenv("FILE_REUSE", "1") == "1"
+FILE_REUSE_MARGIN_SEC = float(os.getenv("FILE_REUSE_MARGIN_SEC", "3600"))   # jangan reuse file yang hampir kedaluwarsa
+FILE_IDLE_SEC = float(os.getenv("FILE_IDLE_SEC", "900"))
+FILE_REAP_INTERVAL_SEC = float(os.getenv("FILE_REAP_INTERVAL_SEC", "60"))
+FILE_REAP_BATCH = int(os.getenv("FILE_REAP_BATCH", "32"))
+FILE_REAP_WORKERS = int(os.getenv("FILE_REAP_WORKERS", "4"))
+FILE_QUOTA_BYTES = int(float(os.getenv("FILE_QUOTA_GB", "20")) * 1024 ** 3)
+FILE_HIGH_WATER = float(os.getenv("FILE_HIGH_WATER", "0.8"))
+
+M_FILES = Counter("gemini_files_total", "Siklus hidup file Gemini", ("event",))   # uploaded|reused|deleted|delete_error
+
+class _FileRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files: Dict[str, dict] = {}       # nama remote -> entri
+        self._by_digest: Dict[str, str] = {}    # "sha256:mime" -> nama remote terbaru
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._deleted = 0
+        self._reused = 0
+
+    def acquire(self, digest: str, mime: str):
+        # file remote yang sama isinya & masih layak dipakai -> tambah referensi; None bila harus upload
+        if not FILE_REUSE:
+            return None
+        now = time.time()
+        with self._lock:
+            e = self._files.get(self._by_digest.get(f"{digest}:{mime}", ""))
+            if e is None or e["failed"] or e["deleting"] or now > e["created"] + FILE_REMOTE_TTL_SEC - FILE_REUSE_MARGIN_SEC:
+                return None
+            e["refs"] += 1
+            e["lastUsed"] = now
+            self._reused += 1
+        M_FILES.inc("reused")
+        return e["file"]
+
+    def register(self, f, digest: str, mime: str, size: int) -> None:
+        now = time.time()
+        key = f"{digest}:{mime}"
+        with self._lock:
+            self._files[f.name] = {"file": f, "key": key, "size": size, "created": now, "lastUsed": now,
+                                   "refs": 1, "failed": False, "deleting": False}
+            self._by_digest[key] = f.name
+        M_FILES.inc("uploaded")
+        self._ensure_reaper()
+
+    def release(self, names: List[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for n in names:
+                e = self._files.get(n)
+                if e is not None:
+                    e["refs"] = max(0, e["refs"] - 1)
+                    e["lastUsed"] = now
+            high = self._used() > FILE_HIGH_WATER * FILE_QUOTA_BYTES
+        if high:
+            self._wake.set()
+
+    def mark_failed(self, names: List[str]) -> None:
+        with self._lock:
+            for n in names:
+                e = self._files.get(n)
+                if e is not None:
+                    e["failed"] = True
+                    if self._by_digest.get(e["key"]) == n: self._by_digest.pop(e["key"])
+        self._wake.set()
+
+    def _used(self) -> int:
+        return sum(e["size"] for e in self._files.values())
+
+    def _due(self) -> List[str]:
+        # kandidat hapus (tanpa referensi): gagal / kedaluwarsa / idle, lalu LRU bila di atas ambang kuota
+        now = time.time()
+        with self._lock:
+            idle = sorted((e for e in self._files.values() if e["refs"] == 0 and not e["deleting"]),
+                          key=lambda e: e["lastUsed"])
+            due = [e for e in idle if e["failed"] or now - e["lastUsed"] > FILE_IDLE_SEC
+                   or now > e["created"] + FILE_REMOTE_TTL_SEC]
+            excess = self._used() - sum(e["size"] for e in due) - FILE_HIGH_WATER * FILE_QUOTA_BYTES
+            for e in idle:
+                if excess <= 0: break
+                if e not in due:
+                    due.append(e)
+                    excess -= e["size"]
+            due = due[:FILE_REAP_BATCH]
+            for e in due:
+                e["deleting"] = True
+                if self._by_digest.get(e["key"]) == e["file"].name: self._by_digest.pop(e["key"])
+            return [e["file"].name for e in due]
+
+    def _delete(self, name: str) -> bool:
+        try:
+            get_genai().delete_file(name)
+        except Exception as e:
+            if getattr(e, "code", None) != 404 and "404" not in str(e):
+                with self._lock:
+                    if name in self._files: self._files[name]["deleting"] = False   # dicoba lagi putaran berikut
+                M_FILES.inc("delete_error")
+                return False
+        with self._lock:
+            self._files.pop(name, None)
+            self._deleted += 1
+        M_FILES.inc("deleted")
+        return True
+
+    def reap(self) -> int:
+        names = self._due()
+        if not names:
+            return 0
+        with span("gemini.reap_files", files=len(names)):
+            return sum(self._pool.map(self._delete, names))
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(FILE_REAP_INTERVAL_SEC)
+            self._wake.clear()
+            try:
+                while self.reap() >= FILE_REAP_BATCH: pass
+            except Exception:
+                pass
+
+    def _ensure_reaper(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._pool = ThreadPoolExecutor(max_workers=FILE_REAP_WORKERS, thread_name_prefix="gemini-reaper")
+                self._thread = threading.Thread(target=self._run, name="gemini-file-reaper", daemon=True)
+                self._thread.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            used = self._used()
+            return {"files": len(self._files), "bytes": used, "quotaBytes": FILE_QUOTA_BYTES,
+                    "usedRatio": round(used / FILE_QUOTA_BYTES, 4) if FILE_QUOTA_BYTES else None,
+                    "inUse": sum(1 for e in self._files.values() if e["refs"] > 0),
+                    "reused": self._reused, "deleted": self._deleted}
+
+_file_registry = _FileRegistry()
+_request_uploads: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("request_uploads", default=None)
+
+def track_uploads(fn):
+    # dekorator endpoint async: referensi file yang diunggah/dipakai request dilepas saat handler selesai
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        names: List[str] = []
+        token = _request_uploads.set(names)
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _request_uploads.reset(token)
+            _file_registry.release(names)
+    return wrapper
+
+@traced("upload")
+def upload_to_gemini(upload: UploadFile, data: Optional[bytes] = None, info: Optional[dict] = None):
     if upload.content_type not in ALLOWED_MIME:
         raise ValueError(f"mime tidak didukung: {upload.content_type}")
+    if data is None: data = upload.file.read()
+    digest = hashlib.sha256(data).hexdigest()
+    f = _file_registry.acquire(digest, upload.content_type)
+    if f is None:
+        f = _upload_bytes(upload, data)
+        _file_registry.register(f, digest, upload.content_type, len(data))
+    elif info is not None:
+        info.update(bytesSent=0, reusedFile=f.name)
+    held = _request_uploads.get()
+    if held is not None:
+        held.append(f.name)
+    else:
+        _file_registry.release([f.name])     # di luar @track_uploads: tidak ada pemegang referensi
+    return f
+
+def _upload_bytes(upload: UploadFile, data: bytes):
     suffix = os.path.splitext(upload.filename or "")[1] or ".bin"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(upload.file.read())
+    with span("upload.spool", mime=upload.content_type), \
+         tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(data)
         tmp_path = tmp.name
+    t0 = time.perf_counter()
     try:
-        return genai.upload_file(path=tmp_path, mime_type=upload.content_type, display_name=upload.filename)
+        with span("gemini.upload_file", mime=upload.content_type, bytes=len(data)):
+            f = get_genai().upload_file(path=tmp_path, mime_type=upload.content_type, display_name=upload.filename)
+        M_UPLOAD.observe(upload.content_type, value=time.perf_counter() - t0)
+        M_UPLOAD_BYTES.inc(upload.content_type, amount=len(data))
+        return f
     finally:
         try: os.remove(tmp_path)
         except OSError: pass
 
-def wait_until_active(files: List[genai.types.File], timeout_sec=60, poll=1.5):
+@traced("gemini.wait_until_active")
+def wait_until_active(files: List[Any], timeout_sec=60, poll=1.5):
     def norm(st):  # enum -> "ACTIVE", string -> as-is
         try: return st.name
         except AttributeError: return str(st)
     states = {f.name: norm(getattr(f, "state", None)) for f in files}
     if all(s == "ACTIVE" for s in states.values()):
+        M_ACTIVE_WAIT.observe("active", value=0.0)
         return True, states
-    deadline = time.time() + timeout_sec
+    t0 = time.time()
+    deadline = t0 + timeout_sec
     while time.time() < deadline:
         states = {}
         all_active = True
         for f in files:
-            info = genai.get_file(f.name)
+            info = get_genai().get_file(f.name)
             st = norm(getattr(info, "state", None))
             states[info.name] = st
+            if st == "FAILED": _file_registry.mark_failed([info.name])
             if st != "ACTIVE": all_active = False
-        if all_active: return True, states
+        if all_active:
+            M_ACTIVE_WAIT.observe("active", value=time.time() - t0)
+            return True, states
         time.sleep(poll)
+    M_ACTIVE_WAIT.observe("timeout", value=time.time() - t0)
     return False, states
 
+# ====== Seleksi halaman PDF lokal (hemat byte upload & token input) ======
+# Bila topic_filter diisi, teks tiap halaman diekstrak lalu diberi skor BM25 terhadap topik. Hanya halaman
+# relevan (+ tetangganya) yang dikirim: sebagai PDF ringkas (PDF_SELECT_MODE=pdf) atau langsung sebagai
+# part teks tanpa upload (PDF_SELECT_MODE=text). Dokumen penuh tetap dipakai bila topik tidak cocok,
+# PDF tanpa teks (hasil scan), pypdf tidak terpasang, atau klien meminta full_document=true.
+PDF_PAGE_SELECT = os.getenv("PDF_PAGE_SELECT", "1") == "1"
+PDF_SELECT_MODE = os.getenv("PDF_SELECT_MODE", "pdf").strip().lower()      # pdf | text
+PDF_SELECT_MAX_PAGES = int(os.getenv("PDF_SELECT_MAX_PAGES", "12"))
+PDF_SELECT_NEIGHBORS = int(os.getenv("PDF_SELECT_NEIGHBORS", "1"))
+PDF_SELECT_MIN_PAGES = int(os.getenv("PDF_SELECT_MIN_PAGES", "4"))          # dokumen pendek dikirim utuh
+PDF_SELECT_MIN_REL = float(os.getenv("PDF_SELECT_MIN_REL", "0.35"))         # skor minimal relatif ke halaman terbaik
+
+M_PDF_PAGES = Counter("pdf_pages_total", "Halaman PDF masuk vs terkirim ke Gemini", ("kind",))
+
+_STOPWORDS = frozenset(
+    "dan yang di ke dari untuk dengan pada ini itu adalah atau dalam oleh sebagai juga tentang "
+    "the of and to in a an is are for on with by as about".split()
+)
+
+def _lex_tokens(text: str) -> List[str]:
+    return [t for t in re.findall(r"\w+", text.lower()) if (len(t) > 1 or t.isdigit()) and t not in _STOPWORDS]
+
+def score_pages(pages: List[str], query: str, k1: float = 1.2, b: float = 0.75) -> List[float]:
+    q = set(_lex_tokens(query))
+    if not q or not pages:
+        return [0.0] * len(pages)
+    tfs, lens, df = [], [], dict.fromkeys(q, 0)
+    for text in pages:
+        tf: Dict[str, int] = {}
+        toks = _lex_tokens(text)
+        for t in toks:
+            if t in q: tf[t] = tf.get(t, 0) + 1
+        for t in tf: df[t] += 1
+        tfs.append(tf); lens.append(len(toks))
+    n, avg = len(pages), (sum(lens) / len(pages)) or 1.0
+    idf = {t: math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5)) for t in q}
+    phrase = " ".join(query.lower().split())
+    scores = []
+    for text, tf, ln in zip(pages, tfs, lens):
+        s = sum(idf[t] * f * (k1 + 1) / (f + k1 * (1 - b + b * ln / avg)) for t, f in tf.items())
+        if len(phrase) > 3 and phrase in " ".join(text.lower().split()):
+            s += 2.0          # frasa utuh (mis. judul bab) jauh lebih kuat dari kata lepas
+        scores.append(s)
+    return scores
+
+def choose_pages(scores: List[float], max_pages: int = PDF_SELECT_MAX_PAGES, neighbors: int = PDF_SELECT_NEIGHBORS) -> List[int]:
+    best = max(scores, default=0.0)
+    if best <= 0:
+        return []
+    ranked = sorted((i for i, s in enumerate(scores) if s >= best * PDF_SELECT_MIN_REL), key=lambda i: -scores[i])
+    picked = set()
+    for i in ranked[:max_pages]:
+        picked.update(j for j in range(i - neighbors, i + neighbors + 1) if 0 <= j < len(scores))
+    return sorted(picked)
+
+@traced("pdf.select_pages")
+def prepare_material(upload: UploadFile, topic_filter: Optional[str], full_document: bool = False) -> dict:
+    # hasil: data (byte untuk diunggah) ATAU text (part teks, tanpa upload), plus info pelaporan
+    if upload.content_type not in ALLOWED_MIME:
+        raise ValueError(f"mime tidak didukung: {upload.content_type}")
+    data = upload.file.read()
+    info = {"file": upload.filename, "bytesIn": len(data), "bytesSent": len(data), "mode": "full"}
+    mat = {"upload": upload, "data": data, "text": None, "info": info}
+    if upload.content_type != "application/pdf":
+        return mat
+    if full_document or not topic_filter or not PDF_PAGE_SELECT:
+        info["reason"] = "requested" if full_document else "no_topic" if not topic_filter else "disabled"
+        return mat
+    try:
+        import pypdf
+    except ImportError:
+        info["reason"] = "pypdf_missing"
+        return mat
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        pages = [(p.extract_text() or "") for p in reader.pages]
+    except Exception:
+        info["reason"] = "unreadable"
+        return mat
+    info["pagesTotal"] = len(pages)
+    M_PDF_PAGES.inc("in", amount=len(pages))
+    if len(pages) < PDF_SELECT_MIN_PAGES:
+        info["reason"] = "short"
+    elif sum(len(p.strip()) for p in pages) < 50 * len(pages):
+        info["reason"] = "no_text"
+    else:
+        picked = choose_pages(score_pages(pages, topic_filter))
+        if not picked:
+            info["reason"] = "no_match"
+        elif len(picked) >= 0.8 * len(pages):
+            info["reason"] = "mostly_relevant"
+        else:
+            info["pages"] = [i + 1 for i in picked]
+            if PDF_SELECT_MODE == "text":
+                mat["data"] = None
+                mat["text"] = "\n\n".join(f"[{upload.filename} halaman {i + 1}]\n{pages[i].strip()}" for i in picked)
+                info.update(mode="text", bytesSent=0)
+            else:
+                w = pypdf.PdfWriter()
+                for i in picked: w.add_page(reader.pages[i])
+                buf = io.BytesIO(); w.write(buf)
+                mat["data"] = buf.getvalue()
+                info.update(mode="pages", bytesSent=len(mat["data"]))
+            M_PDF_PAGES.inc("sent", amount=len(picked))
+            return mat
+    M_PDF_PAGES.inc("sent", amount=len(pages))
+    return mat
+
+def send_materials(materials: List[dict]) -> Tuple[List[Any], List[Any]]:
+    # unggah yang perlu diunggah; kembalikan (file Gemini, parts untuk prompt)
+    uploaded = [upload_to_gemini(m["upload"], m["data"], m["info"]) for m in materials if m["text"] is None]
+    texts = [m["text"] for m in materials if m["text"] is not None]
+    return uploaded, texts
+
+def load_materials(files: List[UploadFile], topic_filter: Optional[str], full_document: bool = False):
+    # blocking (baca file, pypdf, upload): dari endpoint async dipanggil lewat run_in_threadpool
+    materials = [prepare_material(f, topic_filter, full_document) for f in files]
+    uploaded, text_parts = send_materials(materials)
+    return materials, uploaded, text_parts
+
+def usage_report(materials: List[dict], *resps) -> dict:
+    def total(attr):
+        vals = [getattr(getattr(r, "usage_metadata", None), attr, None) for r in resps]
+        vals = [v for v in vals if v is not None]
+        return sum(vals) if vals else None
+    return {
+        "bytesIn": sum(m["info"]["bytesIn"] for m in materials),
+        "bytesUploaded": sum(m["info"]["bytesSent"] for m in materials),
+        "inputTokens": total("prompt_token_count"),
+        "outputTokens": total("candidates_token_count"),
+        "files": [m["info"] for m in materials],
+    }
+
+# ====== Planner token & latensi (sebelum generate_content) ======
+# Token input dihitung dengan count_tokens atas parts yang sebenarnya (file + teks + prompt). Latensi
+# diperkirakan dari model linear per model Gemini: detik ≈ c0 + c1·token_in + c2·token_out, dipasang ulang
+# dari panggilan sukses terakhir (default konservatif selama sampel belum cukup). Bila perkiraan melewati
+# anggaran (PLAN_*_SEC atau sisa deadline), n / max_chars dipangkas; bila token input melewati
+# PLAN_MAX_INPUT_TOKENS, materi PDF diperkecil (halaman tersebar merata) lalu diunggah ulang.
+PLAN_ENABLED = os.getenv("PLAN_ENABLED", "1") == "1"
+PLAN_MAX_INPUT_TOKENS = int(os.getenv("PLAN_MAX_INPUT_TOKENS", "400000"))
+PLAN_MAX_OUTPUT_TOKENS = int(os.getenv("PLAN_MAX_OUTPUT_TOKENS", "8000"))
+PLAN_BUDGET_SEC = {"quiz": float(os.getenv("PLAN_QUIZ_SEC", "90")), "summary": float(os.getenv("PLAN_SUMMARY_SEC", "60"))}
+PLAN_TOKENS_PER_ITEM = int(os.getenv("PLAN_TOKENS_PER_ITEM", "110"))     # soal + opsi + penjelasan
+PLAN_CHARS_PER_TOKEN = 4.0
+PLAN_FILE_TOKENS_GUESS = 1000                                              # per file bila count_tokens gagal
+PLAN_MIN_SAMPLES = 20
+
+M_PLAN = Counter("planner_plans_total", "Rencana generate per jenis & aksi", ("kind", "action"))
+M_PLAN_ERROR = Histogram("planner_estimate_ratio", "Rasio aktual / perkiraan planner", ("kind", "quantity"),
+                         buckets=(0.25, 0.5, 0.67, 0.8, 0.9, 1.1, 1.25, 1.5, 2.0, 4.0))
+
+class _LatencyModel:
+    DEFAULT = (1.5, 1 / 8000, 1 / 80)     # detik dasar, detik/token input, detik/token output (~80 tok/s)
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._coef: Dict[str, Tuple[float, float, float]] = {}
+        self._window = window
+
+    def observe(self, model_name: str, tin: int, tout: int, sec: float) -> None:
+        with self._lock:
+            xs = self._samples.setdefault(model_name, deque(maxlen=self._window))
+            xs.append((tin, tout, sec))
+            if len(xs) >= PLAN_MIN_SAMPLES and len(xs) % 10 == 0:
+                coef = self._fit(list(xs))
+                if coef: self._coef[model_name] = coef
+
+    @staticmethod
+    def _fit(xs: List[Tuple[int, int, float]]) -> Optional[Tuple[float, float, float]]:
+        # least squares 3 variabel lewat persamaan normal; ditolak bila singular atau koefisien negatif
+        rows = [(1.0, float(a), float(b)) for a, b, _ in xs]
+        A = [[sum(r[i] * r[j] for r in rows) for j in range(3)] for i in range(3)]
+        y = [sum(r[i] * s for r, (_, _, s) in zip(rows, xs)) for i in range(3)]
+        for col in range(3):
+            piv = max(range(col, 3), key=lambda r: abs(A[r][col]))
+            if abs(A[piv][col]) < 1e-12:
+                return None
+            A[col], A[piv], y[col], y[piv] = A[piv], A[col], y[piv], y[col]
+            for r in range(3):
+                if r != col:
+                    f = A[r][col] / A[col][col]
+                    A[r] = [a - f * c for a, c in zip(A[r], A[col])]
+                    y[r] -= f * y[col]
+        coef = tuple(y[i] / A[i][i] for i in range(3))
+        return coef if all(c >= 0 for c in coef) and coef[2] > 0 else None
+
+    def coef(self, model_name: str) -> Tuple[float, float, float]:
+        with self._lock:
+            return self._coef.get(model_name, self.DEFAULT)
+
+    def estimate(self, model_name: str, tin: int, tout: int) -> float:
+        c0, c1, c2 = self.coef(model_name)
+        return c0 + c1 * tin + c2 * tout
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {m: {"samples": len(xs), "fitted": m in self._coef,
+                        "outTokPerSec": round(1 / self._coef.get(m, self.DEFAULT)[2], 1)}
+                    for m, xs in self._samples.items()}
+
+_latency_model = _LatencyModel()
+
+def file_parts(uploaded: List[Any]) -> List[dict]:
+    return [{"file_data": {"file_uri": f.uri, "mime_type": f.mime_type}} for f in uploaded]
+
+def count_tokens(m, parts: list) -> Tuple[int, str]:
+    # (jumlah token, sumber); jatuh ke perkiraan lokal bila count_tokens gagal / lambat
+    try:
+        with span("gemini.count_tokens", parts=len(parts)):
+            return int(m.count_tokens(parts, request_options={"timeout": budget(10)}).total_tokens), "count_tokens"
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        est = sum(len(p) / PLAN_CHARS_PER_TOKEN if isinstance(p, str) else PLAN_FILE_TOKENS_GUESS for p in parts)
+        return int(est), "estimate"
+
+def plan_generation(kind: str, m, parts: list, n: Optional[int] = None, max_chars: Optional[int] = None,
+                    include_explanation: bool = True, model_name: str = MODEL_NAME) -> dict:
+    per_item = PLAN_TOKENS_PER_ITEM if include_explanation else PLAN_TOKENS_PER_ITEM * 0.6
+
+    def out_tokens(n_, mc_):
+        return int((n_ or 0) * per_item + (mc_ or 0) / PLAN_CHARS_PER_TOKEN)
+
+    tin, source = count_tokens(m, parts)
+    budget_sec = PLAN_BUDGET_SEC.get(kind, PLAN_BUDGET_SEC["quiz"])
+    rem = remaining_time()
+    if rem is not None:
+        budget_sec = min(budget_sec, max(0.0, rem - 2.0))
+    plan = {"inputTokens": tin, "tokenSource": source, "budgetSec": round(budget_sec, 1),
+            "n": n, "maxChars": max_chars, "actions": []}
+    if tin > PLAN_MAX_INPUT_TOKENS:
+        plan["downscale"] = round(PLAN_MAX_INPUT_TOKENS / tin, 3)
+        plan["actions"].append(f"downscale:{plan['downscale']}")
+
+    c0, c1, c2 = _latency_model.coef(model_name)
+    tout = out_tokens(n, max_chars)
+    allowed = min(PLAN_MAX_OUTPUT_TOKENS, max(0.0, (budget_sec - c0 - c1 * min(tin, PLAN_MAX_INPUT_TOKENS)) / c2))
+    if tout > allowed and tout > 0:
+        scale = allowed / tout
+        if n:
+            plan["n"] = max(1, int(n * scale))
+            if plan["n"] < n: plan["actions"].append(f"n:{n}->{plan['n']}")
+        if max_chars:
+            plan["maxChars"] = max(200, int(max_chars * scale) // 50 * 50)
+            if plan["maxChars"] < max_chars: plan["actions"].append(f"max_chars:{max_chars}->{plan['maxChars']}")
+    plan["estOutputTokens"] = out_tokens(plan["n"], plan["maxChars"])
+    plan["estLatencySec"] = round(_latency_model.estimate(model_name, min(tin, PLAN_MAX_INPUT_TOKENS), plan["estOutputTokens"]), 2)
+    for a in plan["actions"] or ["none"]:
+        M_PLAN.inc(kind, a.split(":")[0])
+    return plan
+
+def downscale_materials(materials: List[dict], ratio: float) -> bool:
+    # perkecil materi agar token input muat: PDF -> subset halaman tersebar merata, teks -> dipotong
+    changed = False
+    for mat in materials:
+        if mat["text"] is not None:
+            keep = max(1000, int(len(mat["text"]) * ratio))
+            if keep < len(mat["text"]):
+                mat["text"] = mat["text"][:keep]
+                mat["info"]["downscaled"] = round(ratio, 3)
+                changed = True
+            continue
+        if mat["upload"].content_type != "application/pdf":
+            continue
+        try:
+            import pypdf
+            reader = pypdf.PdfReader(io.BytesIO(mat["data"]))
+        except Exception:
+            continue
+        total = len(reader.pages)
+        keep = max(1, int(total * ratio))
+        if keep >= total:
+            continue
+        w = pypdf.PdfWriter()
+        for i in sorted({int(k * total / keep) for k in range(keep)}):
+            w.add_page(reader.pages[i])
+        buf = io.BytesIO(); w.write(buf)
+        mat["data"] = buf.getvalue()
+        mat["info"].update(bytesSent=len(mat["data"]), downscaled=round(keep / total, 3), pagesKept=keep)
+        changed = True
+    return changed
+
+class FilesNotActive(Exception):
+    def __init__(self, states: dict):
+        super().__init__("file belum ACTIVE di Gemini")
+        self.states = states
+
+@app.exception_handler(FilesNotActive)
+async def _files_not_active_handler(request, exc: FilesNotActive):
+    return JSONResponse({"error": str(exc), "states": exc.states}, status_code=503)
+
+async def plan_materials(kind: str, materials: List[dict], uploaded: List[Any], text_parts: List[Any], prompt: str,
+                         n: Optional[int] = None, max_chars: Optional[int] = None,
+                         include_explanation: bool = True, task: Optional[str] = None) -> Tuple[List[Any], List[Any], Optional[dict]]:
+    # -> (uploaded, text_parts, plan); materi diunggah ulang bila planner meminta downscale
+    if not PLAN_ENABLED:
+        return uploaded, text_parts, None
+    m, model_name = model_for(task or kind)
+    plan = await run_in_threadpool(plan_generation, kind, m, file_parts(uploaded) + text_parts + [prompt],
+                                   n, max_chars, include_explanation, model_name)
+    if plan.get("downscale") and await run_in_threadpool(downscale_materials, materials, plan["downscale"]):
+        # upload & polling ACTIVE blocking: jangan di event loop
+        uploaded, text_parts = await run_in_threadpool(send_materials, materials)
+        ok, states = await run_in_threadpool(wait_until_active, uploaded, timeout_sec=budget(60))
+        if not ok:
+            raise FilesNotActive(states)
+        first = plan
+        plan = await run_in_threadpool(plan_generation, kind, m, file_parts(uploaded) + text_parts + [prompt],
+                                       n, max_chars, include_explanation, model_name)
+        plan["actions"] = [a for a in first["actions"] if a.startswith("downscale")] + \
+                          [a for a in plan["actions"] if not a.startswith("downscale")]
+        plan["inputTokensBefore"] = first["inputTokens"]
+        plan["downscale"] = first["downscale"]      # rasio yang benar-benar diterapkan; re-plan tidak memangkas lagi
+    return uploaded, text_parts, plan
+
+def plan_record(kind: str, plan: Optional[dict], elapsed: float, *resps) -> None:
+    # bandingkan perkiraan dengan aktual; hasilnya ikut di meta.plan.actual & histogram akurasi
+    if not plan:
+        return
+    usage = [getattr(r, "usage_metadata", None) for r in resps]
+    tin = sum(getattr(u, "prompt_token_count", 0) or 0 for u in usage if u is not None)
+    tout = sum(getattr(u, "candidates_token_count", 0) or 0 for u in usage if u is not None)
+    plan["actual"] = {"latencySec": round(elapsed, 2), "inputTokens": tin or None, "outputTokens": tout or None}
+    if plan.get("estLatencySec"):
+        M_PLAN_ERROR.observe(kind, "latency", value=elapsed / plan["estLatencySec"])
+    if tin and plan.get("inputTokens") and len(resps) == 1:
+        M_PLAN_ERROR.observe(kind, "input_tokens", value=tin / plan["inputTokens"])
+    if tout and plan.get("estOutputTokens"):
+        M_PLAN_ERROR.observe(kind, "output_tokens", value=tout / plan["estOutputTokens"])
+
 # ====== Local store helpers ======
 def _now_iso():
     return datetime.utcnow().isoformat(timespec="seconds") + "Z"
 
+@traced("store.atomic_write")
 def _atomic_write(path: Path, obj: dict):
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + ".tmp")
@@ -142,26 +1446,211 @@ def _read_json(path: Path) -> Optional[dict]:
     if not path.exists(): return None
     return json.loads(path.read_text(encoding="utf-8"))
 
-def save_quiz_local(items: list, meta: dict) -> str:
+# ====== Indeks sekunder (ditulis saat simpan) ======
+# Tiap dokumen yang disimpan menambahkan record lebar-tetap "<created_at> <_id>\n" ke file indeks per
+# kunci: semua dokumen, per quiz_id / challengeId, per pemain, per tipe / bahasa. Record bertambah urut
+# waktu, jadi halaman terbaru-dulu = satu seek dari posisi cursor dan since/until = binary search:
+# biaya query bergantung pada ukuran halaman, bukan jumlah dokumen. Dokumen lama: python main.py reindex.
+INDEX_DIR = DATA_DIR / "index"
+_IDX_REC = 34          # 20 (created_at) + spasi + 12 (_id) + newline
+_index_lock = threading.Lock()
+
+def _index_keys(coll: str, doc: dict) -> List[Tuple[str, Optional[str]]]:
+    player = (doc.get("player") or {}).get("name") or doc.get("player_name")
+    keys = {
+        "quizzes": [("language", (doc.get("meta") or {}).get("language")), ("source", (doc.get("meta") or {}).get("source"))],
+        "attempts": [("quiz_id", doc.get("quiz_id")), ("player", player)],
+        "challenges": [("type", doc.get("type")), ("player", player)],
+        "submissions": [("challengeId", doc.get("challengeId")), ("type", doc.get("type")), ("player", player)],
+    }[coll]
+    return [("all", None)] + [(f, str(v)) for f, v in keys if v]
+
+def _index_path(coll: str, field: str, value: Optional[str] = None) -> Path:
+    if field == "all":
+        return INDEX_DIR / coll / "all.idx"
+    h = hashlib.sha1(value.strip().lower().encode("utf-8")).hexdigest()[:16]
+    return INDEX_DIR / coll / f"{field}-{h}.idx"
+
+def index_doc(coll: str, doc: dict) -> None:
+    rec = f"{doc['created_at']} {doc['_id']}\n".encode("ascii")
+    if len(rec) != _IDX_REC:
+        return
+    with _index_lock:
+        for field, value in _index_keys(coll, doc):
+            p = _index_path(coll, field, value)
+            p.parent.mkdir(parents=True, exist_ok=True)
+            # satu write() kecil dengan O_APPEND: aman juga dari proses batch paralel
+            with open(p, "ab") as fh:
+                fh.write(rec)
+
+def _idx_ts(fh, i: int) -> str:
+    fh.seek(i * _IDX_REC)
+    return fh.read(20).decode("ascii")
+
+def _idx_bisect(fh, n: int, ts: str, right: bool = False) -> int:
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        v = _idx_ts(fh, mid)
+        if v < ts or (right and v == ts): lo = mid + 1
+        else: hi = mid
+    return lo
+
+def query_index(coll: str, field: str, value: Optional[str], since: Optional[str], until: Optional[str],
+                limit: int, cursor: Optional[int], match=None, scan_max: int = 1000) -> Tuple[List[str], Optional[int]]:
+    # -> (id terbaru-dulu, cursor berikut); match(id) menyaring filter yang tidak punya indeks sendiri
+    p = _index_path(coll, field, value)
+    if not p.exists():
+        return [], None
+    with open(p, "rb") as fh:
+        n = p.stat().st_size // _IDX_REC
+        lo = _idx_bisect(fh, n, since) if since else 0
+        hi = _idx_bisect(fh, n, until, right=True) if until else n
+        if cursor is not None:
+            hi = min(hi, cursor)
+        out, scanned = [], 0
+        while hi > lo and len(out) < limit and scanned < scan_max:
+            start = max(lo, hi - max(limit - len(out), 16))
+            fh.seek(start * _IDX_REC)
+            recs = fh.read((hi - start) * _IDX_REC).decode("ascii").splitlines()
+            for i in range(len(recs) - 1, -1, -1):
+                hi, scanned = start + i, scanned + 1
+                did = recs[i][21:]
+                if match is None or match(did):
+                    out.append(did)
+                    if len(out) >= limit: break
+    return out, (hi if hi > lo else None)
+
+def reindex_all() -> Dict[str, int]:
+    # bangun ulang seluruh indeks dari dokumen (urut created_at); jalankan saat server berhenti
+    import shutil
+    shutil.rmtree(INDEX_DIR, ignore_errors=True)
+    counts = {}
+    for coll, d in (("quizzes", QUIZ_DIR), ("attempts", ATTEMPT_DIR), ("challenges", CHALLENGE_DIR), ("submissions", SUBMISSION_DIR)):
+        docs = [_read_json(f) for f in d.glob("*.json")] if d.exists() else []
+        docs = sorted((x for x in docs if x and x.get("created_at") and x.get("_id")), key=lambda x: x["created_at"])
+        for doc in docs:
+            index_doc(coll, doc)
+        counts[coll] = len(docs)
+    return counts
+
+# ====== Representasi siap-saji untuk GET (ETag + kompresi) ======
+# Body JSON untuk GET /quiz/{id} dan /v1/challenges/{id} dibuat sekali saat dokumen disimpan, bersama varian
+# gzip (dan brotli bila paket `brotli` terpasang) serta ETag kuat = sha256 body, disimpan di samping dokumen.
+# GET hanya membaca byte jadi: If-None-Match cocok -> 304 tanpa membaca body; Accept-Encoding memilih
+# varian. Dokumen yang disimpan sebelum fitur ini dirender saat pertama kali dibaca.
+RENDER_DIR = DATA_DIR / "rendered"
+RENDER_MIN_COMPRESS = int(os.getenv("RENDER_MIN_COMPRESS", "1024"))     # body kecil tidak dikompres
+RENDER_BROTLI_QUALITY = int(os.getenv("RENDER_BROTLI_QUALITY", "9"))
+DOC_CACHE_CONTROL = os.getenv("DOC_CACHE_CONTROL", "public, max-age=3600")
+_DOC_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+def _atomic_write_bytes(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+@traced("store.render")
+def render_doc(coll: str, did: str, payload: dict) -> str:
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    base = RENDER_DIR / coll / f"{did}.json"
+    _atomic_write_bytes(base, body)
+    if len(body) >= RENDER_MIN_COMPRESS:
+        _atomic_write_bytes(base.with_suffix(".json.gz"), gzip.compress(body, compresslevel=9, mtime=0))
+        br = _brotli()
+        if br is not None:
+            _atomic_write_bytes(base.with_suffix(".json.br"), br.compress(body, quality=RENDER_BROTLI_QUALITY))
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    _atomic_write_bytes(base.with_suffix(".etag"), etag.encode("ascii"))   # terakhir: penanda render lengkap
+    return etag
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    # perbandingan lemah (RFC 9110 If-None-Match); tag varian "-gz"/"-br" mewakili isi yang sama
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag[2:] if tag.startswith("W/") else tag
+        tag = tag.strip('"')
+        if tag.split("-")[0] == etag:
+            return True
+    return False
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try: q = float(params.strip()[2:])
+            except ValueError: q = 0.0
+        if name: out[name.strip().lower()] = q
+    return out
+
+def serve_doc(request: Request, coll: str, did: str, build):
+    # build(did) -> payload dict atau None (tidak ada); payload dengan "stale" tidak disimpan/di-cache
+    if not _DOC_ID_RE.fullmatch(did):
+        return JSONResponse({"error": "id tidak valid"}, status_code=400)
+    base = RENDER_DIR / coll / f"{did}.json"
+    etag_path = base.with_suffix(".etag")
+    if not etag_path.exists():
+        payload = build(did)
+        if payload is None:
+            return JSONResponse({"error": "dokumen tidak ditemukan"}, status_code=404)
+        if payload.get("stale"):
+            return JSONResponse(payload, headers={"Cache-Control": "no-store"})
+        render_doc(coll, did, payload)
+    etag = etag_path.read_text(encoding="ascii").strip()
+    headers = {"Cache-Control": DOC_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={**headers, "ETag": f'"{etag}"'})
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    for enc, ext in _ENCODINGS:
+        q = accepted.get(enc, accepted.get("*", 0.0))
+        path = base.with_suffix(f".json{ext}")
+        if q > 0 and path.exists():
+            headers.update({"Content-Encoding": enc, "ETag": f'"{etag}-{ext[1:]}"'})
+            return Response(path.read_bytes(), media_type="application/json", headers=headers)
+    return Response(base.read_bytes(), media_type="application/json", headers={**headers, "ETag": f'"{etag}"'})
+
+def save_quiz_local(items: list, meta: dict, model: str = MODEL_NAME) -> str:
     qid = uuid.uuid4().hex[:12]
     doc = {
         "_id": qid,
         "created_at": _now_iso(),
-        "model": MODEL_NAME,
+        "model": model,
         "items": items,
         "meta": meta,
     }
     _atomic_write(QUIZ_DIR / f"{qid}.json", doc)
+    index_doc("quizzes", doc)
+    render_doc("quizzes", qid, quiz_view(doc))
     return qid
 
 def load_quiz_local(qid: str) -> Optional[dict]:
     return _read_json(QUIZ_DIR / f"{qid}.json")
 
+def quiz_view(doc: dict) -> dict:
+    return {"quiz_id": doc["_id"], "created_at": doc["created_at"], "model": doc.get("model"),
+            "items": doc.get("items") or [], "meta": doc.get("meta") or {}}
+
 def save_attempt_local(attempt: dict) -> str:
     aid = uuid.uuid4().hex[:12]
     attempt["_id"] = aid
     attempt["created_at"] = _now_iso()
     _atomic_write(ATTEMPT_DIR / f"{aid}.json", attempt)
+    index_doc("attempts", attempt)
     return aid
 
 # ====== scoring helpers ======
@@ -169,6 +1658,51 @@ def letter_to_index(letter: str) -> int:
     k = (letter or "A").strip().upper()
     return 1 if k == "B" else 2 if k == "C" else 3 if k == "D" else 0
 
+def score_attempt(items: list, answers: list, max_time_sec: int) -> Tuple[dict, int, list]:
+    by_id = {str(it.get("id", "")): it for it in items}
+
+    total_score = 0
+    correct_count = 0
+    wrong_count = 0
+    duration = 0
+
+    answers_out = []
+    for ans in answers:
+        q = by_id.get(ans.question_id)
+        if not q:
+            continue
+        orig_correct = letter_to_index(q.get("jawaban", "A"))
+
+        # jika ada "order" (urutan opsi tampil -> indeks asli), map
+        if ans.order and len(ans.order) == 4:
+            try:
+                correct_display_index = ans.order.index(orig_correct)
+            except ValueError:
+                correct_display_index = orig_correct
+        else:
+            correct_display_index = orig_correct
+
+        is_correct = (ans.chosen_index == correct_display_index)
+        if is_correct:
+            base = 700
+            bonus = max(0, int(round((max_time_sec - ans.time_sec) / max_time_sec * 300)))
+            total_score += base + bonus
+            correct_count += 1
+        else:
+            wrong_count += 1
+
+        duration += max(0, int(ans.time_sec))
+        answers_out.append({
+            "question_id": ans.question_id,
+            "chosen_index": ans.chosen_index,
+            "correct_index": correct_display_index,
+            "order": ans.order,
+            "time_sec": ans.time_sec,
+            "is_correct": is_correct,
+        })
+
+    return {"total": total_score, "correct": correct_count, "wrong": wrong_count}, duration, answers_out
+
 # ====== Pydantic for attempts ======
 class AnswerIn(BaseModel):
     question_id: str
@@ -184,9 +1718,15 @@ class AttemptIn(BaseModel):
 
 # ====== Endpoints ======
 @app.get("/health")
-def health(): return {"status":"ok","model":MODEL_NAME, "storage":"local-files"}
+def health(): return {"status":"ok","model":MODEL_NAME, "backend": GEMINI_BACKEND, "localOnly": LOCAL_ONLY,
+                   "importSec": round(IMPORT_SECONDS, 4), "storage":"local-files", "llm_shared": llm_shared_stats(),
+                   "gemini_scheduler": _gemini_scheduler.stats(), "circuit": circuit_stats(),
+                   "planner": _latency_model.stats(), "routes": {k: r["model"] for k, r in MODEL_ROUTES.items()},
+                   "files": _file_registry.stats(), "rooms": rooms_stats()}
 
 @app.post("/quiz/from-files")
+@with_deadline("quiz")
+@track_uploads
 async def quiz_from_files(
     files: List[UploadFile] = File(...),
     n: int = 10,
@@ -194,36 +1734,186 @@ async def quiz_from_files(
     include_explanation: bool = True,
     topic_filter: Optional[str] = Form(None),
     output_language: str = "id",
+    full_document: bool = False,
 ):
     if not files:
         return JSONResponse({"error": "unggah minimal satu file"}, status_code=400)
     try:
-        uploaded = [upload_to_gemini(f) for f in files]
+        materials, uploaded, text_parts = await run_in_threadpool(load_materials, files, topic_filter, full_document)
     except ValueError as e:
         return JSONResponse({"error": str(e)}, status_code=400)
 
-    ok, states = wait_until_active(uploaded)
+    ok, states = await run_in_threadpool(wait_until_active, uploaded, timeout_sec=budget(60))
     if not ok:
         return JSONResponse({"error": "file belum ACTIVE di Gemini", "states": states}, status_code=503)
 
-    file_parts = [{"file_data": {"file_uri": f.uri, "mime_type": f.mime_type}} for f in uploaded]
     text_part = "\n\n".join([QUIZ_SYSTEM_PROMPT, build_user_prompt(n, difficulty, include_explanation, topic_filter, output_language)])
-
-    resp = model.generate_content(file_parts + [text_part], request_options={"timeout": 180})
+    uploaded, text_parts, plan = await plan_materials("quiz", materials, uploaded, text_parts, text_part,
+                                                      n=n, include_explanation=include_explanation)
+    if plan and plan["n"] != n:
+        text_part = "\n\n".join([QUIZ_SYSTEM_PROMPT, build_user_prompt(plan["n"], difficulty, include_explanation, topic_filter, output_language)])
+
+    m, model_name = model_for("quiz")
+    t0 = time.perf_counter()
+    resp = await run_in_threadpool(gemini_generate, m, file_parts(uploaded) + text_parts + [text_part], "standard", model_name,
+                                   request_options={"timeout": budget(180)})
+    plan_record("quiz", plan, time.perf_counter() - t0, resp)
     items = parse_json_or_fallback(resp.text)
     for i, it in enumerate(items, 1):
         it.setdefault("id", f"q{i}")
         if "opsi" in it and isinstance(it["opsi"], list):
             it["opsi"] = (it["opsi"] + ["", "", "", ""])[:4]
 
+    usage = usage_report(materials, resp)
     quiz_id = save_quiz_local(items, {
         "source":"files", "file_count": len(files), "difficulty": difficulty, "n": n,
-        "language": output_language, "include_explanation": include_explanation, "topic_filter": topic_filter
-    })
+        "language": output_language, "include_explanation": include_explanation, "topic_filter": topic_filter,
+        "usage": usage, "plan": plan,
+    }, model_name)
+
+    return {"quiz_id": quiz_id, "items": items, "meta": {"model": model_name, "usage": usage, "plan": plan}}
+
+# ====== Quiz dari teks panjang: map-reduce per chunk ======
+# Teks dipecah di batas struktural (heading, paragraf, kalimat), kuota n soal dibagi proporsional
+# terhadap ukuran chunk, lalu chunk dikirim paralel (dibatasi semaphore) sehingga latensi total
+# ditentukan chunk paling lambat. Hasil digabung, soal yang nyaris sama dibuang, id dinomori ulang.
+QUIZ_CHUNK_CHARS = int(os.getenv("QUIZ_CHUNK_CHARS", "24000"))
+QUIZ_CHUNK_CONCURRENCY = int(os.getenv("QUIZ_CHUNK_CONCURRENCY", "4"))
+QUIZ_TEXT_MAX_CHARS = int(os.getenv("QUIZ_TEXT_MAX_CHARS", "2000000"))
+QUIZ_DEDUP_JACCARD = float(os.getenv("QUIZ_DEDUP_JACCARD", "0.8"))
+
+_HEADING_RE = re.compile(r"^(#{1,6}\s|bab\s+\w+|chapter\s+\w+|bagian\s+\w+|\d+(\.\d+)*\.?\s+[A-Z])", re.I)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+def _split_blocks(text: str) -> List[str]:
+    # blok = paragraf; heading selalu memulai blok baru agar chunk tidak memotong di tengah bab
+    blocks, cur = [], []
+    for line in text.splitlines():
+        if not line.strip() or _HEADING_RE.match(line.strip()):
+            if cur: blocks.append("\n".join(cur)); cur = []
+            if line.strip(): cur.append(line)
+            continue
+        cur.append(line)
+    if cur: blocks.append("\n".join(cur))
+    return blocks
+
+def _split_oversized(block: str, limit: int) -> List[str]:
+    if len(block) <= limit: return [block]
+    out, cur = [], ""
+    for sent in _SENTENCE_RE.split(block):
+        while len(sent) > limit:               # kalimat raksasa (mis. tabel hasil OCR): potong keras
+            if cur: out.append(cur); cur = ""
+            out.append(sent[:limit]); sent = sent[limit:]
+        if cur and len(cur) + 1 + len(sent) > limit:
+            out.append(cur); cur = sent
+        else:
+            cur = f"{cur} {sent}" if cur else sent
+    if cur: out.append(cur)
+    return out
 
-    return {"quiz_id": quiz_id, "items": items, "meta": {"model": MODEL_NAME}}
+def split_text_chunks(text: str, limit: int) -> List[str]:
+    chunks, cur, size = [], [], 0
+    for block in _split_blocks(text):
+        for piece in _split_oversized(block, limit):
+            if cur and size + len(piece) + 2 > limit:
+                chunks.append("\n\n".join(cur)); cur, size = [], 0
+            cur.append(piece); size += len(piece) + 2
+    if cur: chunks.append("\n\n".join(cur))
+    return chunks or [text]
+
+def allocate_questions(sizes: List[int], n: int) -> List[int]:
+    # largest remainder: total tepat n, proporsional terhadap ukuran chunk
+    total = sum(sizes) or 1
+    raw = [n * s / total for s in sizes]
+    quota = [int(x) for x in raw]
+    for i in sorted(range(len(sizes)), key=lambda i: raw[i] - quota[i], reverse=True)[: n - sum(quota)]:
+        quota[i] += 1
+    return quota
+
+def fold_empty_chunks(chunks: List[str], quotas: List[int]) -> Tuple[List[str], List[int]]:
+    # chunk tanpa kuota digabung ke tetangganya agar isinya tetap terbaca model
+    out_c, out_q = [], []
+    for c, q in zip(chunks, quotas):
+        if out_c and (q == 0 or out_q[-1] == 0):
+            out_c[-1] += "\n\n" + c; out_q[-1] += q
+        else:
+            out_c.append(c); out_q.append(q)
+    return out_c, out_q
+
+def _question_tokens(it: dict) -> frozenset:
+    q = str(it.get("pertanyaan", "")).lower()
+    return frozenset(re.findall(r"\w+", q))
+
+def dedupe_questions(items: List[dict], threshold: float = QUIZ_DEDUP_JACCARD) -> List[dict]:
+    kept, seen = [], []
+    for it in items:
+        toks = _question_tokens(it)
+        if not toks: continue
+        dup = False
+        for other in seen:
+            inter = len(toks & other)
+            if inter and inter / len(toks | other) >= threshold:
+                dup = True; break
+        if not dup:
+            kept.append(it); seen.append(toks)
+    return kept
+
+async def _generate_quiz_chunks(chunks: List[str], quotas: List[int], difficulty: str, include_explanation: bool,
+                                topic_filter: Optional[str], output_language: str) -> Tuple[List[List[dict]], int]:
+    sem = asyncio.Semaphore(QUIZ_CHUNK_CONCURRENCY)
+    # minta sedikit lebih banyak per chunk (bila >1 chunk) sebagai cadangan setelah dedupe
+    extra = [0 if len(chunks) == 1 else max(1, q // 5) for q in quotas]
+
+    async def one(i: int) -> Optional[List[dict]]:
+        prompt = "\n\n".join([
+            QUIZ_SYSTEM_PROMPT,
+            f"Materi (bagian {i + 1}/{len(chunks)}):\n{chunks[i]}",
+            build_user_prompt(quotas[i] + extra[i], difficulty, include_explanation, topic_filter, output_language),
+        ])
+        async with sem:
+            with span("quiz.chunk", index=i, chars=len(chunks[i]), n=quotas[i]):
+                m, model_name = model_for("quiz")
+                resp = await run_in_threadpool(gemini_generate, m, [prompt], "standard", model_name,
+                                               request_options={"timeout": budget(180)})
+        return parse_quiz_items(resp.text)
+
+    jobs = [i for i, q in enumerate(quotas) if q > 0]
+    results = await asyncio.gather(*(one(i) for i in jobs), return_exceptions=True)
+    per_chunk: List[List[dict]] = [[] for _ in chunks]
+    failed, first_exc = 0, None
+    for i, r in zip(jobs, results):
+        if isinstance(r, BaseException) or r is None:
+            failed += 1
+            if isinstance(r, BaseException) and first_exc is None: first_exc = r
+            continue
+        per_chunk[i] = r
+    if failed == len(jobs) and first_exc is not None:
+        raise first_exc          # semua chunk gagal: biarkan handler deadline/saturasi yang menjawab
+    return per_chunk, failed
+
+def merge_quiz_chunks(per_chunk: List[List[dict]], quotas: List[int], n: int) -> List[dict]:
+    # dedupe global dengan urutan dokumen, lalu ambil kuota tiap chunk dulu, sisa slot diisi cadangan
+    tagged = [dict(it, _chunk=i) for i, items in enumerate(per_chunk) for it in items]
+    unique = dedupe_questions(tagged)
+    taken, spare, used = [], [], [0] * len(per_chunk)
+    for it in unique:
+        c = it["_chunk"]
+        if used[c] < quotas[c]:
+            taken.append(it); used[c] += 1
+        else:
+            spare.append(it)
+    taken += spare[: max(0, n - len(taken))]
+    order = {id(it): k for k, it in enumerate(unique)}
+    taken.sort(key=lambda it: order[id(it)])
+    out = []
+    for i, it in enumerate(taken[:n], 1):
+        it.pop("_chunk", None)
+        it["id"] = f"q{i}"
+        out.append(it)
+    return out
 
 @app.post("/quiz/from-text")
+@with_deadline("quiz")
 async def quiz_from_text(
     text: str = Form(...),
     n: int = 10,
@@ -232,24 +1922,30 @@ async def quiz_from_text(
     topic_filter: Optional[str] = Form(None),
     output_language: str = "id",
 ):
-    prompt = "\n\n".join([
-        QUIZ_SYSTEM_PROMPT,
-        f"Materi:\n{text[:120000]}",
-        build_user_prompt(n, difficulty, include_explanation, topic_filter, output_language),
-    ])
-    resp = model.generate_content([prompt])
-    items = parse_json_or_fallback(resp.text)
-    for i, it in enumerate(items, 1):
-        it.setdefault("id", f"q{i}")
+    if len(text) > QUIZ_TEXT_MAX_CHARS:
+        return JSONResponse({"error": f"teks terlalu panjang (maks {QUIZ_TEXT_MAX_CHARS} karakter)"}, status_code=413)
+    if n < 1:
+        return JSONResponse({"error": "n minimal 1"}, status_code=400)
+
+    # chunk tidak lebih kecil dari len/n, supaya setiap chunk kebagian minimal satu soal
+    limit = max(QUIZ_CHUNK_CHARS, -(-len(text) // n))
+    chunks = split_text_chunks(text, limit)
+    chunks, quotas = fold_empty_chunks(chunks, allocate_questions([len(c) for c in chunks], n))
+    per_chunk, failed = await _generate_quiz_chunks(chunks, quotas, difficulty, include_explanation, topic_filter, output_language)
+    items = merge_quiz_chunks(per_chunk, quotas, n)
+    if not items:
+        items = parse_json_or_fallback("")
+    for it in items:
         if "opsi" in it and isinstance(it["opsi"], list):
             it["opsi"] = (it["opsi"] + ["", "", "", ""])[:4]
 
     quiz_id = save_quiz_local(items, {
         "source":"text", "chars": len(text), "difficulty": difficulty, "n": n,
-        "language": output_language, "include_explanation": include_explanation, "topic_filter": topic_filter
-    })
+        "language": output_language, "include_explanation": include_explanation, "topic_filter": topic_filter,
+        "chunks": len(chunks), "chunks_failed": failed,
+    }, route_for("quiz")["model"])
 
-    return {"quiz_id": quiz_id, "items": items, "meta": {"model": MODEL_NAME}}
+    return {"quiz_id": quiz_id, "items": items, "meta": {"model": route_for("quiz")["model"], "chunks": len(chunks), "chunks_failed": failed}}
 
 @app.post("/quiz/attempts")
 async def save_attempt(payload: AttemptIn):
@@ -259,52 +1955,12 @@ async def save_attempt(payload: AttemptIn):
         return JSONResponse({"error":"quiz_id tidak ditemukan"}, status_code=404)
 
     items = quiz.get("items", [])
-    by_id = {str(it.get("id", "")): it for it in items}
-
-    total_score = 0
-    correct_count = 0
-    wrong_count = 0
-    duration = 0
-
-    answers_out = []
-    for ans in payload.answers:
-        q = by_id.get(ans.question_id)
-        if not q:
-            continue
-        orig_correct = letter_to_index(q.get("jawaban", "A"))
-
-        # jika ada "order" (urutan opsi tampil -> indeks asli), map
-        if ans.order and len(ans.order) == 4:
-            try:
-                correct_display_index = ans.order.index(orig_correct)
-            except ValueError:
-                correct_display_index = orig_correct
-        else:
-            correct_display_index = orig_correct
-
-        is_correct = (ans.chosen_index == correct_display_index)
-        if is_correct:
-            base = 700
-            bonus = max(0, int(round((payload.max_time_sec - ans.time_sec) / payload.max_time_sec * 300)))
-            total_score += base + bonus
-            correct_count += 1
-        else:
-            wrong_count += 1
-
-        duration += max(0, int(ans.time_sec))
-        answers_out.append({
-            "question_id": ans.question_id,
-            "chosen_index": ans.chosen_index,
-            "correct_index": correct_display_index,
-            "order": ans.order,
-            "time_sec": ans.time_sec,
-            "is_correct": is_correct,
-        })
+    score, duration, answers_out = score_attempt(items, payload.answers, payload.max_time_sec)
 
     attempt_doc = {
         "quiz_id": payload.quiz_id,
         "player": {"name": payload.player_name} if payload.player_name else {},
-        "score": {"total": total_score, "correct": correct_count, "wrong": wrong_count},
+        "score": score,
         "duration_sec": duration,
         "max_time_sec": payload.max_time_sec,
         "answers": answers_out,
@@ -313,6 +1969,8 @@ async def save_attempt(payload: AttemptIn):
     }
 
     attempt_id = save_attempt_local(attempt_doc)
+    level = _level((quiz.get("meta") or {}).get("difficulty"), "medium")
+    record_skill(payload.player_name, "quiz", [("mcq", level, a["is_correct"]) for a in answers_out])
     return {
         "attempt_id": attempt_id,
         "quiz_id": payload.quiz_id,
@@ -357,38 +2015,53 @@ def build_summary_prompt(output_language: str, max_chars: int, fmt: str):
         f"max_chars: {max_chars}."
     ])
 
+@traced("parse.summary")
 def parse_summary_response(text: str) -> str:
     try:
         data = json.loads(text)
         if isinstance(data, dict) and "summary" in data:
+            M_PARSE.inc("summary", "ok")
             return str(data["summary"])
         if isinstance(data, list):
+            M_PARSE.inc("summary", "ok")
             return "\n\n".join(str(it.get("summary","")) for it in data if isinstance(it, dict))
     except Exception:
         pass
+    M_PARSE.inc("summary", "fallback")
     return text
 
 @app.post("/summary/from-files")
+@with_deadline("summary")
+@track_uploads
 async def summary_from_files(
     files: List[UploadFile] = File(..., description="PDF / JPG / PNG / WEBP"),
     output_language: str = "id",
     max_chars: int = 1000,
     format: str = "markdown",  # "markdown" | "plain"
+    topic_filter: Optional[str] = Form(None),
+    full_document: bool = False,
 ):
     if not files:
         return JSONResponse({"error": "unggah minimal satu file"}, status_code=400)
     try:
-        uploaded = [upload_to_gemini(f) for f in files]
+        materials, uploaded, text_parts = await run_in_threadpool(load_materials, files, topic_filter, full_document)
     except ValueError as e:
         return JSONResponse({"error": str(e)}, status_code=400)
 
-    ok, states = wait_until_active(uploaded)
+    ok, states = await run_in_threadpool(wait_until_active, uploaded, timeout_sec=budget(60))
     if not ok:
         return JSONResponse({"error": "file belum ACTIVE di Gemini", "states": states}, status_code=503)
 
-    prompt = build_summary_prompt(output_language, max_chars, format)
-    file_parts = [{"file_data": {"file_uri": f.uri, "mime_type": f.mime_type}} for f in uploaded]
-    resp = model.generate_content(file_parts + [prompt], request_options={"timeout": 180})
+    focus = f"\n\nFokus ringkasan pada topik: {topic_filter}." if topic_filter else ""
+    prompt = build_summary_prompt(output_language, max_chars, format) + focus
+    uploaded, text_parts, plan = await plan_materials("summary", materials, uploaded, text_parts, prompt, max_chars=max_chars)
+    if plan and plan["maxChars"] != max_chars:
+        prompt = build_summary_prompt(output_language, plan["maxChars"], format) + focus
+    m, model_name = model_for("summary")
+    t0 = time.perf_counter()
+    resp = await run_in_threadpool(gemini_generate, m, file_parts(uploaded) + text_parts + [prompt], "standard", model_name,
+                                   request_options={"timeout": budget(180)})
+    plan_record("summary", plan, time.perf_counter() - t0, resp)
 
     summary = parse_summary_response(resp.text).strip()
     if format == "markdown":
@@ -401,10 +2074,12 @@ async def summary_from_files(
     return {
         "summary": summary,
         "format": format,
-        "meta": {"model": MODEL_NAME, "file_count": len(files), "language": output_language}
+        "meta": {"model": model_name, "file_count": len(files), "language": output_language,
+                 "usage": usage_report(materials, resp), "plan": plan}
     }
 
 @app.post("/chat/completion")
+@with_deadline("chat")
 async def chat_completion(
     text: str = Form(...),
     avatar: str = Form("teacher"), 
@@ -425,46 +2100,227 @@ async def chat_completion(
             f"Pertanyaan: {text}"
         )
 
-    chat_model = genai.GenerativeModel(MODEL_NAME, generation_config={"temperature": 0.7})
-    
-    resp = chat_model.generate_content([prompt])
+    chat_model, model_name = model_for(f"chat.{'student' if avatar == 'student' else 'teacher'}")
+    resp = await run_in_threadpool(gemini_generate, chat_model, [prompt], "interactive", model_name, request_options={"timeout": budget(60)})
 
     return {"response": resp.text}
 
+# ====== Materi: ringkasan + kuis dari satu upload ======
+# File diunggah & ditunggu ACTIVE sekali. Mode "combined" meminta ringkasan dan soal dalam satu JSON;
+# bagian yang gagal di-parse diminta ulang sendiri memakai file yang sama. Mode "parallel" langsung
+# menjalankan dua generasi bersamaan atas file yang sama.
+MATERIALS_SYSTEM_PROMPT = """Anda adalah asisten belajar yang meringkas materi dan membuat soal sekaligus.
+KELUARKAN PERSIS SEBAGAI JSON object tanpa teks tambahan:
+{
+  "summary": "<ringkasan>",
+  "items": [
+    {"pertanyaan": "...", "opsi": ["A ...","B ...","C ...","D ..."], "jawaban": "A"|"B"|"C"|"D", "penjelasan": "..."}
+  ]
+}
+- Soal: 1 jawaban benar + 3 distraktor masuk akal (tidak ambigu).
+"""
+
+def build_materials_prompt(n: int, difficulty: str, include_explanation: bool, topic_filter: Optional[str],
+                           output_language: str, max_chars: int, fmt: str) -> str:
+    style = ("markdown: heading ## untuk bagian, bullet '- ', tanpa tabel/tautan" if fmt == "markdown"
+             else "teks polos tanpa markdown, bullet '- ' bila perlu")
+    expl = "sertakan 'penjelasan' singkat" if include_explanation else "tanpa penjelasan"
+    tf = f"Fokus pada topik: {topic_filter}." if topic_filter else ""
+    return "\n\n".join([
+        MATERIALS_SYSTEM_PROMPT,
+        f"Tulis seluruh isi dalam bahasa: {lang_display(output_language)}. {tf}",
+        f"summary: {style}; panjang mendekati {max_chars} karakter.",
+        f"items: Buat {n} soal pilihan ganda (A-D). Tingkat kesulitan: {difficulty}. {expl}.",
+    ])
+
+def parse_materials_response(text: str) -> Tuple[Optional[str], Optional[List[dict]]]:
+    try:
+        data = json.loads(text)
+    except Exception:
+        M_PARSE.inc("materials", "fallback")
+        return None, None
+    if not isinstance(data, dict):
+        M_PARSE.inc("materials", "fallback")
+        return None, None
+    summary = data.get("summary")
+    summary = str(summary) if isinstance(summary, str) and summary.strip() else None
+    items = data.get("items")
+    items = parse_quiz_items(json.dumps(items)) if isinstance(items, list) and items else None
+    M_PARSE.inc("materials", "ok" if summary and items else "partial")
+    return summary, items
+
+async def _materials_separate(parts: list, need_summary: bool, need_quiz: bool, n: int, difficulty: str,
+                              include_explanation: bool, topic_filter: Optional[str], output_language: str,
+                              max_chars: int, fmt: str) -> Tuple[Optional[str], Optional[List[dict]], list]:
+    calls = []
+    if need_summary:
+        prompt = build_summary_prompt(output_language, max_chars, fmt)
+        if topic_filter:
+            prompt += f"\n\nFokus ringkasan pada topik: {topic_filter}."
+        calls.append(("summary", prompt))
+    if need_quiz:
+        calls.append(("quiz", "\n\n".join([QUIZ_SYSTEM_PROMPT, build_user_prompt(n, difficulty, include_explanation, topic_filter, output_language)])))
+    routed = {kind: model_for(kind) for kind, _ in calls}
+    resps = await asyncio.gather(*(
+        run_in_threadpool(gemini_generate, routed[kind][0], parts + [p], "standard", routed[kind][1],
+                          request_options={"timeout": budget(180)})
+        for kind, p in calls
+    ))
+    summary, items = None, None
+    for (kind, _), resp in zip(calls, resps):
+        if kind == "summary":
+            summary = parse_summary_response(resp.text)
+        else:
+            items = parse_json_or_fallback(resp.text)
+    return summary, items, list(resps)
+
+@app.post("/materials/process")
+@with_deadline("quiz")
+@track_uploads
+async def process_materials(
+    files: List[UploadFile] = File(..., description="PDF / JPG / PNG / WEBP"),
+    n: int = 10,
+    difficulty: str = "mixed",
+    include_explanation: bool = True,
+    topic_filter: Optional[str] = Form(None),
+    output_language: str = "id",
+    max_chars: int = 1000,
+    format: str = "markdown",  # "markdown" | "plain"
+    full_document: bool = False,
+    mode: str = "combined",    # "combined" | "parallel"
+):
+    if not files:
+        return JSONResponse({"error": "unggah minimal satu file"}, status_code=400)
+    if mode not in ("combined", "parallel"):
+        return JSONResponse({"error": "mode harus 'combined' atau 'parallel'"}, status_code=400)
+    timings = {}
+    t0 = time.perf_counter()
+    try:
+        materials, uploaded, text_parts = await run_in_threadpool(load_materials, files, topic_filter, full_document)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    timings["uploadMs"] = round((time.perf_counter() - t0) * 1000)
+
+    t1 = time.perf_counter()
+    ok, states = await run_in_threadpool(wait_until_active, uploaded, timeout_sec=budget(60))
+    if not ok:
+        return JSONResponse({"error": "file belum ACTIVE di Gemini", "states": states}, status_code=503)
+    timings["activeMs"] = round((time.perf_counter() - t1) * 1000)
+
+    args = (n, difficulty, include_explanation, topic_filter, output_language, max_chars, format)
+    uploaded, text_parts, plan = await plan_materials("quiz", materials, uploaded, text_parts, build_materials_prompt(*args),
+                                                      n=n, max_chars=max_chars, include_explanation=include_explanation,
+                                                      task="materials")
+    if plan:
+        args = (plan["n"], difficulty, include_explanation, topic_filter, output_language, plan["maxChars"], format)
+
+    t2 = time.perf_counter()
+    parts = file_parts(uploaded) + text_parts
+    retried = []
+    if mode == "combined":
+        m, model_name = model_for("materials")
+        resp = await run_in_threadpool(gemini_generate, m, parts + [build_materials_prompt(*args)], "standard", model_name,
+                                       request_options={"timeout": budget(180)})
+        summary, items = parse_materials_response(resp.text)
+        resps = [resp]
+        if summary is None or items is None:
+            retried = [k for k, v in (("summary", summary), ("quiz", items)) if v is None]
+            s2, i2, more = await _materials_separate(parts, summary is None, items is None, *args)
+            summary, items, resps = summary or s2, items or i2, resps + more
+    else:
+        summary, items, resps = await _materials_separate(parts, True, True, *args)
+    timings["generateMs"] = round((time.perf_counter() - t2) * 1000)
+    plan_record("quiz", plan, time.perf_counter() - t2, *resps)
+    timings["totalMs"] = round((time.perf_counter() - t0) * 1000)
+
+    summary = summary.strip()
+    if format == "markdown":
+        summary = cleanup_markdown(summary)
+    for i, it in enumerate(items, 1):
+        it.setdefault("id", f"q{i}")
+        if "opsi" in it and isinstance(it["opsi"], list):
+            it["opsi"] = (it["opsi"] + ["", "", "", ""])[:4]
+
+    usage = usage_report(materials, *resps)
+    quiz_id = save_quiz_local(items, {
+        "source":"materials", "file_count": len(files), "difficulty": difficulty, "n": n,
+        "language": output_language, "include_explanation": include_explanation, "topic_filter": topic_filter,
+        "summary": summary, "usage": usage, "plan": plan,
+    }, route_for("materials" if mode == "combined" else "quiz")["model"])
+
+    return {
+        "quiz_id": quiz_id, "items": items, "summary": summary, "format": format,
+        "meta": {"model": route_for("materials" if mode == "combined" else "quiz")["model"], "mode": mode, "retried": retried, "generations": len(resps),
+                 "timings": timings, "usage": usage, "plan": plan},
+    }
+
 # ============================================
 # == COMPLETION BLOCK: Local Generators & IO ==
 # ============================================
-import math, random, ast, base64, hashlib, hmac
-from typing import List, Optional, Tuple, Dict, Any
-
 # ---------- Directories (pakai DATA_DIR existing) ----------
 CHALLENGE_DIR = DATA_DIR / "challenges"
 SUBMISSION_DIR = DATA_DIR / "submissions"
-for d in (CHALLENGE_DIR, SUBMISSION_DIR):
-    d.mkdir(parents=True, exist_ok=True)
-
-# ---------- Storage helpers (jika belum ada) ----------
-if 'save_challenge_local' not in globals():
-    def save_challenge_local(doc: dict) -> str:
-        cid = uuid.uuid4().hex[:12]
-        doc = dict(doc)
-        doc["_id"] = cid
-        doc["created_at"] = _now_iso()
-        _atomic_write(CHALLENGE_DIR / f"{cid}.json", doc)
-        return cid
-
-if 'load_challenge_local' not in globals():
-    def load_challenge_local(cid: str) -> Optional[dict]:
-        return _read_json(CHALLENGE_DIR / f"{cid}.json")
-
-if 'save_submission_local' not in globals():
-    def save_submission_local(doc: dict) -> str:
-        sid = uuid.uuid4().hex[:12]
-        doc = dict(doc)
-        doc["_id"] = sid
-        doc["created_at"] = _now_iso()
-        _atomic_write(SUBMISSION_DIR / f"{sid}.json", doc)
-        return sid
+
+# ---------- Storage helpers ----------
+# Challenge lokal-prosedural cukup disimpan sebagai (type, difficulty, seed, versi generator);
+# item dibuat ulang saat dibaca. Naikkan versi ini setiap kali output generator lokal berubah.
+GENERATOR_VERSION = 2
+CHALLENGE_CACHE_SIZE = int(os.getenv("CHALLENGE_CACHE_SIZE", "512"))
+
+CHALLENGE_SCORING = {"perCorrect": 10, "perWrong": 0, "timeBonus": {"enabled": True}}
+
+def save_challenge_local(doc: dict, render: bool = True) -> str:
+    cid = uuid.uuid4().hex[:12]
+    doc = dict(doc)
+    doc["_id"] = cid
+    doc["created_at"] = _now_iso()
+    if render:
+        # dirender sebelum item lokal dibuang: hasilnya identik dengan regenerasi dari seed
+        render_doc("challenges", cid, challenge_view(doc))
+    if doc.get("model") == "local-procedural":
+        doc.pop("items", None)
+        doc["generatorVersion"] = GENERATOR_VERSION
+    _atomic_write(CHALLENGE_DIR / f"{cid}.json", doc)
+    index_doc("challenges", doc)
+    return cid
+
+def challenge_view(doc: dict) -> dict:
+    # bentuk yang dilihat klien: solusi diganti answerHash
+    out = {"challengeId": doc["_id"], "type": doc.get("type"), "difficulty": doc.get("difficulty"),
+           "generatedAt": doc["created_at"], "items": sanitize_items(doc.get("items") or []), "scoring": CHALLENGE_SCORING}
+    if doc.get("adaptivePlan"): out["adaptive"] = doc["adaptivePlan"]
+    if doc.get("stale"): out["stale"] = True
+    return out
+
+def load_challenge_local(cid: str) -> Optional[dict]:
+    doc = _read_json(CHALLENGE_DIR / f"{cid}.json")
+    if doc is None or "items" in doc:
+        return doc
+    if doc.get("generatorVersion") != GENERATOR_VERSION:
+        # generator sudah berubah: item asli tidak bisa direproduksi lagi
+        doc["items"] = []
+        doc["stale"] = True
+        return doc
+    mix = tuple(doc["variantMix"]) if doc.get("variantMix") else None
+    doc["items"] = _regenerate_items(doc["type"], doc.get("difficulty"), int(doc["seed"]), GENERATOR_VERSION, mix)
+    return doc
+
+@functools.lru_cache(maxsize=CHALLENGE_CACHE_SIZE)
+def _regenerate_items_cached(t: str, difficulty: Optional[str], seed: int, version: int, mix: Optional[tuple] = None) -> str:
+    return json.dumps(local_bundle(t, random.Random(seed), difficulty, list(mix) if mix else None), ensure_ascii=False)
+
+def _regenerate_items(t: str, difficulty: Optional[str], seed: int, version: int, mix: Optional[tuple] = None) -> List[dict]:
+    # cache menyimpan JSON agar setiap pembaca dapat salinan sendiri
+    return json.loads(_regenerate_items_cached(t, difficulty, seed, version, mix))
+
+def save_submission_local(doc: dict) -> str:
+    sid = uuid.uuid4().hex[:12]
+    doc = dict(doc)
+    doc["_id"] = sid
+    doc["created_at"] = _now_iso()
+    _atomic_write(SUBMISSION_DIR / f"{sid}.json", doc)
+    index_doc("submissions", doc)
+    return sid
 
 # ---------- Answer hashing for client (anti-bocor) ----------
 SERVER_SALT = os.getenv("SERVER_SALT", "PLEASE_CHANGE_THIS_TO_A_RANDOM_LONG_SECRET")
@@ -486,61 +2342,64 @@ def sanitize_items(items: List[dict]) -> List[dict]:
 # ==========================================================
 # ================== MEMORY (LOCAL FALLBACK) ===============
 # ==========================================================
-_LEXICON_BANK = {
-    "Sunda": [
-        ("punten","permisi"), ("neda","makan"), ("teu","tidak"),
-        ("leumpang","berjalan"), ("duka","tidak tahu"), ("hatur nuhun","terima kasih")
-    ],
-    "Jawa": [
-        ("mangan","makan"), ("mlaku","berjalan"), ("ora","tidak"),
-        ("suwun","terima kasih"), ("tulung","tolong"), ("pamit","permisi")
-    ],
-    "Minang": [
-        ("makan","makan"), ("indak","tidak"), ("pai","pergi"),
-        ("ciek","satu"), ("bapikir","berpikir"), ("tibo","jatuh")
-    ],
-    "Bugis": [
-        ("mammio","belajar"), ("malllempa","jalan"), ("iyye","iya"),
-        ("de’na","tidak"), ("sipulung","berkumpul"), ("accera","membaca")
-    ],
-    "Batak": [
-        ("mangan","makan"), ("marsak","susah"), ("mauliate","terima kasih"),
-        ("adong","ada"), ("ndang","tidak"), ("marsogot","cepat")
-    ],
-    "Bali": [
-        ("nampiin","membereskan"), ("meli","membeli"), ("ulung","meminjam"),
-        ("sing","tidak"), ("titiang","saya"), ("suksma","terima kasih")
-    ],
-}
+# Bank leksikon dimuat sekali dari file data, lalu dibekukan: tuple per region + indeks definisi.
+# Tidak ada yang memutasi struktur ini, jadi aman dibaca bersamaan dari threadpool.
+LEXICON_PATH = Path(os.getenv("LEXICON_PATH", Path(__file__).resolve().parent / "lexicon.json"))
+
+def _load_lexicon(path: Path):
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    bank = MappingProxyType({str(r): tuple((str(t), str(d)) for t, d in pairs) for r, pairs in raw.items()})
+    def_regions: Dict[str, set] = {}
+    for r, pairs in bank.items():
+        for _, d in pairs:
+            def_regions.setdefault(d, set()).add(r)
+    defs = tuple(def_regions)  # definisi unik, urutan kemunculan pertama
+    return bank, tuple(bank), defs, MappingProxyType({d: frozenset(rs) for d, rs in def_regions.items()})
+
+_LEXICON_BANK, _LEXICON_REGIONS, _LEXICON_DEFS, _LEXICON_DEF_REGIONS = _load_lexicon(LEXICON_PATH)
 
 def _pick_pairs_for_region(rnd: random.Random, region: str, k: int) -> List[Tuple[str,str]]:
-    bank = _LEXICON_BANK.get(region, [])
-    rnd.shuffle(bank)
-    return bank[:k] if len(bank) >= k else bank
+    # sampel O(k) tanpa menyentuh bank global
+    bank = _LEXICON_BANK.get(region, ())
+    return rnd.sample(bank, min(k, len(bank)))
+
+def _pick_distractors(rnd: random.Random, region: str, exclude: set, k: int) -> List[str]:
+    # definisi yang juga dipakai region lain dan bukan jawaban; rejection sampling O(k) atas indeks definisi
+    def ok(d): return d not in exclude and bool(_LEXICON_DEF_REGIONS[d] - {region})
+    out: List[str] = []
+    seen = set()
+    for _ in range(8 * k):
+        if len(out) >= k: return out
+        d = _LEXICON_DEFS[rnd.randrange(len(_LEXICON_DEFS))]
+        if d not in seen and ok(d):
+            out.append(d)
+        seen.add(d)
+    # bank kecil/padat: lanjut scan linear dari titik acak
+    start = rnd.randrange(len(_LEXICON_DEFS))
+    for i in range(len(_LEXICON_DEFS)):
+        if len(out) >= k: break
+        d = _LEXICON_DEFS[(start + i) % len(_LEXICON_DEFS)]
+        if d not in seen and ok(d):
+            out.append(d); seen.add(d)
+    return out
 
 def _gen_memory_lexicon(rnd: random.Random, idx: int, region: Optional[str], pairs_count: int = 4) -> dict:
-    region = region or rnd.choice(list(_LEXICON_BANK.keys()))
+    region = region or rnd.choice(_LEXICON_REGIONS)
     pairs = _pick_pairs_for_region(rnd, region, pairs_count)
     if len(pairs) < pairs_count:
-        other_regions = [r for r in _LEXICON_BANK.keys() if r != region]
-        for r in other_regions:
-            if len(pairs) >= pairs_count: break
+        used_terms = {t for t,_ in pairs}
+        for r in _LEXICON_REGIONS:
+            if r == region: continue
             for p in _LEXICON_BANK[r]:
-                if p not in pairs:
-                    pairs.append(p)
                 if len(pairs) >= pairs_count: break
+                if p[0] not in used_terms:
+                    pairs.append(p); used_terms.add(p[0])
+            if len(pairs) >= pairs_count: break
 
     terms = [t for t,_ in pairs]
     defs  = [d for _,d in pairs]
     # distraktor definisi dari region lain
-    distractors = []
-    for r in _LEXICON_BANK.keys():
-        if r == region: continue
-        for _,d in _LEXICON_BANK[r]:
-            if d not in defs and d not in distractors:
-                distractors.append(d)
-            if len(distractors) >= 2: break
-        if len(distractors) >= 2: break
+    distractors = _pick_distractors(rnd, region, set(defs), 2)
 
     solution = {t:d for (t,d) in pairs}
     return {
@@ -616,7 +2475,7 @@ def generate_memory_bundle(rnd: random.Random, difficulty: Optional[str]) -> Lis
     else:
         pairs = [3,3]; length_mask = [(6,2),(6,1)]; grid_obj = (4,3)
     items = []
-    regions = list(_LEXICON_BANK.keys()); rnd.shuffle(regions)
+    regions = list(_LEXICON_REGIONS); rnd.shuffle(regions)
     items.append(_gen_memory_lexicon(rnd, 1, regions[0], pairs_count=pairs[0]))
     items.append(_gen_memory_lexicon(rnd, 2, regions[1] if len(regions)>1 else None, pairs_count=pairs[1]))
     items.append(_gen_memory_sequence_missing(rnd, 3, *length_mask[0]))
@@ -823,10 +2682,10 @@ def generate_spatial_bundle(rnd: random.Random, difficulty: Optional[str]) -> Li
     else:
         grids = [3,3,4,4,4]; steps = [3,4]
     items = []
-    items.append(_gen_spatial_rotate(rnd, 1, grid=grids[0], deg=random.choice([90,180,270])))
-    items.append(_gen_spatial_route(rnd, 2, grid=grids[1], steps=random.choice(steps)))
-    items.append(_gen_spatial_rotate(rnd, 3, grid=grids[2], deg=random.choice([90,180,270])))
-    items.append(_gen_spatial_route(rnd, 4, grid=grids[3], steps=random.choice(steps)))
+    items.append(_gen_spatial_rotate(rnd, 1, grid=grids[0], deg=rnd.choice([90,180,270])))
+    items.append(_gen_spatial_route(rnd, 2, grid=grids[1], steps=rnd.choice(steps)))
+    items.append(_gen_spatial_rotate(rnd, 3, grid=grids[2], deg=rnd.choice([90,180,270])))
+    items.append(_gen_spatial_route(rnd, 4, grid=grids[3], steps=rnd.choice(steps)))
     items.append(_gen_spatial_reflect(rnd, 5, grid=grids[4]))
     return items
 
@@ -894,57 +2753,148 @@ def _apply_op(a:int, b:int, op:str) -> Optional[int]:
         return None
     return None
 
-def _gen_num_maze(rnd: random.Random, idx:int, grid:int=3, max_steps:int=4) -> dict:
-    cells = [[rnd.randrange(1,10) for _ in range(grid)] for _ in range(grid)]
-    start = [rnd.randrange(0,grid), rnd.randrange(0,grid)]
-    cur = tuple(start)
-    steps = []
-    dirs = {"N":(-1,0),"S":(1,0),"E":(0,1),"W":(0,-1)}
-    path_cells = [list(cur)]
+# ---------- Solver maze: DP atas state (sel, nilai) per langkah ----------
+_MAZE_DIRS = {"N":(-1,0),"S":(1,0),"E":(0,1),"W":(0,-1)}
+
+def _maze_edge_op(edges: dict, r:int, c:int, nr:int, nc:int) -> Optional[str]:
+    if r == nr and abs(c - nc) == 1:
+        return edges["h"][r][min(c, nc)]
+    if c == nc and abs(r - nr) == 1:
+        return edges["v"][min(r, nr)][c]
+    return None
+
+def _maze_neighbors(grid:int, r:int, c:int) -> List[Tuple[int,int]]:
+    out = []
+    for dr,dc in _MAZE_DIRS.values():
+        nr,nc = r+dr, c+dc
+        if 0 <= nr < grid and 0 <= nc < grid:
+            out.append((nr,nc))
+    return out
+
+def _maze_layers(cells: List[List[int]], edges: dict, start: List[int], max_steps:int) -> List[Dict[tuple, Dict[int,int]]]:
+    # layers[k][(sel, sel_sebelumnya)][nilai] = banyaknya jalur k langkah dari start yang berakhir di sel tsb.
+    # Sel sebelumnya ikut jadi state agar langkah balik langsung (A->B->A) tidak dihitung sebagai jalur.
+    grid = len(cells)
+    s = (int(start[0]), int(start[1]))
+    layers = [{(s, None): {cells[s[0]][s[1]]: 1}}]
     for _ in range(max_steps):
-        cand = []
+        nxt: Dict[tuple, Dict[int,int]] = {}
+        for ((r,c), prev), vals in layers[-1].items():
+            for nr,nc in _maze_neighbors(grid, r, c):
+                if (nr,nc) == prev: continue
+                op = _maze_edge_op(edges, r, c, nr, nc)
+                b = cells[nr][nc]
+                bucket = nxt.setdefault(((nr,nc), (r,c)), {})
+                for v, cnt in vals.items():
+                    nv = _apply_op(v, b, op)
+                    if nv is None: continue
+                    bucket[nv] = bucket.get(nv, 0) + cnt
+        layers.append(nxt)
+    return layers
+
+def _maze_target_stats(layers: list) -> Dict[int, dict]:
+    # per target: total jalur solusi (1..max_steps langkah) & langkah minimum
+    stats: Dict[int, dict] = {}
+    for k in range(1, len(layers)):
+        for vals in layers[k].values():
+            for v, cnt in vals.items():
+                st = stats.get(v)
+                if st is None:
+                    stats[v] = {"count": cnt, "minSteps": k}
+                else:
+                    st["count"] += cnt
+    return stats
+
+def _maze_count_solutions(cells: List[List[int]], edges: dict, start: List[int], target:int, max_steps:int) -> int:
+    st = _maze_target_stats(_maze_layers(cells, edges, start, max_steps)).get(target)
+    return st["count"] if st else 0
+
+def _maze_reconstruct(cells: List[List[int]], edges: dict, layers: list, target:int, steps:int) -> List[List[int]]:
+    # telusuri mundur dari layer `steps` ke start lewat state (sel, sel_sebelumnya)
+    cur, prev = next(key for key, vals in layers[steps].items() if target in vals)
+    val = target
+    path = [list(cur)]
+    for k in range(steps, 0, -1):
         r,c = cur
-        if r>0: cand.append(("N",(r-1,c)))
-        if r<grid-1: cand.append(("S",(r+1,c)))
-        if c<grid-1: cand.append(("E",(r,c+1)))
-        if c>0: cand.append(("W",(r,c-1)))
-        d,nxt = rnd.choice(cand)
-        steps.append([d,1])
-        cur = nxt
-        path_cells.append([cur[0],cur[1]])
+        op = _maze_edge_op(edges, prev[0], prev[1], r, c)
+        found = None
+        for (pc, pprev), pvals in layers[k-1].items():
+            if pc != prev or pprev == cur: continue
+            for pv in pvals:
+                if _apply_op(pv, cells[r][c], op) == val:
+                    found = (pc, pprev, pv); break
+            if found: break
+        cur, prev, val = found
+        path.append(list(cur))
+    path.reverse()
+    return path
+
+def _maze_difficulty(min_steps:int, max_steps:int, states:int) -> Tuple[float, str]:
+    # makin panjang jalur minimum & makin luas ruang state -> makin sulit
+    depth = (min_steps - 1) / max(1, max_steps - 1)
+    spread = min(1.0, math.log(max(2, states)) / math.log(max(4, 4 ** max_steps)))
+    rating = round(0.7*depth + 0.3*spread, 3)
+    label = "easy" if rating < 0.5 else "medium" if rating < 0.8 else "hard"
+    return rating, label
+
+def _maze_check_path(render: dict, path_cells: Any) -> bool:
+    # validasi O(langkah): mulai di start, langkah bertetangga tanpa balik langsung, op valid, nilai akhir = target
+    try:
+        cells = render["cells"]; edges = render["edges"]; grid = int(render["grid"])
+        start = [int(x) for x in render["start"]]
+        p = [[int(a), int(b)] for a,b in path_cells]
+    except (KeyError, TypeError, ValueError):
+        return False
+    if not p or p[0] != start: p = [start] + p
+    if len(p) < 2 or len(p) - 1 > int(render.get("maxSteps", 4)):
+        return False
+    val = cells[start[0]][start[1]]
+    for i, ((r,c),(nr,nc)) in enumerate(zip(p, p[1:])):
+        if not (0 <= nr < grid and 0 <= nc < grid): return False
+        if i > 0 and p[i-1] == [nr,nc]: return False   # tidak boleh balik langsung ke sel sebelumnya
+        op = _maze_edge_op(edges, r, c, nr, nc)
+        if op is None: return False
+        val = _apply_op(val, cells[nr][nc], op)
+        if val is None: return False
+    return val == render.get("target")
+
+def _gen_num_maze(rnd: random.Random, idx:int, grid:int=3, max_steps:int=4,
+                  solutions:int=1, difficulty: Optional[str]=None, attempts:int=200) -> dict:
     ops = ["+","-","×","÷"]
-    edges_h = [[rnd.choice(ops) for _ in range(grid-1)] for _ in range(grid)]
-    edges_v = [[rnd.choice(ops) for _ in range(grid)] for _ in range(grid-1)]
-    value = cells[start[0]][start[1]]
-    cur_r, cur_c = start
-    for (d,_len) in steps:
-        dr,dc = dirs[d]
-        nr,nc = cur_r+dr, cur_c+dc
-        if d in ("E","W"):
-            cc = min(cur_c, nc)
-            op = edges_h[cur_r][cc]
+    want = {"hard":"hard","sulit":"hard","medium":"medium","sedang":"medium","easy":"easy","mudah":"easy"}.get((difficulty or "").lower())
+    best = None
+    for _ in range(attempts):
+        cells = [[rnd.randrange(1,10) for _ in range(grid)] for _ in range(grid)]
+        start = [rnd.randrange(0,grid), rnd.randrange(0,grid)]
+        edges = {"h": [[rnd.choice(ops) for _ in range(grid-1)] for _ in range(grid)],
+                 "v": [[rnd.choice(ops) for _ in range(grid)] for _ in range(grid-1)]}
+        layers = _maze_layers(cells, edges, start, max_steps)
+        states = sum(len(v) for layer in layers for v in layer.values())
+        cands = []
+        for target, st in _maze_target_stats(layers).items():
+            if st["count"] != solutions or st["minSteps"] < 2: continue
+            rating, label = _maze_difficulty(st["minSteps"], max_steps, states)
+            cands.append((target, st, rating, label))
+        if not cands: continue
+        if want:
+            match = [x for x in cands if x[3] == want]
+            if match:
+                best = (cells, start, edges, layers, rnd.choice(match)); break
+            if best is None: best = (cells, start, edges, layers, rnd.choice(cands))
         else:
-            rr = min(cur_r, nr)
-            op = edges_v[rr][cur_c]
-        val_next = _apply_op(value, cells[nr][nc], op)
-        if val_next is None:
-            op = "+"
-            if d in ("E","W"):
-                edges_h[cur_r][cc] = op
-            else:
-                edges_v[rr][cur_c] = op
-            val_next = value + cells[nr][nc]
-        value = val_next
-        cur_r,cur_c = nr,nc
-    target = value
+            best = (cells, start, edges, layers, rnd.choice(cands)); break
+    if best is None:
+        raise RuntimeError(f"maze: tidak ada grid dengan tepat {solutions} solusi")
+    cells, start, edges, layers, (target, st, rating, label) = best
+    path_cells = _maze_reconstruct(cells, edges, layers, target, st["minSteps"])
     return {
         "itemId": f"num_maze_{idx}",
         "variant": "number_maze",
         "prompt": f"Mulai dari nilai sel awal. Pilih jalur agar nilai akhir = {target}.",
-        "render": {"kind":"path-grid","grid":grid,"cells":cells,"edges":{"h":edges_h,"v":edges_v},"start": start,"target": target,"maxSteps": max_steps},
+        "render": {"kind":"path-grid","grid":grid,"cells":cells,"edges":edges,"start": start,"target": target,"maxSteps": max_steps},
         "answerSpec": {"mode":"path","encoding":"cells"},
-        "solution": {"pathCells": path_cells},
-        "metadata": {"difficulty": "easy" if grid==3 else "medium", "maxSteps": max_steps}
+        "solution": {"pathCells": path_cells, "solutionCount": st["count"]},
+        "metadata": {"difficulty": label, "rating": rating, "maxSteps": max_steps, "solutions": st["count"], "minSteps": st["minSteps"]}
     }
 
 # V3: Equation Fill (lokal)
@@ -1041,44 +2991,355 @@ def _gen_num_prob_ratio(rnd: random.Random, idx:int) -> dict:
 def generate_numerical_bundle(rnd: random.Random, difficulty_hint: Optional[str]) -> List[dict]:
     items = []
     items.append(_gen_num_24(rnd, 1))                                   # Easy
-    items.append(_gen_num_maze(rnd, 2, grid=3, max_steps=4))            # Easy
+    items.append(_gen_num_maze(rnd, 2, grid=3, max_steps=4, difficulty=difficulty_hint))  # ikut difficulty_hint
     items.append(_gen_num_equation_fill(rnd, 3, level="medium"))        # Medium
     items.append(_gen_num_function_machine(rnd, 4))                     # Medium
-    items.append(random.choice([_gen_num_modular, _gen_num_base_convert, _gen_num_prob_ratio])(rnd, 5))  # Hard
+    items.append(rnd.choice([_gen_num_modular, _gen_num_base_convert, _gen_num_prob_ratio])(rnd, 5))  # Hard
     return items
 
-if '_llm_json' not in globals():
-    def _llm_json(prompt: str, timeout_sec: int = 45) -> Any:
-        sys = (
-            "KELUARKAN PERSIS JSON VALID tanpa teks lain, tanpa markdown, tanpa komentar. "
-            "Pastikan JSON bisa di-parse Python."
-        )
-        resp = model.generate_content([sys, prompt], request_options={"timeout": timeout_sec})
-        txt = (resp.text or "").strip()
-        return json.loads(txt)
-
-# --- helper: sembunyikan solusi untuk klien ---
-if '_answer_hash' not in globals():
-    SERVER_SALT = os.getenv("SERVER_SALT", "PLEASE_CHANGE_THIS_TO_A_RANDOM_LONG_SECRET")
-    import base64, hashlib, hmac
-    def _answer_hash(payload: Any) -> str:
-        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
-        digest = hmac.new(SERVER_SALT.encode("utf-8"), raw, hashlib.sha256).digest()
-        return base64.b64encode(digest).decode("ascii")
-
-if '_sanitize_items_llm' not in globals():
-    def _sanitize_items_llm(items: list) -> list:
-        clean = []
-        for it in items:
-            it2 = {k: v for k, v in it.items() if k != "solution"}
-            if "solution" in it:
-                it2["answerHash"] = _answer_hash({"itemId": it["itemId"], "solution": it["solution"]})
-            clean.append(it2)
-        return clean
+# ========= LLM: single-flight + reuse hasil tervalidasi =========
+# Prompt item challenge nyaris selalu identik antar request. Prompt identik yang sedang berjalan
+# digabung jadi satu panggilan upstream; hasil yang lolos validasi builder disimpan (terbatas per
+# hash prompt) dan bisa dipakai ulang dengan peluang LLM_REUSE_RATE.
+LLM_REUSE_RATE = float(os.getenv("LLM_REUSE_RATE", "0.2"))
+LLM_STORE_PER_PROMPT = int(os.getenv("LLM_STORE_PER_PROMPT", "8"))
+LLM_STORE_MAX_PROMPTS = int(os.getenv("LLM_STORE_MAX_PROMPTS", "256"))
+
+_llm_lock = threading.Lock()
+_llm_inflight: Dict[str, Future] = {}
+_llm_store: "OrderedDict[str, deque]" = OrderedDict()
+_llm_reuse_rnd = random.Random()
+_llm_stats = {"requests": 0, "upstream": 0, "coalesced": 0, "reused": 0, "remembered": 0, "errors": 0,
+              "hedged": 0, "hedgeWins": 0}
+
+def _prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+_LLM_SYS = (
+    "KELUARKAN PERSIS JSON VALID tanpa teks lain, tanpa markdown, tanpa komentar. "
+    "Pastikan JSON bisa di-parse Python."
+)
+
+# Hedging: prompt item idempoten, jadi bila jawaban pertama belum datang setelah ~p95 latensi,
+# kirim duplikat; respons valid pertama menang. SDK sinkron tidak bisa membatalkan HTTP yang sedang
+# jalan, jadi "pembatalan" = duplikat yang belum mulai tidak dikirim & hasil yang kalah dibuang: panggilan
+# yang kalah tetap memakai satu slot scheduler dan satu token rate sampai selesai. Karena itu duplikat hanya
+# dikirim bila scheduler sedang longgar (tidak ada antrean, slot konkurensi masih tersisa).
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY_DEFAULT = float(os.getenv("LLM_HEDGE_DELAY_SEC", "8"))
+LLM_HEDGE_DELAY_MIN = float(os.getenv("LLM_HEDGE_DELAY_MIN_SEC", "1"))
+_llm_latencies: deque = deque(maxlen=256)
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_THREADS", "16")), thread_name_prefix="llm-hedge")
+
+def _hedge_delay() -> float:
+    lat = sorted(_llm_latencies)
+    if len(lat) < 20:
+        return LLM_HEDGE_DELAY_DEFAULT
+    return max(LLM_HEDGE_DELAY_MIN, lat[int(len(lat) * 0.95) - 1])
+
+def _llm_call_once(prompt: str, timeout_sec: float, cancelled: Optional[threading.Event] = None,
+                   variant: str = "generic") -> str:
+    if cancelled is not None and cancelled.is_set():
+        raise concurrent.futures.CancelledError()
+    m, model_name = model_for(f"item.{variant}")
+    used = _llm_models_used.get()
+    if used is not None: used.add(model_name)
+    t0 = time.monotonic()
+    resp = gemini_generate(m, [_LLM_SYS, prompt], "background", model_name, request_options={"timeout": timeout_sec})
+    txt = (resp.text or "").strip()
+    json.loads(txt)  # hanya respons yang bisa di-parse dihitung valid
+    _llm_latencies.append(time.monotonic() - t0)
+    return txt
+
+def _llm_hedged(prompt: str, timeout_sec: float, variant: str = "generic") -> str:
+    end = time.monotonic() + timeout_sec
+    cancelled = threading.Event()
+    def submit(t):
+        return _hedge_pool.submit(contextvars.copy_context().run, _llm_call_once, prompt, t, cancelled, variant)
+    futs = [submit(timeout_sec)]
+    done, _ = futures_wait(futs, timeout=min(_hedge_delay(), timeout_sec))
+    if not done and end - time.monotonic() > LLM_MIN_BUDGET_SEC and _gemini_scheduler.idle():
+        futs.append(submit(end - time.monotonic()))
+        with _llm_lock:
+            _llm_stats["hedged"] += 1
+    last_err: Optional[BaseException] = None
+    pending = set(futs)
+    try:
+        while pending:
+            done, pending = futures_wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                if f.exception() is None:
+                    if len(futs) > 1 and f is futs[1]:
+                        with _llm_lock:
+                            _llm_stats["hedgeWins"] += 1
+                    return f.result()
+                last_err = f.exception()
+        raise last_err or DeadlineExceeded("LLM tidak merespons sebelum deadline")
+    finally:
+        cancelled.set()
+        for f in pending: f.cancel()
+
+def _llm_raw(prompt: str, timeout_sec: float, variant: str = "generic") -> str:
+    if LLM_HEDGE:
+        return _llm_hedged(prompt, timeout_sec, variant)
+    return _llm_call_once(prompt, timeout_sec, variant=variant)
+
+# ========= LLM: circuit breaker (global + per varian) =========
+# Jendela geser atas hasil panggilan upstream: bila rasio error atau rasio lambat melewati ambang,
+# breaker terbuka dan panggilan langsung gagal (ms) sehingga challenge langsung pakai generator lokal.
+# Setelah CB_OPEN_SEC, satu panggilan probe (half-open) menentukan tutup lagi atau buka ulang.
+CB_WINDOW_SEC = float(os.getenv("CB_WINDOW_SEC", "60"))
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "5"))
+CB_ERROR_RATE = float(os.getenv("CB_ERROR_RATE", "0.5"))
+CB_SLOW_SEC = float(os.getenv("CB_SLOW_SEC", "20"))
+CB_SLOW_RATE = float(os.getenv("CB_SLOW_RATE", "0.5"))
+CB_OPEN_SEC = float(os.getenv("CB_OPEN_SEC", "30"))
+
+class CircuitOpen(Exception):
+    pass
+
+class _CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: deque = deque()      # (ts, ok, slow)
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self._trips = 0
+
+    def _prune(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > CB_WINDOW_SEC:
+            self._calls.popleft()
+
+    def _trip(self, now: float) -> None:
+        self._state, self._opened_at, self._probing = "open", now, False
+        self._trips += 1
+        self._calls.clear()
+
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= CB_OPEN_SEC:
+                return "half_open"
+            return self._state
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < CB_OPEN_SEC:
+                    raise CircuitOpen(self.name)
+                self._state, self._probing = "half_open", False
+            if self._state == "half_open":
+                if self._probing:
+                    raise CircuitOpen(self.name)
+                self._probing = True
+
+    def release(self) -> None:
+        # hasil netral (mis. ditolak scheduler lokal): lepas slot probe tanpa menilai upstream
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slow = latency >= CB_SLOW_SEC
+            if self._state == "half_open":
+                self._probing = False
+                if ok and not slow:
+                    self._state = "closed"; self._calls.clear()
+                else:
+                    self._trip(now)
+                return
+            self._calls.append((now, ok, slow))
+            self._prune(now)
+            n = len(self._calls)
+            if n >= CB_MIN_CALLS:
+                errors = sum(1 for _, k, _ in self._calls if not k)
+                slows = sum(1 for _, _, s in self._calls if s)
+                if errors / n >= CB_ERROR_RATE or slows / n >= CB_SLOW_RATE:
+                    self._trip(now)
+
+    def snapshot(self) -> dict:
+        state = self.state()
+        with self._lock:
+            self._prune(time.monotonic())
+            n = len(self._calls)
+            return {
+                "state": state, "trips": self._trips, "windowCalls": n,
+                "errorRate": round(sum(1 for _, k, _ in self._calls if not k) / n, 3) if n else 0.0,
+                "slowRate": round(sum(1 for _, _, s in self._calls if s) / n, 3) if n else 0.0,
+            }
+
+_gemini_breaker = _CircuitBreaker("gemini")
+_variant_breakers: Dict[str, _CircuitBreaker] = {}
+_LLM_BUNDLE_VARIANTS = {
+    "memory": ("lexicon_match", "sequence_missing", "scene_recall"),
+    "spatial": ("map_rotate", "route_nav", "mirror_reflect"),
+    "numerical": ("target_24", "equation_fill", "function_machine"),
+}
+
+def _variant_breaker(variant: str) -> _CircuitBreaker:
+    with _llm_lock:
+        br = _variant_breakers.get(variant)
+        if br is None:
+            br = _variant_breakers[variant] = _CircuitBreaker(variant)
+        return br
+
+def llm_bundle_available(t: str) -> bool:
+    # cek tanpa mengambil slot probe: hanya status "open" penuh yang langsung dialihkan ke lokal
+    if LOCAL_ONLY or _gemini_breaker.state() == "open":
+        return False
+    variants = _LLM_BUNDLE_VARIANTS.get(t, ()) + ((f"bundle_{t}",) if LLM_BUNDLE_MODE == "batch" else ())
+    return all(_variant_breaker(v).state() != "open" for v in variants)
+
+def circuit_stats() -> dict:
+    with _llm_lock:
+        variants = dict(_variant_breakers)
+    return {"gemini": _gemini_breaker.snapshot(), "variants": {v: b.snapshot() for v, b in variants.items()}}
+
+def _llm_upstream(prompt: str, timeout_sec: float, variant: str) -> str:
+    breakers = [_gemini_breaker, _variant_breaker(variant)]
+    acquired = []
+    try:
+        for br in breakers:
+            br.acquire(); acquired.append(br)
+    except CircuitOpen:
+        for br in acquired: br.release()
+        raise
+    t0 = time.monotonic()
+    try:
+        txt = _llm_raw(prompt, timeout_sec, variant)
+    except (GeminiSaturated, concurrent.futures.CancelledError):
+        for br in breakers: br.release()
+        M_LLM_ITEM.observe(variant, "rejected", value=time.monotonic() - t0)
+        raise
+    except Exception:
+        for br in breakers: br.record(False, time.monotonic() - t0)
+        M_LLM_ITEM.observe(variant, "error", value=time.monotonic() - t0)
+        raise
+    for br in breakers: br.record(True, time.monotonic() - t0)
+    M_LLM_ITEM.observe(variant, "ok", value=time.monotonic() - t0)
+    return txt
+
+def _llm_json(prompt: str, timeout_sec: int = 45, variant: str = "generic") -> Any:
+    timeout_sec = budget(timeout_sec)
+    key = _prompt_key(prompt)
+    # hasil tervalidasi dipakai ulang lintas model, tapi panggilan eskalasi tidak boleh menumpang panggilan model cepat
+    fkey = key + "@" + route_for(f"item.{variant}")["model"]
+    batch = _llm_batch.get()
+    if batch is not None and key in batch["data"]:
+        return json.loads(batch["data"][key])
+    with _llm_lock:
+        _llm_stats["requests"] += 1
+        stored = _llm_store.get(key)
+        if stored and _llm_reuse_rnd.random() < LLM_REUSE_RATE:
+            _llm_stats["reused"] += 1
+            _llm_store.move_to_end(key)
+            return json.loads(_llm_reuse_rnd.choice(stored))
+    if batch is not None:
+        # mode batch: prompt dikumpulkan dulu, dikirim sekaligus oleh generate_bundle_llm_batched
+        if batch["collect"]:
+            raise _BatchPending(prompt)
+        raise RuntimeError("LLM batch: hasil item tidak ada")
+    with _llm_lock:
+        fut = _llm_inflight.get(fkey)
+        leader = fut is None
+        if leader:
+            fut = _llm_inflight[fkey] = Future()
+        else:
+            _llm_stats["coalesced"] += 1
+    if leader:
+        try:
+            fut.set_result(_llm_upstream(prompt, timeout_sec, variant))
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with _llm_lock:
+                _llm_inflight.pop(fkey, None)
+                if not isinstance(fut.exception(), CircuitOpen):
+                    _llm_stats["upstream"] += 1
+                    if fut.exception() is not None: _llm_stats["errors"] += 1
+    # setiap pemanggil mem-parse sendiri: tidak ada objek yang dibagi antar request
+    return json.loads(fut.result(timeout=timeout_sec))
+
+M_ESCALATIONS = Counter("llm_escalations_total", "Item yang dicoba ulang dengan model berat", ("variant", "result"))
+_llm_models_used: contextvars.ContextVar[Optional[set]] = contextvars.ContextVar("llm_models_used", default=None)
+# {"collect": bool, "data": {hash prompt: json}}: diset generate_bundle_llm_batched
+_llm_batch: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("llm_batch", default=None)
+
+class _BatchPending(Exception):
+    def __init__(self, prompt: str):
+        super().__init__("prompt menunggu batch")
+        self.prompt = prompt
+
+class _PendingItem:
+    # tempat item LLM di bundle selama fase kumpul; build() menjalankan validasi builder atas hasil batch
+    def __init__(self, fn, args: tuple, kw: dict, prompt: str, variant: str):
+        self.fn, self.args, self.kw, self.prompt, self.variant = fn, args, kw, prompt, variant
+
+    def build(self) -> dict:
+        return self.fn(*self.args, **self.kw)
+
+def escalating(variant: str):
+    # builder item: validasi gagal di model cepat -> ulangi sekali dengan model berat rute tersebut.
+    # Pada fase kumpul mode batch, builder diganti _PendingItem berisi prompt-nya.
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            try:
+                return fn(*args, **kw)
+            except _BatchPending as p:
+                return _PendingItem(fn, args, kw, p.prompt, variant)
+            except (CircuitOpen, GeminiSaturated, DeadlineExceeded, LLMUnavailable, concurrent.futures.CancelledError):
+                raise
+            except Exception:
+                if not MODEL_ESCALATE or _escalated.get() or not route_for(f"item.{variant}")["escalate"]:
+                    raise
+            token = _escalated.set(True)
+            try:
+                out = fn(*args, **kw)
+            except Exception:
+                M_ESCALATIONS.inc(variant, "failed")
+                raise
+            finally:
+                _escalated.reset(token)
+            M_ESCALATIONS.inc(variant, "ok")
+            return out
+        return wrapper
+    return deco
+
+def _llm_remember(prompt: str, data: Any) -> None:
+    # dipanggil builder SETELAH validasi lolos; hanya hasil valid yang boleh dipakai ulang
+    if LLM_STORE_PER_PROMPT <= 0: return
+    key = _prompt_key(prompt)
+    txt = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    with _llm_lock:
+        stored = _llm_store.get(key)
+        if stored is None:
+            stored = _llm_store[key] = deque(maxlen=LLM_STORE_PER_PROMPT)
+        _llm_store.move_to_end(key)
+        if txt not in stored:
+            stored.append(txt)
+            _llm_stats["remembered"] += 1
+        while len(_llm_store) > LLM_STORE_MAX_PROMPTS:
+            _llm_store.popitem(last=False)
+
+def llm_shared_stats() -> dict:
+    with _llm_lock:
+        st = dict(_llm_stats)
+        st["inflight"] = len(_llm_inflight)
+        st["storedPrompts"] = len(_llm_store)
+        st["storedResults"] = sum(len(d) for d in _llm_store.values())
+    st["reuseRate"] = LLM_REUSE_RATE
+    st["hitRatio"] = round((st["reused"] + st["coalesced"]) / st["requests"], 4) if st["requests"] else 0.0
+    return st
 
 # ========= MEMORY via LLM =========
-_ALLOWED_REGIONS = ["Sunda","Jawa","Minang","Bugis","Batak","Bali"]
+_ALLOWED_REGIONS = list(_LEXICON_REGIONS)
 
+@escalating("lexicon_match")
 def _mem_llm_lexicon_item(rnd: random.Random, idx: int, pairs_count: int = 4) -> dict:
     prompt = f"""
 Buat pasangan istilah bahasa daerah dan definisinya.
@@ -1095,7 +3356,7 @@ Ketentuan:
 - 2 distraktor definisi yang masuk akal namun tidak cocok.
 - Bahasa Indonesia. Tanpa teks di luar JSON.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="lexicon_match")
     reg = data.get("region") or rnd.choice(_ALLOWED_REGIONS)
     if reg not in _ALLOWED_REGIONS:
         reg = rnd.choice(_ALLOWED_REGIONS)
@@ -1115,6 +3376,7 @@ Ketentuan:
         dis.append(f"dummy_{rnd.randrange(100,999)}")
 
     solution = {t:d for t,d in zip(terms, defs)}
+    _llm_remember(prompt, data)
     return {
         "itemId": f"mem_lx_{idx}",
         "variant": "lexicon_match",
@@ -1125,6 +3387,7 @@ Ketentuan:
         "metadata": {"region": reg, "pairsCount": len(terms)}
     }
 
+@escalating("sequence_missing")
 def _mem_llm_sequence_item(rnd: random.Random, idx: int, length: int = 7, masked: int = 2) -> dict:
     prompt = f"""
 Buat urutan angka bermakna untuk memory (aritmetika/geometri/pola sederhana).
@@ -1138,13 +3401,14 @@ Ketentuan:
 - Panjang {length}. maskIndices {masked} posisi unik dalam 0..{length-1}.
 - Nilai integer non-negatif. Tanpa teks lain.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="sequence_missing")
     seq = data.get("sequence") or []
     mask = data.get("maskIndices") or []
     if not (isinstance(seq,list) and len(seq)==length): raise RuntimeError("LLM seq: panjang salah")
     mask = sorted(list({int(i) for i in mask if 0 <= int(i) < length}))[:masked]
     if len(mask) != masked: raise RuntimeError("LLM seq: mask salah")
     solution = [seq[i] for i in mask]
+    _llm_remember(prompt, data)
     return {
         "itemId": f"mem_seq_{idx}",
         "variant": "sequence_missing",
@@ -1155,6 +3419,7 @@ Ketentuan:
         "metadata": {"length": length, "masked": masked}
     }
 
+@escalating("scene_recall")
 def _mem_llm_scene_item(rnd: random.Random, idx: int, grid: int = 4, obj_cnt: int = 3) -> dict:
     prompt = f"""
 Buat skenario scene sederhana untuk memory recall.
@@ -1169,7 +3434,7 @@ Ketentuan:
 - Tepat {obj_cnt} objek dengan id & posisi unik dalam grid {grid}x{grid}.
 - Jika "moved", "to" ≠ posisi semula. Hanya JSON.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="scene_recall")
     objs = data.get("objects") or []
     if len(objs) != obj_cnt: raise RuntimeError("LLM scene: jumlah objek salah")
     ids = [o.get("id") for o in objs]
@@ -1190,6 +3455,7 @@ Ketentuan:
         options = [f"{o['id']}@{o['pos'][0]}-{o['pos'][1]}" for o in objs] + [solution]
         options = list(dict.fromkeys(options))[:4] if len(options)>=4 else options
 
+    _llm_remember(prompt, data)
     return {
         "itemId": f"mem_sc_{idx}",
         "variant": "scene_recall",
@@ -1216,27 +3482,9 @@ def generate_memory_bundle_llm(rnd: random.Random, difficulty: Optional[str]) ->
     ]
 
 # ========= SPATIAL via LLM =========
-# butuh renderer & rotator. Jika belum ada (dari fallback), definisikan cepat.
-if '_render_map_svg' not in globals():
-    def _render_map_svg(grid, roads, river, landmarks, north="up", marker=None, axis=None):
-        # minimal stub agar tidak error (sebaiknya pakai versi lengkap di fallback)
-        return "<svg/>"
-
-if '_apply_rotate_to_map' not in globals():
-    def _apply_rotate_to_map(base:dict, deg:int, n:int) -> dict:
-        times = (deg//90) % 4
-        def rot(p):
-            r,c = p
-            for _ in range(times):
-                r,c = (c, n-1-r)
-            return [r,c]
-        return {
-            "roads": [ [ rot(tuple(a)), rot(tuple(b)) ] for (a,b) in base.get("roads",[]) ],
-            "river": [ rot(tuple(p)) for p in base.get("river",[]) ],
-            "landmarks": [{"name":lm["name"],"pos":rot(tuple(lm["pos"])),"icon":lm.get("icon","square")} for lm in base.get("landmarks",[])],
-            "north": base.get("north","up")
-        }
+# renderer & rotator dipakai bersama dengan generator lokal di atas
 
+@escalating("map_rotate")
 def _sp_llm_rotate_item(rnd: random.Random, idx:int, grid:int=4, deg:int=90) -> dict:
     prompt = f"""
 Buat skenario peta grid untuk rotasi.
@@ -1254,7 +3502,7 @@ Output JSON:
 }}
 Ketentuan: koordinat 0..{grid-1}, landmark 2-3 buah unik. JSON only.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="map_rotate")
     base = data.get("base") or {}
     if not base.get("landmarks"): raise RuntimeError("LLM rot: landmarks kosong")
 
@@ -1267,6 +3515,7 @@ Ketentuan: koordinat 0..{grid-1}, landmark 2-3 buah unik. JSON only.
         svg = _render_map_svg(grid, rotated.get("roads",[]), rotated.get("river",[]), rotated.get("landmarks",[]), rotated.get("north","up"))
         options.append({"optionId": L, "render": {"kind":"svg","svg": svg}})
 
+    _llm_remember(prompt, data)
     return {
         "itemId": f"sp_rot_{idx}",
         "variant": "map_rotate",
@@ -1278,6 +3527,7 @@ Ketentuan: koordinat 0..{grid-1}, landmark 2-3 buah unik. JSON only.
         "metadata": {"theme":"rotate","grid":grid,"deg":deg}
     }
 
+@escalating("route_nav")
 def _sp_llm_route_item(rnd: random.Random, idx:int, grid:int=5, step_len:int=4) -> dict:
     prompt = f"""
 Buat peta untuk navigasi rute.
@@ -1295,7 +3545,7 @@ Output JSON:
 }}
 Ketentuan: steps {step_len}, tidak keluar grid {grid}x{grid}. JSON only.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="route_nav")
     base = data.get("base") or {}
     action = data.get("action") or {}
     start_name = action.get("from")
@@ -1328,6 +3578,7 @@ Ketentuan: steps {step_len}, tidak keluar grid {grid}x{grid}. JSON only.
         options.append({"optionId": L, "render": {"kind":"svg","svg": svg}})
         if pos == final: sol_letter = L
 
+    _llm_remember(prompt, data)
     return {
         "itemId": f"sp_nav_{idx}",
         "variant": "route_nav",
@@ -1339,6 +3590,7 @@ Ketentuan: steps {step_len}, tidak keluar grid {grid}x{grid}. JSON only.
         "metadata": {"theme":"path","grid":grid,"steps": action.get("steps",[])}
     }
 
+@escalating("mirror_reflect")
 def _sp_llm_reflect_item(rnd: random.Random, idx:int, grid:int=5) -> dict:
     prompt = f"""
 Buat peta untuk refleksi terhadap sumbu.
@@ -1356,7 +3608,7 @@ Output JSON:
 }}
 Ketentuan: axis vertical x atau horizontal y dalam 0..{grid-1}. JSON only.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="mirror_reflect")
     base = data.get("base") or {}
     axis = data.get("action",{}).get("axis")
 
@@ -1383,6 +3635,7 @@ Ketentuan: axis vertical x atau horizontal y dalam 0..{grid-1}. JSON only.
         options.append({"optionId": L, "render": {"kind":"svg","svg": svg}})
         if coords[i]==reflected: sol_letter = L
 
+    _llm_remember(prompt, data)
     return {
         "itemId": f"sp_ref_{idx}",
         "variant": "mirror_reflect",
@@ -1402,27 +3655,15 @@ def generate_spatial_bundle_llm(rnd: random.Random, difficulty: Optional[str]) -
     else:
         grids = [3,3,4,4,4]; steps = [3,4]
     return [
-        _sp_llm_rotate_item(rnd, 1, grid=grids[0], deg=random.choice([90,180,270])),
-        _sp_llm_route_item(rnd, 2, grid=grids[1], step_len=random.choice(steps)),
-        _sp_llm_rotate_item(rnd, 3, grid=grids[2], deg=random.choice([90,180,270])),
-        _sp_llm_route_item(rnd, 4, grid=grids[3], step_len=random.choice(steps)),
+        _sp_llm_rotate_item(rnd, 1, grid=grids[0], deg=rnd.choice([90,180,270])),
+        _sp_llm_route_item(rnd, 2, grid=grids[1], step_len=rnd.choice(steps)),
+        _sp_llm_rotate_item(rnd, 3, grid=grids[2], deg=rnd.choice([90,180,270])),
+        _sp_llm_route_item(rnd, 4, grid=grids[3], step_len=rnd.choice(steps)),
         _sp_llm_reflect_item(rnd, 5, grid=grids[4]),
     ]
 
 # ========= NUMERICAL via LLM =========
-# safe eval untuk validasi hasil LLM
-if '_safe_eval_expr' not in globals():
-    _ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd, ast.Pow, ast.Load)
-    def _safe_eval_expr(expr: str) -> float:
-        expr = expr.replace("×","*").replace("÷","/").replace("^","**")
-        if not re.fullmatch(r"[0-9\.\+\-\*\/\(\)\s]*", expr):
-            raise ValueError("invalid characters")
-        tree = ast.parse(expr, mode="eval")
-        for node in ast.walk(tree):
-            if not isinstance(node, _ALLOWED_NODES):
-                raise ValueError("node not allowed")
-        return eval(compile(tree, "<expr>", "eval"), {"__builtins__":{}})
-
+# validasi hasil LLM memakai _safe_eval_expr dari generator lokal
 def _verify_24(expr: str, nums: list, target: int = 24) -> bool:
     try:
         val = _safe_eval_expr(expr)
@@ -1435,6 +3676,7 @@ def _verify_24(expr: str, nums: list, target: int = 24) -> bool:
     except Exception:
         return False
 
+@escalating("target_24")
 def _num_llm_24_item(rnd: random.Random, idx:int) -> dict:
     prompt = """
 Buat puzzle 24 yang solvable.
@@ -1447,12 +3689,13 @@ Output JSON:
 }
 Syarat: numbers 1..13 (boleh berulang), oneSolution valid mencapai 24. JSON only.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="target_24")
     nums = list(data.get("numbers") or [])
     if len(nums) != 4: raise RuntimeError("LLM 24: angka != 4")
     sol = str(data.get("oneSolution","")).strip()
     if not _verify_24(sol, nums, 24):
         raise RuntimeError("LLM 24: solusi tidak valid")
+    _llm_remember(prompt, data)
     return {
         "itemId": f"num_24_{idx}",
         "variant": "target_24",
@@ -1463,6 +3706,7 @@ Syarat: numbers 1..13 (boleh berulang), oneSolution valid mencapai 24. JSON only
         "metadata": {"mustUseAllNumbers": True, "allowParentheses": True, "difficulty": "easy"}
     }
 
+@escalating("equation_fill")
 def _num_llm_equation_fill_item(rnd: random.Random, idx:int, level:str="medium") -> dict:
     prompt = f"""
 Buat persamaan dengan kotak kosong ('□') yang harus diisi digit agar benar.
@@ -1475,7 +3719,7 @@ Output JSON:
 }}
 Ketentuan: {1 if level=='easy' else 2}–3 kotak, + - × ÷ boleh, tanpa leading zero ilegal. JSON only.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="equation_fill")
     left = str(data.get("left","")).strip()
     right = str(data.get("right","")).strip()
     sols = [str(x) for x in (data.get("solutions") or [])]
@@ -1494,6 +3738,7 @@ Ketentuan: {1 if level=='easy' else 2}–3 kotak, + - × ÷ boleh, tanpa leading
         ok = False
     if not ok: raise RuntimeError("LLM eq: tidak seimbang")
 
+    _llm_remember(prompt, data)
     return {
         "itemId": f"num_eq_{idx}",
         "variant": "equation_fill",
@@ -1504,6 +3749,7 @@ Ketentuan: {1 if level=='easy' else 2}–3 kotak, + - × ÷ boleh, tanpa leading
         "metadata": {"difficulty": level, "original": {"left": le, "right": ri}}
     }
 
+@escalating("function_machine")
 def _num_llm_function_machine_item(rnd: random.Random, idx:int) -> dict:
     prompt = """
 Buat soal komposisi fungsi sederhana.
@@ -1517,7 +3763,7 @@ Output JSON:
 }
 Ketentuan: f,g linear/sederhana; steps konsisten dengan answer. JSON only.
 """
-    data = _llm_json(prompt)
+    data = _llm_json(prompt, variant="function_machine")
     fdef = data.get("functions",{}).get("f","")
     gdef = data.get("functions",{}).get("g","")
     query = data.get("query","")
@@ -1537,6 +3783,7 @@ Ketentuan: f,g linear/sederhana; steps konsisten dengan answer. JSON only.
     if abs(float(val) - float(ans)) > 1e-6:
         raise RuntimeError("LLM fn: mismatch evaluasi")
 
+    _llm_remember(prompt, data)
     return {
         "itemId": f"num_fn_{idx}",
         "variant": "function_machine",
@@ -1550,12 +3797,249 @@ Ketentuan: f,g linear/sederhana; steps konsisten dengan answer. JSON only.
 def generate_numerical_bundle_llm(rnd: random.Random, difficulty_hint: Optional[str]) -> List[dict]:
     return [
         _num_llm_24_item(rnd, 1),                              # Easy (LLM)
-        _gen_num_maze(rnd, 2, grid=3, max_steps=4),            # Easy (lokal stabil)
+        _gen_num_maze(rnd, 2, grid=3, max_steps=4, difficulty=difficulty_hint),  # ikut difficulty_hint (lokal stabil)
         _num_llm_equation_fill_item(rnd, 3, level="medium"),   # Medium (LLM)
         _num_llm_function_machine_item(rnd, 4),                # Medium (LLM)
-        random.choice([_gen_num_modular, _gen_num_base_convert, _gen_num_prob_ratio])(rnd, 5)  # Hard (lokal)
+        rnd.choice([_gen_num_modular, _gen_num_base_convert, _gen_num_prob_ratio])(rnd, 5)  # Hard (lokal)
     ]
 
+_LOCAL_GENERATORS = {
+    "memory": generate_memory_bundle,
+    "spatial": generate_spatial_bundle,
+    "numerical": generate_numerical_bundle,
+}
+
+_LLM_GENERATORS = {
+    "memory": generate_memory_bundle_llm,
+    "spatial": generate_spatial_bundle_llm,
+    "numerical": generate_numerical_bundle_llm,
+}
+
+# ========= LLM: satu round-trip per bundle =========
+# Mode batch (LLM_BUNDLE_MODE=batch): bundle dijalankan sekali dalam fase kumpul, prompt item LLM-nya
+# digabung jadi satu permintaan {"items": [...]}, lalu tiap hasil divalidasi builder aslinya. Item yang
+# gagal diminta ulang bersama dalam satu batch susulan (model berat bila MODEL_ESCALATE=1).
+# Bandingkan dengan mode per item: python benchmarks/bench_bundle.py
+LLM_BUNDLE_MODE = os.getenv("LLM_BUNDLE_MODE", "items").strip().lower()   # items | batch
+
+M_BUNDLE_ITEMS = Counter("llm_bundle_items_total", "Item bundle mode batch per tahap", ("type", "stage", "result"))
+
+def _batch_prompt(pending: List[_PendingItem]) -> str:
+    tasks = "\n".join(f"### TUGAS {i}\n{p.prompt.strip()}\n" for i, p in enumerate(pending, 1))
+    return (f"Kerjakan {len(pending)} TUGAS berikut secara terpisah, masing-masing sesuai ketentuannya sendiri.\n"
+            f'Output JSON: {{"items": [<hasil TUGAS 1>, ..., <hasil TUGAS {len(pending)}>]}} '
+            f"berurutan, tepat {len(pending)} elemen.\n\n{tasks}")
+
+def _llm_batch_fetch(pending: List[_PendingItem], t: str) -> Dict[str, str]:
+    data = _llm_json(_batch_prompt(pending), timeout_sec=90, variant=f"bundle_{t}")
+    outs = data.get("items") if isinstance(data, dict) else data
+    res = {}
+    for p, out in zip(pending, outs if isinstance(outs, list) else []):
+        if isinstance(out, dict):
+            res[_prompt_key(p.prompt)] = json.dumps(out, ensure_ascii=False)
+    return res
+
+def generate_bundle_llm_batched(t: str, rnd: random.Random, difficulty: Optional[str], mix: Optional[List[str]] = None) -> List[dict]:
+    token = _llm_batch.set({"collect": True, "data": {}})
+    try:
+        items = generate_mixed_bundle(t, rnd, difficulty, mix, use_llm=True) if mix else _LLM_GENERATORS[t](rnd, difficulty)
+    finally:
+        _llm_batch.reset(token)
+    pending = [i for i, it in enumerate(items) if isinstance(it, _PendingItem)]
+    for stage in ("first", "retry"):
+        if not pending:
+            break
+        esc = _escalated.set(stage == "retry" and MODEL_ESCALATE)
+        try:
+            data = _llm_batch_fetch([items[i] for i in pending], t)
+        finally:
+            _escalated.reset(esc)
+        token = _llm_batch.set({"collect": False, "data": data})
+        failed = []
+        try:
+            for i in pending:
+                try:
+                    items[i] = items[i].build()
+                    M_BUNDLE_ITEMS.inc(t, stage, "ok")
+                except (CircuitOpen, GeminiSaturated, DeadlineExceeded, LLMUnavailable):
+                    raise
+                except Exception:
+                    M_BUNDLE_ITEMS.inc(t, stage, "failed")
+                    failed.append(i)
+        finally:
+            _llm_batch.reset(token)
+        pending = failed
+    if pending:
+        raise RuntimeError(f"LLM batch: {len(pending)} item gagal validasi")
+    return items
+
+def generate_bundle_llm(t: str, rnd: random.Random, difficulty: Optional[str], mix: Optional[List[str]] = None) -> List[dict]:
+    if LLM_BUNDLE_MODE == "batch":
+        return generate_bundle_llm_batched(t, rnd, difficulty, mix)
+    if mix:
+        return generate_mixed_bundle(t, rnd, difficulty, mix, use_llm=True)
+    return _LLM_GENERATORS[t](rnd, difficulty)
+
+# ========= Campuran varian per bundle =========
+# Bundle default punya susunan varian tetap. Dengan variantMix (dari klien atau dipilih adaptif), tiap slot
+# dibangun dari generator varian itu sendiri dengan parameter level yang sama seperti bundle default.
+_VARIANT_POOL = {
+    "memory": ("lexicon_match", "sequence_missing", "scene_recall"),
+    "spatial": ("map_rotate", "route_nav", "mirror_reflect"),
+    "numerical": ("target_24", "number_maze", "equation_fill", "function_machine",
+                  "modular_arith", "base_convert", "prob_ratio"),
+}
+
+def _level(difficulty: Optional[str], default: str = "easy") -> str:
+    d = (difficulty or "").lower()
+    if d in ("hard", "sulit"): return "hard"
+    if d in ("medium", "sedang"): return "medium"
+    if d in ("easy", "mudah"): return "easy"
+    return default
+
+def normalize_mix(t: str, mix: Optional[List[str]]) -> Optional[List[str]]:
+    picked = [v for v in (mix or []) if v in _VARIANT_POOL.get(t, ())][:5]
+    if not picked:
+        return None
+    return (picked * 5)[:5]
+
+def _bundle_slot(variant: str, rnd: random.Random, idx: int, level: str, use_llm: bool) -> dict:
+    if variant == "lexicon_match":
+        pairs = {"easy": 3, "medium": 4, "hard": 5}[level]
+        return _mem_llm_lexicon_item(rnd, idx, pairs) if use_llm else _gen_memory_lexicon(rnd, idx, rnd.choice(_ALLOWED_REGIONS), pairs_count=pairs)
+    if variant == "sequence_missing":
+        length, masked = {"easy": (6, 2), "medium": (7, 2), "hard": (9, 3)}[level]
+        return (_mem_llm_sequence_item if use_llm else _gen_memory_sequence_missing)(rnd, idx, length, masked)
+    if variant == "scene_recall":
+        grid, obj = {"easy": (4, 3), "medium": (4, 3), "hard": (5, 4)}[level]
+        return (_mem_llm_scene_item if use_llm else _gen_memory_scene_recall)(rnd, idx, grid, obj)
+    if variant == "map_rotate":
+        grid = {"easy": 3, "medium": 4, "hard": 5}[level]
+        deg = rnd.choice([90, 180, 270])
+        return _sp_llm_rotate_item(rnd, idx, grid=grid, deg=deg) if use_llm else _gen_spatial_rotate(rnd, idx, grid=grid, deg=deg)
+    if variant == "route_nav":
+        grid = {"easy": 3, "medium": 4, "hard": 5}[level]
+        steps = rnd.choice({"easy": [3, 4], "medium": [4, 5], "hard": [5, 6]}[level])
+        return _sp_llm_route_item(rnd, idx, grid=grid, step_len=steps) if use_llm else _gen_spatial_route(rnd, idx, grid=grid, steps=steps)
+    if variant == "mirror_reflect":
+        grid = {"easy": 4, "medium": 5, "hard": 5}[level]
+        return (_sp_llm_reflect_item if use_llm else _gen_spatial_reflect)(rnd, idx, grid=grid)
+    if variant == "target_24":
+        return (_num_llm_24_item if use_llm else _gen_num_24)(rnd, idx)
+    if variant == "number_maze":
+        return _gen_num_maze(rnd, idx, grid=3, max_steps=4, difficulty=level)
+    if variant == "equation_fill":
+        return (_num_llm_equation_fill_item if use_llm else _gen_num_equation_fill)(rnd, idx, level=level)
+    if variant == "function_machine":
+        return (_num_llm_function_machine_item if use_llm else _gen_num_function_machine)(rnd, idx)
+    # varian numerik hard selalu lokal
+    return {"modular_arith": _gen_num_modular, "base_convert": _gen_num_base_convert,
+            "prob_ratio": _gen_num_prob_ratio}[variant](rnd, idx)
+
+def generate_mixed_bundle(t: str, rnd: random.Random, difficulty: Optional[str], mix: List[str], use_llm: bool = False) -> List[dict]:
+    level = _level(difficulty)
+    return [_bundle_slot(v, rnd, i, level, use_llm) for i, v in enumerate(mix, 1)]
+
+def local_bundle(t: str, rnd: random.Random, difficulty: Optional[str], mix: Optional[List[str]] = None) -> List[dict]:
+    if mix:
+        return generate_mixed_bundle(t, rnd, difficulty, mix)
+    return _LOCAL_GENERATORS[t](rnd, difficulty)
+
+# ========= Skill pemain (Elo per tipe & varian) & challenge adaptif =========
+# Rating pemain per (tipe, varian) dan rating item per (tipe, varian, level) diperbarui O(1) dari tiap
+# jawaban yang dinilai (submit challenge, attempt quiz): satu file JSON kecil per pemain + satu file per
+# (tipe, varian) untuk rating item. Setiap update membaca ulang file di bawah flock, jadi beberapa worker
+# uvicorn tidak saling menimpa. /v1/challenges/new tanpa difficulty/variantMix dari klien memakai file
+# pemain: level dipilih agar peluang benar mendekati SKILL_TARGET, slot bundle condong ke varian terlemah.
+SKILL_DIR = DATA_DIR / "skills"
+SKILL_TARGET = float(os.getenv("SKILL_TARGET", "0.7"))
+SKILL_K_PLAYER = float(os.getenv("SKILL_K_PLAYER", "40"))
+SKILL_K_MIN = float(os.getenv("SKILL_K_MIN", "12"))
+SKILL_K_ITEM = float(os.getenv("SKILL_K_ITEM", "6"))
+_SKILL_START = 1000.0
+_LEVEL_RATING = {"easy": 850.0, "medium": 1000.0, "hard": 1150.0}
+
+_skill_lock = threading.Lock()
+
+def _player_key(name: str) -> str:
+    return hashlib.sha1(name.strip().lower().encode("utf-8")).hexdigest()[:16]
+
+def load_player_skill(name: str) -> dict:
+    return _read_json(SKILL_DIR / f"{_player_key(name)}.json") or {"player": name.strip(), "ratings": {}}
+
+def _item_path(t: str, variant: str) -> Path:
+    return SKILL_DIR / "items" / f"{t}-{variant}.json"
+
+def _load_item_ratings(t: str, variant: str) -> dict:
+    # {level: [rating, jumlah]}; tabel tunggal lama (_items.json) dipakai sebagai nilai awal
+    doc = _read_json(_item_path(t, variant))
+    if doc is None:
+        doc = ((_read_json(SKILL_DIR / "_items.json") or {}).get(t) or {}).get(variant) or {}
+    return doc
+
+@contextlib.contextmanager
+def _file_lock(path: Path):
+    # kunci antar-proses (flock) untuk read-modify-write; tanpa fcntl (Windows) hanya kunci thread di atas
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path.with_suffix(path.suffix + ".lock"), "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _p_correct(theta: float, beta: float) -> float:
+    return 1.0 / (1.0 + 10 ** ((beta - theta) / 400.0))
+
+def record_skill(player_name: Optional[str], t: str, outcomes: List[Tuple[str, str, bool]]) -> None:
+    # outcomes: (varian, level, benar); rating disimpan sebagai [nilai, jumlah jawaban]
+    if not player_name or not player_name.strip() or not outcomes:
+        return
+    player_path = SKILL_DIR / f"{_player_key(player_name)}.json"
+    variants = sorted({v for v, _, _ in outcomes})
+    with _skill_lock, contextlib.ExitStack() as locks:
+        # urutan kunci tetap (pemain, lalu varian terurut) agar dua worker tidak saling menunggu
+        locks.enter_context(_file_lock(player_path))
+        for v in variants:
+            locks.enter_context(_file_lock(_item_path(t, v)))
+        doc = load_player_skill(player_name)
+        items = {v: _load_item_ratings(t, v) for v in variants}
+        for variant, level, ok in outcomes:
+            pr = doc["ratings"].setdefault(t, {}).setdefault(variant, [_SKILL_START, 0])
+            ir = items[variant].setdefault(level, [_LEVEL_RATING[level], 0])
+            err = (1.0 if ok else 0.0) - _p_correct(pr[0], ir[0])
+            k = max(SKILL_K_MIN, SKILL_K_PLAYER / (1 + pr[1] / 20))
+            pr[0], pr[1] = round(pr[0] + k * err, 2), pr[1] + 1
+            ir[0], ir[1] = round(ir[0] - SKILL_K_ITEM * err, 2), ir[1] + 1
+        doc["updated_at"] = _now_iso()
+        _atomic_write(player_path, doc)
+        for v in variants:
+            _atomic_write(_item_path(t, v), items[v])
+
+def adaptive_plan(player_name: str, t: str) -> Optional[dict]:
+    # None = belum ada riwayat untuk tipe ini (pakai difficulty dari klien)
+    ratings = load_player_skill(player_name)["ratings"].get(t)
+    if not ratings:
+        return None
+    pool = _VARIANT_POOL[t]
+    table = {v: _load_item_ratings(t, v) for v in pool}
+    beta = {(v, lv): table[v].get(lv, [r])[0] for v in pool for lv, r in _LEVEL_RATING.items()}
+    mean = sum(r[0] for r in ratings.values()) / len(ratings)
+
+    def p(v: str, level: str) -> float:
+        return _p_correct(ratings.get(v, [mean])[0], beta[(v, level)])
+
+    level = min(_LEVEL_RATING, key=lambda lv: abs(sum(p(v, lv) for v in pool) / len(pool) - SKILL_TARGET))
+    # varian terlemah dulu; tiap varian dapat slot sebelum ada yang dapat slot kedua
+    weakest = sorted(pool, key=lambda v: (p(v, level), pool.index(v)))
+    mix = sorted((weakest * 5)[:5], key=pool.index)
+    return {"level": level, "mix": mix, "expected": round(sum(p(v, level) for v in mix) / len(mix), 3)}
+
 # ========= Endpoint baru yang memanggil LLM / fallback =========
 class ChallengeCreateInLLM(BaseModel):
     type: str                         # "memory" | "spatial" | "numerical"
@@ -1568,8 +4052,10 @@ class ChallengeCreateInLLM(BaseModel):
     use_llm: bool = True
     variantMix: Optional[List[str]] = None
     numerical_mix: Optional[List[str]] = None
+    player_name: Optional[str] = None
 
 @app.post("/v1/challenges/new")
+@with_deadline("challenge")
 def create_challenge_upgraded(payload: ChallengeCreateInLLM):
     seed = payload.seed if payload.seed is not None else int(time.time()*1000) % (2**31-1)
     rnd = random.Random(seed)
@@ -1578,42 +4064,745 @@ def create_challenge_upgraded(payload: ChallengeCreateInLLM):
         return JSONResponse({"error":"type harus 'memory'|'spatial'|'numerical'"}, status_code=400)
 
     use_llm = bool(payload.use_llm)
-
+    fallback = False
+    if use_llm and not llm_bundle_available(t):
+        # breaker terbuka: langsung ke generator lokal tanpa menunggu timeout LLM
+        use_llm, fallback = False, True
+
+    difficulty, mix = payload.difficulty, normalize_mix(t, payload.variantMix)
+    # adaptive default True sejak awal: rencana hanya mengisi yang tidak dikirim klien, pilihan eksplisit tetap dipakai
+    adaptive = None
+    if payload.adaptive and payload.player_name and (payload.difficulty is None or payload.variantMix is None):
+        adaptive = adaptive_plan(payload.player_name, t)
+    if adaptive:
+        if payload.difficulty is None: difficulty = adaptive["level"]
+        if payload.variantMix is None: mix = adaptive["mix"]
+
+    models_used: set = set()
+    _llm_models_used.set(models_used)
     try:
-        if t == "memory":
-            items = generate_memory_bundle_llm(rnd, payload.difficulty) if use_llm else generate_memory_bundle(rnd, payload.difficulty)
-        elif t == "spatial":
-            items = generate_spatial_bundle_llm(rnd, payload.difficulty) if use_llm else generate_spatial_bundle(rnd, payload.difficulty)
-        else:
-            items = generate_numerical_bundle_llm(rnd, payload.difficulty) if use_llm else generate_numerical_bundle(rnd, payload.difficulty)
+        items = generate_bundle_llm(t, rnd, difficulty, mix) if use_llm else local_bundle(t, rnd, difficulty, mix)
     except Exception as e:
-        if t == "memory":
-            items = generate_memory_bundle(rnd, payload.difficulty)
-        elif t == "spatial":
-            items = generate_spatial_bundle(rnd, payload.difficulty)
-        else:
-            items = generate_numerical_bundle(rnd, payload.difficulty)
+        # RNG baru dari seed yang sama: item fallback harus identik dengan hasil regenerasi saat dibaca
+        use_llm, fallback = False, True
+        items = local_bundle(t, random.Random(seed), difficulty, mix)
 
     # paksa 5 item
     if len(items) != 5:
         items = (items + items[:5])[:5]
 
+    source = "fallback" if fallback else "llm" if use_llm else "local"
+    M_CHALLENGES.inc(t, source)
+    for it in items:
+        # di bundle LLM, maze & soal hard numerik tetap lokal
+        M_CHALLENGE_ITEMS.inc(t, it.get("variant"), "llm" if use_llm and it.get("variant") in _LLM_BUNDLE_VARIANTS[t] else "local")
+
     doc = {
-        "type": t, "difficulty": payload.difficulty, "count": 5,
+        "type": t, "difficulty": difficulty, "count": 5,
         "adaptive": payload.adaptive, "seed": seed, "locale": payload.locale,
         "timeBudgetSec": payload.timeBudgetSec, "items": items,
-        "model": MODEL_NAME if use_llm else "local-procedural", "llm_used": use_llm
+        "model": (",".join(sorted(models_used)) or MODEL_NAME) if use_llm else "local-procedural", "llm_used": use_llm,
+        "llm_fallback": fallback
     }
-    if 'save_challenge_local' in globals():
-        cid = save_challenge_local(doc)
-    else:
-        cid = save_quiz_local(items, {"source":"challenge","type":t,"difficulty":payload.difficulty})
+    if mix: doc["variantMix"] = mix
+    if payload.player_name: doc["player_name"] = payload.player_name
+    if adaptive: doc["adaptivePlan"] = adaptive
+    cid = save_challenge_local(doc)
 
-    return {
+    out = {
         "challengeId": cid,
         "type": t,
-        "difficulty": payload.difficulty,
+        "difficulty": difficulty,
         "generatedAt": _now_iso(),
-        "items": _sanitize_items_llm(items),
-        "scoring": {"perCorrect": 10, "perWrong": 0, "timeBonus": {"enabled": True}}
+        "items": sanitize_items(items),
+        "scoring": CHALLENGE_SCORING
+    }
+    if adaptive: out["adaptive"] = adaptive
+    return out
+
+# ========= Submit & grading challenge =========
+class ItemAnswerIn(BaseModel):
+    itemId: str
+    answer: Any = None
+    time_sec: int = 0
+
+class ChallengeSubmitIn(BaseModel):
+    challengeId: str
+    player_name: Optional[str] = None
+    answers: List[ItemAnswerIn]
+
+def _grade_challenge_item(item: dict, answer: Any) -> bool:
+    mode = (item.get("answerSpec") or {}).get("mode")
+    sol = item.get("solution")
+    try:
+        if mode == "path":
+            # jalur mana pun yang valid & mencapai target dianggap benar, bukan hanya pathCells
+            return _maze_check_path(item.get("render") or {}, answer)
+        if mode == "expression":
+            return _verify_24(str(answer), sol.get("numbers", []), sol.get("target", 24))
+        if mode == "mapping":
+            return isinstance(answer, dict) and {str(k): str(v) for k,v in answer.items()} == {str(k): str(v) for k,v in sol.items()}
+        if mode in ("sequence_fill", "digits"):
+            # wajib list per slot; string utuh tidak dipecah per karakter
+            if not isinstance(answer, list) or len(answer) != len(sol): return False
+            return [str(x).strip() for x in answer] == [str(x) for x in sol]
+        if mode == "free":
+            s = str(answer).strip().replace(",", ".")
+            val = Fraction(s)
+            frac = (item.get("metadata") or {}).get("fraction")
+            exact = Fraction(int(frac[0]), int(frac[1])) if frac else Fraction(sol)
+            if isinstance(sol, int) or exact.denominator == 1:
+                return val == exact
+            if "/" in s:
+                return val == exact
+            # desimal dari pecahan tak berujung (mis. 40/3, 1/21): cukup tepat 2 desimal
+            return abs(val - exact) <= Fraction(1, 200)
+        return str(answer) == str(sol)
+    except Exception:
+        return False
+
+@app.post("/v1/challenges/submit")
+def submit_challenge(payload: ChallengeSubmitIn):
+    ch = load_challenge_local(payload.challengeId)
+    if not ch:
+        return JSONResponse({"error":"challengeId tidak ditemukan"}, status_code=404)
+    if ch.get("stale"):
+        return JSONResponse({"error":"challenge dibuat dengan versi generator lama, tidak bisa dinilai"}, status_code=410)
+    by_id = {it.get("itemId"): it for it in ch.get("items", [])}
+
+    results = []
+    correct = wrong = 0
+    for ans in payload.answers:
+        it = by_id.get(ans.itemId)
+        if not it:
+            continue
+        ok = _grade_challenge_item(it, ans.answer)
+        if ok: correct += 1
+        else: wrong += 1
+        results.append({"itemId": ans.itemId, "answer": ans.answer, "time_sec": ans.time_sec, "is_correct": ok})
+
+    score = {"total": correct * 10, "correct": correct, "wrong": wrong}
+    level = _level(ch.get("difficulty"))
+    record_skill(payload.player_name or ch.get("player_name"), ch.get("type"), [
+        (by_id[r["itemId"]].get("variant") or "unknown",
+         _level((by_id[r["itemId"]].get("metadata") or {}).get("difficulty"), level), r["is_correct"])
+        for r in results
+    ])
+    sid = save_submission_local({
+        "challengeId": payload.challengeId, "type": ch.get("type"), "difficulty": ch.get("difficulty"),
+        "player": {"name": payload.player_name} if payload.player_name else {},
+        "score": score, "results": results,
+    })
+    return {"submissionId": sid, "challengeId": payload.challengeId, "score": score, "results": results}
+
+@app.get("/v1/players/{player_name}/skills")
+def player_skills(player_name: str):
+    doc = load_player_skill(player_name)
+    return {"player": doc["player"], "updatedAt": doc.get("updated_at"),
+            "ratings": {t: {v: {"rating": r[0], "answers": r[1]} for v, r in vs.items()} for t, vs in doc["ratings"].items()},
+            "next": {t: adaptive_plan(player_name, t) for t in _VARIANT_POOL if t in doc["ratings"]}}
+
+# ========= Query berhalaman (dashboard guru) =========
+LIST_MAX_LIMIT = 100
+
+def _norm_time(v: Optional[str]) -> Optional[str]:
+    # ISO 8601 apa pun -> format created_at ("YYYY-MM-DDTHH:MM:SSZ", UTC)
+    if not v:
+        return None
+    dt = datetime.fromisoformat(v.strip().replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(timespec="seconds") + "Z"
+
+def _encode_cursor(key: str, pos: Optional[int]) -> Optional[str]:
+    return None if pos is None else base64.urlsafe_b64encode(f"{key}|{pos}".encode()).decode().rstrip("=")
+
+def _decode_cursor(key: str, cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    try:
+        k, _, pos = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().rpartition("|")
+        pos = int(pos)
+    except ValueError:
+        raise ValueError("cursor tidak valid")
+    if k != key:
+        raise ValueError("cursor tidak cocok dengan filter")
+    return pos
+
+def list_docs(coll: str, load, summarize, filters: Dict[str, Optional[str]], since: Optional[str],
+              until: Optional[str], limit: int, cursor: Optional[str]):
+    # indeks dari filter pertama yang diisi; filter lain dicocokkan per dokumen kandidat
+    try:
+        since, until = _norm_time(since), _norm_time(until)
+    except ValueError:
+        return JSONResponse({"error": "since/until harus ISO 8601"}, status_code=400)
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        return JSONResponse({"error": f"limit harus 1..{LIST_MAX_LIMIT}"}, status_code=400)
+    given = [(f, str(v)) for f, v in filters.items() if v]
+    field, value = given[0] if given else ("all", None)
+    key = f"{coll}:{field}:{value}:{since}:{until}"
+    try:
+        pos = _decode_cursor(key, cursor)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    docs: Dict[str, dict] = {}
+
+    def match(did: str) -> bool:
+        doc = load(did)
+        if doc is None:
+            return False
+        keys = dict(_index_keys(coll, doc))
+        if any((keys.get(f) or "").strip().lower() != v.strip().lower() for f, v in given[1:]):
+            return False
+        docs[did] = doc
+        return True
+
+    ids, nxt = query_index(coll, field, value, since, until, limit, pos, match)
+    return {"items": [summarize(docs[i]) for i in ids], "nextCursor": _encode_cursor(key, nxt)}
+
+@app.get("/quizzes")
+def list_quizzes(language: Optional[str] = None, source: Optional[str] = None, since: Optional[str] = None,
+                 until: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None):
+    def summarize(q: dict) -> dict:
+        meta = q.get("meta") or {}
+        return {"quiz_id": q["_id"], "created_at": q["created_at"], "model": q.get("model"), "source": meta.get("source"),
+                "language": meta.get("language"), "difficulty": meta.get("difficulty"),
+                "topic_filter": meta.get("topic_filter"), "items": len(q.get("items") or [])}
+    return list_docs("quizzes", load_quiz_local, summarize, {"language": language, "source": source},
+                     since, until, limit, cursor)
+
+@app.get("/quiz/attempts")
+def list_attempts(quiz_id: Optional[str] = None, player_name: Optional[str] = None, since: Optional[str] = None,
+                  until: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None):
+    def summarize(a: dict) -> dict:
+        return {"attempt_id": a["_id"], "quiz_id": a.get("quiz_id"), "created_at": a["created_at"],
+                "player": a.get("player") or {}, "score": a.get("score"), "duration_sec": a.get("duration_sec")}
+    return list_docs("attempts", lambda i: _read_json(ATTEMPT_DIR / f"{i}.json"), summarize,
+                     {"quiz_id": quiz_id, "player": player_name}, since, until, limit, cursor)
+
+@app.get("/v1/challenges")
+def list_challenges(type: Optional[str] = None, player_name: Optional[str] = None, since: Optional[str] = None,
+                    until: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None):
+    # dibaca mentah: item challenge lokal tidak perlu diregenerasi untuk daftar
+    def summarize(c: dict) -> dict:
+        return {"challengeId": c["_id"], "created_at": c["created_at"], "type": c.get("type"),
+                "difficulty": c.get("difficulty"), "player_name": c.get("player_name"),
+                "llm_used": c.get("llm_used", False), "adaptive": c.get("adaptive")}
+    return list_docs("challenges", lambda i: _read_json(CHALLENGE_DIR / f"{i}.json"), summarize,
+                     {"player": player_name, "type": type}, since, until, limit, cursor)
+
+@app.get("/v1/submissions")
+def list_submissions(challengeId: Optional[str] = None, player_name: Optional[str] = None, type: Optional[str] = None,
+                     since: Optional[str] = None, until: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None):
+    def summarize(d: dict) -> dict:
+        return {"submissionId": d["_id"], "challengeId": d.get("challengeId"), "created_at": d["created_at"],
+                "type": d.get("type"), "player": d.get("player") or {}, "score": d.get("score")}
+    return list_docs("submissions", lambda i: _read_json(SUBMISSION_DIR / f"{i}.json"), summarize,
+                     {"challengeId": challengeId, "player": player_name, "type": type}, since, until, limit, cursor)
+
+# ========= GET dokumen (ETag, 304, gzip/brotli) =========
+# Dideklarasikan setelah /quiz/attempts dan /v1/challenges agar rute daftar tidak tertangkap sebagai {id}.
+@app.get("/quiz/{quiz_id}")
+def get_quiz(quiz_id: str, request: Request):
+    def build(qid: str) -> Optional[dict]:
+        q = load_quiz_local(qid)
+        return quiz_view(q) if q else None
+    return serve_doc(request, "quizzes", quiz_id, build)
+
+@app.get("/v1/challenges/{challenge_id}")
+def get_challenge(challenge_id: str, request: Request):
+    def build(cid: str) -> Optional[dict]:
+        # dokumen seed-only diregenerasi (variantMix ikut) sebelum dirender
+        c = load_challenge_local(cid)
+        return challenge_view(c) if c else None
+    return serve_doc(request, "challenges", challenge_id, build)
+
+# ========= Room quiz multiplayer (WebSocket) =========
+# Host membuat room dari quiz_id (POST /quiz/rooms), membuka WS dengan hostToken lalu mengirim {"type":"start"}.
+# Pemain bergabung lewat WS /quiz/rooms/{room}/ws?name=...; pesan state pertama berisi token pemain yang wajib
+# dikirim ulang (?token=...) untuk menyambung kembali dengan nama yang sama. Soal didorong server dengan timer dan jawaban
+# dinilai langsung memakai score_attempt (700 + bonus waktu, waktu diukur server). Perubahan leaderboard
+# dikumpulkan lalu dikirim per tick (ROOM_TICK_SEC), bukan per jawaban. State room hanya di memori worker;
+# attempt semua pemain disimpan sekaligus saat permainan selesai. Memori per room dibatasi: jumlah pemain,
+# antrean kirim per socket (klien lambat diputus, bukan ditunggu), satu jawaban per soal per pemain.
+ROOM_MAX = int(os.getenv("ROOM_MAX", "500"))
+ROOM_MAX_PLAYERS = int(os.getenv("ROOM_MAX_PLAYERS", "200"))
+ROOM_QUESTION_SEC = int(os.getenv("ROOM_QUESTION_SEC", "20"))
+ROOM_REVEAL_SEC = float(os.getenv("ROOM_REVEAL_SEC", "3"))
+ROOM_TICK_SEC = float(os.getenv("ROOM_TICK_SEC", "0.5"))
+ROOM_LOBBY_TTL_SEC = float(os.getenv("ROOM_LOBBY_TTL_SEC", "1800"))
+ROOM_LATE_JOIN = os.getenv("ROOM_LATE_JOIN", "1") == "1"        # boleh bergabung setelah permainan mulai
+ROOM_SEND_QUEUE = int(os.getenv("ROOM_SEND_QUEUE", "32"))
+ROOM_LEADERBOARD_TOP = int(os.getenv("ROOM_LEADERBOARD_TOP", "10"))
+ROOM_MSG_MAX = 1024
+
+M_ROOMS = Counter("quiz_rooms_total", "Room quiz per kejadian", ("event",))   # created|started|finished|aborted|expired
+
+class _Conn:
+    # satu socket: antrean kirim terbatas + satu task penulis
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ROOM_SEND_QUEUE)
+        self.closed = False
+        self.writer = asyncio.create_task(self._write())
+
+    def send(self, text: str) -> None:
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.abort(1013)
+
+    def finish(self) -> None:
+        # kirim sisa antrean lalu tutup normal
+        if not self.closed:
+            self.closed = True
+            try: self.queue.put_nowait(None)
+            except asyncio.QueueFull: self.abort(1013)
+
+    def abort(self, code: int) -> None:
+        self.closed = True
+        self.writer.cancel()
+        asyncio.create_task(self._close(code))
+
+    async def _close(self, code: int) -> None:
+        try: await self.ws.close(code=code)
+        except Exception: pass
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                text = await self.queue.get()
+                if text is None:
+                    await self._close(1000)
+                    return
+                await self.ws.send_text(text)
+        except Exception:
+            self.closed = True
+
+class _Player:
+    __slots__ = ("name", "conn", "token", "score", "answers", "answered")
+
+    def __init__(self, name: str, conn: _Conn):
+        self.name, self.conn = name, conn
+        self.token = uuid.uuid4().hex     # bukti kepemilikan nama saat sambung ulang
+        self.score = 0
+        self.answers: List[AnswerIn] = []
+        self.answered: set = set()
+
+class _Room:
+    def __init__(self, code: str, quiz: dict, question_sec: int):
+        self.code = code
+        self.quiz_id = quiz["_id"]
+        self.items = quiz.get("items") or []
+        self.meta = quiz.get("meta") or {}
+        self.model = quiz.get("model", MODEL_NAME)
+        self.question_sec = question_sec
+        self.host_token = uuid.uuid4().hex
+        self.host: Optional[_Conn] = None
+        self.players: Dict[str, _Player] = {}     # nama (lower) -> pemain
+        self.state = "lobby"                      # lobby | question | reveal | ended
+        self.index = -1
+        self.q_started = 0.0
+        self.n_answered = 0
+        self.created = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.dirty = False
+        self.sent: Dict[str, Tuple[int, int]] = {}   # nama -> (skor, peringkat) terakhir yang dikirim
+
+    def conns(self) -> List[_Conn]:
+        out = [p.conn for p in self.players.values() if p.conn is not None]
+        return out + [self.host] if self.host is not None else out
+
+    def broadcast(self, msg: dict) -> None:
+        text = json.dumps(msg, ensure_ascii=False)     # serialisasi sekali untuk semua socket
+        for c in self.conns():
+            c.send(text)
+
+    def question_msg(self) -> dict:
+        q = self.items[self.index]
+        left = max(0.0, self.q_started + self.question_sec - time.monotonic())
+        return {"type": "question", "index": self.index, "total": len(self.items), "remainingSec": round(left, 1),
+                "question": {"id": q.get("id"), "pertanyaan": q.get("pertanyaan"), "opsi": q.get("opsi")}}
+
+    def ranking(self) -> List[_Player]:
+        return sorted(self.players.values(), key=lambda p: (-p.score, p.name.lower()))
+
+    def top(self) -> List[dict]:
+        return [{"rank": i, "name": p.name, "score": p.score} for i, p in enumerate(self.ranking()[:ROOM_LEADERBOARD_TOP], 1)]
+
+    def flush_leaderboard(self) -> None:
+        # satu pesan per tick berisi pemain yang skor/peringkatnya berubah sejak tick sebelumnya
+        if not self.dirty:
+            return
+        self.dirty = False
+        delta = []
+        for i, p in enumerate(self.ranking(), 1):
+            if self.sent.get(p.name) != (p.score, i):
+                self.sent[p.name] = (p.score, i)
+                delta.append({"rank": i, "name": p.name, "score": p.score})
+        self.broadcast({"type": "leaderboard", "index": self.index, "answered": self.n_answered, "delta": delta})
+
+    def answer(self, p: _Player, index: Any, choice: Any) -> Optional[dict]:
+        if self.state != "question" or index != self.index or index in p.answered or not isinstance(choice, int):
+            return None
+        q = self.items[index]
+        ans = AnswerIn(question_id=str(q.get("id", "")), chosen_index=choice, time_sec=int(time.monotonic() - self.q_started))
+        score, _, out = score_attempt([q], [ans], self.question_sec)
+        p.score += score["total"]
+        p.answers.append(ans)
+        p.answered.add(index)
+        self.n_answered += 1
+        self.dirty = True
+        return {"type": "answered", "index": index, "correct": bool(out and out[0]["is_correct"]),
+                "points": score["total"], "score": p.score}
+
+    def snapshot(self, p: Optional[_Player]) -> dict:
+        out = {"type": "state", "room": self.code, "quiz_id": self.quiz_id, "state": self.state,
+               "questions": len(self.items), "questionSec": self.question_sec, "players": len(self.players)}
+        if p is not None:
+            out.update(name=p.name, score=p.score, token=p.token)
+        if self.state == "question":
+            out["current"] = self.question_msg()
+        return out
+
+_rooms: Dict[str, _Room] = {}
+
+def rooms_stats() -> dict:
+    # juga dipanggil dari thread scrape /metrics: salin dulu, jangan iterasi dict yang sedang diubah event loop
+    rooms = list(_rooms.values())
+    return {"rooms": len(rooms), "playing": sum(1 for r in rooms if r.state in ("question", "reveal")),
+            "sockets": sum(sum(1 for p in list(r.players.values()) if p.conn is not None) + (r.host is not None) for r in rooms)}
+
+def _purge_rooms() -> None:
+    now = time.monotonic()
+    for code, r in list(_rooms.items()):
+        if r.state == "lobby" and now - r.created > ROOM_LOBBY_TTL_SEC:
+            _rooms.pop(code, None)
+            for c in r.conns(): c.finish()
+            M_ROOMS.inc("expired")
+
+def _flush_room_attempts(room: _Room, players: List[_Player]) -> Dict[str, str]:
+    # satu hop threadpool di akhir permainan: attempt berbentuk sama dengan POST /quiz/attempts
+    ids = {}
+    level = _level(room.meta.get("difficulty"), "medium")
+    for p in players:
+        if not p.answers:
+            continue
+        score, duration, answers_out = score_attempt(room.items, p.answers, room.question_sec)
+        ids[p.name] = save_attempt_local({
+            "quiz_id": room.quiz_id, "player": {"name": p.name}, "score": score, "duration_sec": duration,
+            "max_time_sec": room.question_sec, "answers": answers_out, "meta": room.meta, "model": room.model,
+            "room": room.code,
+        })
+        record_skill(p.name, "quiz", [("mcq", level, a["is_correct"]) for a in answers_out])
+    return ids
+
+async def _run_room(room: _Room) -> None:
+    M_ROOMS.inc("started")
+    aborted = False
+    try:
+        for i in range(len(room.items)):
+            room.index, room.state, room.n_answered = i, "question", 0
+            room.q_started = time.monotonic()
+            room.broadcast(room.question_msg())
+            deadline = room.q_started + room.question_sec
+            while time.monotonic() < deadline:
+                await asyncio.sleep(min(ROOM_TICK_SEC, max(0.0, deadline - time.monotonic())))
+                room.flush_leaderboard()
+                live = sum(1 for p in room.players.values() if p.conn is not None and not p.conn.closed)
+                if live and room.n_answered >= live:
+                    break            # semua pemain aktif sudah menjawab
+            room.flush_leaderboard()
+            room.state = "reveal"
+            q = room.items[i]
+            room.broadcast({"type": "reveal", "index": i, "correct_index": letter_to_index(q.get("jawaban", "A")),
+                            "penjelasan": q.get("penjelasan"), "leaderboard": room.top()})
+            if i + 1 < len(room.items):
+                await asyncio.sleep(ROOM_REVEAL_SEC)
+    except asyncio.CancelledError:
+        aborted = True               # host mengakhiri lebih awal: jawaban yang sudah masuk tetap disimpan
+    room.state = "ended"
+    players = list(room.players.values())
+    try:
+        ids = await run_in_threadpool(_flush_room_attempts, room, players)
+    except Exception:
+        ids = {}
+    board = room.top()
+    ranks = {p.name: i for i, p in enumerate(room.ranking(), 1)}
+    for p in players:
+        if p.conn is not None:
+            p.conn.send(json.dumps({"type": "end", "leaderboard": board, "rank": ranks[p.name], "score": p.score,
+                                    "attempt_id": ids.get(p.name), "aborted": aborted}, ensure_ascii=False))
+            p.conn.finish()
+    if room.host is not None:
+        room.host.send(json.dumps({"type": "end", "leaderboard": board, "attempts": ids, "aborted": aborted}, ensure_ascii=False))
+        room.host.finish()
+    _rooms.pop(room.code, None)
+    M_ROOMS.inc("aborted" if aborted else "finished")
+
+class RoomCreateIn(BaseModel):
+    quiz_id: str
+    question_sec: int = ROOM_QUESTION_SEC
+
+@app.post("/quiz/rooms")
+async def create_quiz_room(payload: RoomCreateIn):
+    quiz = await run_in_threadpool(load_quiz_local, payload.quiz_id)
+    if not quiz or not quiz.get("items"):
+        return JSONResponse({"error": "quiz_id tidak ditemukan"}, status_code=404)
+    if not 5 <= payload.question_sec <= 300:
+        return JSONResponse({"error": "question_sec harus 5..300"}, status_code=400)
+    _purge_rooms()
+    if len(_rooms) >= ROOM_MAX:
+        return JSONResponse({"error": "jumlah room penuh"}, status_code=503)
+    code = uuid.uuid4().hex[:6].upper()
+    while code in _rooms:
+        code = uuid.uuid4().hex[:6].upper()
+    room = _Room(code, quiz, payload.question_sec)
+    _rooms[code] = room
+    M_ROOMS.inc("created")
+    return {"room": code, "hostToken": room.host_token, "quiz_id": room.quiz_id, "questions": len(room.items),
+            "questionSec": room.question_sec, "ws": f"/quiz/rooms/{code}/ws"}
+
+@app.websocket("/quiz/rooms/{room_code}/ws")
+async def quiz_room_ws(ws: WebSocket, room_code: str, name: Optional[str] = None, host_token: Optional[str] = None,
+                       token: Optional[str] = None):
+    await ws.accept()
+    room = _rooms.get(room_code.upper())
+    if room is None or room.state == "ended":
+        await ws.close(code=4404)
+        return
+    player: Optional[_Player] = None
+    if host_token is not None:
+        if not hmac.compare_digest(host_token, room.host_token):
+            await ws.close(code=4403)
+            return
+        if room.host is not None:
+            room.host.finish()
+    else:
+        name = (name or "").strip()[:32]
+        key = name.lower()
+        existing = room.players.get(key)
+        if not name:
+            await ws.close(code=4400)
+            return
+        if existing is not None:
+            if token is None:
+                await ws.close(code=4409)       # nama sudah dipakai pemain lain
+                return
+            if not hmac.compare_digest(token, existing.token):
+                await ws.close(code=4403)
+                return
+            if existing.conn is not None:
+                existing.conn.finish()          # pemilik sah mengambil alih dari socket lama
+        if existing is None and ((room.state != "lobby" and not ROOM_LATE_JOIN) or len(room.players) >= ROOM_MAX_PLAYERS):
+            await ws.close(code=4429)
+            return
+    conn = _Conn(ws)
+    if host_token is not None:
+        room.host = conn
+    else:
+        player = room.players.get(key)
+        if player is None:
+            player = room.players[key] = _Player(name, conn)
+            room.dirty = True
+        else:
+            player.conn = conn          # sambung ulang: skor & jawaban tetap
+        if room.host is not None:
+            room.host.send(json.dumps({"type": "joined", "name": name, "players": len(room.players)}, ensure_ascii=False))
+    conn.send(json.dumps(room.snapshot(player), ensure_ascii=False))
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+            text = msg.get("text")
+            if not text or len(text) > ROOM_MSG_MAX:
+                continue
+            try:
+                data = json.loads(text)
+            except ValueError:
+                continue
+            kind = data.get("type") if isinstance(data, dict) else None
+            if player is None:
+                if kind == "start" and room.task is None and room.items:
+                    room.task = asyncio.create_task(_run_room(room))
+                elif kind == "end" and room.task is not None and room.state in ("question", "reveal"):
+                    room.task.cancel()
+            elif kind == "answer":
+                ack = room.answer(player, data.get("index"), data.get("choice"))
+                if ack is not None:
+                    conn.send(json.dumps(ack))
+    except Exception:
+        pass
+    finally:
+        if not conn.closed:
+            conn.abort(1000)
+        if player is not None and player.conn is conn:
+            player.conn = None
+        elif player is None and room.host is conn:
+            room.host = None
+
+# ========= Batch generation (process pool) =========
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "0")) or (os.cpu_count() or 1)
+BATCH_MAX = int(os.getenv("BATCH_MAX", "20000"))
+_batch_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_batch_pool() -> ProcessPoolExecutor:
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+    return _batch_pool
+
+def _batch_jobs(count: int, types: List[str], difficulties: List[Optional[str]], base_seed: int, persist: bool) -> List[tuple]:
+    # round-robin tipe dulu, lalu difficulty; seed = base_seed + i agar setiap bundle bisa direproduksi
+    nt, nd = len(types), len(difficulties)
+    return [(types[i % nt], difficulties[(i // nt) % nd], (base_seed + i) % (2**31-1), persist) for i in range(count)]
+
+def _batch_build(job: tuple) -> dict:
+    # dijalankan di worker process: harus top-level & murni lokal (tanpa LLM)
+    t, difficulty, seed, persist = job
+    items = _LOCAL_GENERATORS[t](random.Random(seed), difficulty)
+    doc = {
+        "type": t, "difficulty": difficulty, "count": 5,
+        "adaptive": False, "seed": seed, "locale": "id-ID",
+        "timeBudgetSec": 600, "items": items,
+        "model": "local-procedural", "llm_used": False
     }
+    if persist:
+        # render siap-saji ditunda ke GET pertama: batch besar tidak membayar kompresi
+        return {"challengeId": save_challenge_local(doc, render=False), "type": t, "difficulty": difficulty, "seed": seed}
+    return doc
+
+def _batch_encode(doc: dict, sanitize: bool) -> str:
+    if sanitize and "items" in doc:
+        doc = dict(doc); doc["items"] = sanitize_items(doc["items"])
+    return json.dumps(doc, ensure_ascii=False) + "\n"
+
+def _batch_build_chunk(jobs: List[tuple], encode: bool = False, sanitize: bool = False) -> list:
+    # encode=True: serialisasi NDJSON di worker, parent cukup meneruskan string (IPC jauh lebih murah
+    # daripada pickle dokumen bersarang dengan SVG)
+    docs = [_batch_build(j) for j in jobs]
+    return [_batch_encode(d, sanitize) for d in docs] if encode else docs
+
+def _batch_chunksize(count: int, workers: int) -> int:
+    return max(1, min(64, count // (workers * 8)))
+
+def _run_windowed(pool: ProcessPoolExecutor, jobs: List[tuple], workers: int, encode: bool = False, sanitize: bool = False):
+    # submit per chunk dengan jendela terbatas (2 chunk per worker): request besar tidak memonopoli
+    # antrean pool bersama, dan chunk yang belum jalan dibatalkan bila generator ditutup (klien putus)
+    size = _batch_chunksize(len(jobs), workers)
+    chunks = iter([jobs[i:i+size] for i in range(0, len(jobs), size)])
+    inflight = deque()
+    try:
+        for ch in itertools.islice(chunks, workers * 2):
+            inflight.append(pool.submit(_batch_build_chunk, ch, encode, sanitize))
+        while inflight:
+            done = inflight.popleft().result()
+            nxt = next(chunks, None)
+            if nxt is not None:
+                inflight.append(pool.submit(_batch_build_chunk, nxt, encode, sanitize))
+            yield from done
+    finally:
+        for f in inflight:
+            f.cancel()
+
+def run_batch(jobs: List[tuple], workers: Optional[int] = None, encode: bool = False, sanitize: bool = False):
+    workers = workers or BATCH_WORKERS
+    if workers <= 1:
+        for j in jobs:
+            yield from _batch_build_chunk([j], encode, sanitize)
+    elif workers == BATCH_WORKERS:
+        yield from _run_windowed(_get_batch_pool(), jobs, workers, encode, sanitize)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from _run_windowed(pool, jobs, workers, encode, sanitize)
+
+_BATCH_DIFFICULTIES = ("easy", "medium", "hard", "mudah", "sedang", "sulit")
+
+class ChallengeBatchIn(BaseModel):
+    count: int = 100
+    types: List[str] = Field(default_factory=lambda: ["memory", "spatial", "numerical"])
+    difficulties: List[Optional[str]] = Field(default_factory=lambda: ["easy", "medium", "hard"])
+    seed: Optional[int] = None
+    persist: bool = False             # True: simpan ke disk & balas ringkasan; False: stream NDJSON
+
+@app.post("/v1/challenges/batch")
+def create_challenge_batch(payload: ChallengeBatchIn):
+    types = [(t or "").lower() for t in payload.types]
+    if not types or any(t not in _LOCAL_GENERATORS for t in types):
+        return JSONResponse({"error":"types harus subset dari 'memory'|'spatial'|'numerical'"}, status_code=400)
+    difficulties = [(d or "").lower() or None for d in (payload.difficulties or [None])]
+    if any(d is not None and d not in _BATCH_DIFFICULTIES for d in difficulties):
+        return JSONResponse({"error":"difficulties harus 'easy'|'medium'|'hard' (atau null)"}, status_code=400)
+    if not (1 <= payload.count <= BATCH_MAX):
+        return JSONResponse({"error": f"count harus 1..{BATCH_MAX}"}, status_code=400)
+    base_seed = payload.seed if payload.seed is not None else int(time.time()*1000) % (2**31-1)
+    jobs = _batch_jobs(payload.count, types, difficulties, base_seed, payload.persist)
+
+    if payload.persist:
+        t0 = time.perf_counter()
+        saved = list(run_batch(jobs))
+        elapsed = time.perf_counter() - t0
+        return {
+            "count": len(saved), "seed": base_seed, "workers": BATCH_WORKERS,
+            "elapsed_sec": round(elapsed, 3), "per_sec": round(len(saved) / elapsed, 1) if elapsed else None,
+            "challenges": saved,
+        }
+
+    return StreamingResponse(run_batch(jobs, encode=True, sanitize=True), media_type="application/x-ndjson")
+
+# ========= CLI =========
+def _cli_batch(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog="python main.py batch", description="Generate challenge bundle lokal secara massal.")
+    ap.add_argument("--count", type=int, default=1000)
+    ap.add_argument("--types", default="memory,spatial,numerical")
+    ap.add_argument("--difficulties", default="easy,medium,hard")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    ap.add_argument("--persist", action="store_true", help="simpan ke DATA_DIR/challenges alih-alih menulis NDJSON")
+    ap.add_argument("--out", default="-", help="file NDJSON (default stdout)")
+    args = ap.parse_args(argv)
+
+    types = [t.strip().lower() for t in args.types.split(",") if t.strip()]
+    bad = [t for t in types if t not in _LOCAL_GENERATORS]
+    if bad:
+        ap.error(f"type tidak dikenal: {bad}")
+    diffs = [d.strip().lower() or None for d in args.difficulties.split(",")]
+    bad = [d for d in diffs if d is not None and d not in _BATCH_DIFFICULTIES]
+    if bad:
+        ap.error(f"difficulty tidak dikenal: {bad}")
+    jobs = _batch_jobs(args.count, types, diffs, args.seed, args.persist)
+
+    t0 = time.perf_counter()
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    try:
+        n = 0
+        for line in run_batch(jobs, args.workers, encode=True):
+            out.write(line)
+            n += 1
+    finally:
+        if out is not sys.stdout: out.close()
+    elapsed = time.perf_counter() - t0
+    print(f"{n} bundle dalam {elapsed:.2f}s ({n/elapsed:.1f}/s, workers={args.workers})", file=sys.stderr)
+    return 0
+
+# ====== Waktu import (dipantau terhadap anggaran, lihat benchmarks/bench_import.py) ======
+IMPORT_BUDGET_SEC = float(os.getenv("IMPORT_BUDGET_SEC", "1.0"))
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_T0
+M_IMPORT = Gauge("app_import_seconds", "Durasi import main.py vs anggaran", ("kind",))
+M_IMPORT.set("measured", value=round(IMPORT_SECONDS, 4))
+M_IMPORT.set("budget", value=IMPORT_BUDGET_SEC)
+if IMPORT_SECONDS > IMPORT_BUDGET_SEC:
+    print(f"[startup] import main.py {IMPORT_SECONDS:.2f}s melebihi anggaran {IMPORT_BUDGET_SEC:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(_cli_batch(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "reindex":
+        print(json.dumps(reindex_all()))
+        sys.exit(0)
+    print("usage: python main.py batch [--count N] [--types ...] [--difficulties ...] [--seed S] [--workers W] [--persist] [--out FILE]\n"
+          "       python main.py reindex", file=sys.stderr)
+    sys.exit(2)
@@ -0,0 +1,29 @@
+import os, sys, tempfile
+from pathlib import Path
+
+# env harus diset sebelum main diimpor: DATA_DIR & backend dibaca saat import
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="custom-ai-test-")
+os.environ["GEMINI_BACKEND"] = "fake"
+os.environ.setdefault("FAKE_GEMINI_LATENCY_MS", "5:10")
+os.environ.setdefault("FAKE_GEMINI_ACTIVE_SEC", "0")
+os.environ["TRACE_EXPORT"] = "off"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+@pytest.fixture
+def new_challenge(client):
+    def make(seed: int, player: str, type: str = "numerical") -> str:
+        r = client.post("/v1/challenges/new", json={"type": type, "seed": seed, "use_llm": False, "adaptive": False,
+                                                    "player_name": player})
+        assert r.status_code == 200, r.text
+        return r.json()["challengeId"]
+    return make
@@ -0,0 +1,32 @@
+import main
+
+def test_etag_matches():
+    assert main._etag_matches('"abc"', "abc")
+    assert main._etag_matches('W/"abc-gz"', "abc")
+    assert main._etag_matches('"zzz", "abc-br"', "abc")
+    assert main._etag_matches("*", "abc")
+    assert not main._etag_matches('"abcd"', "abc")
+    assert not main._etag_matches(None, "abc")
+
+def test_conditional_get_across_encodings(client, new_challenge):
+    url = f"/v1/challenges/{new_challenge(400, 'etag')}"
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    gz = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert plain.status_code == gz.status_code == 200
+    assert "Content-Encoding" not in plain.headers
+    assert gz.headers["Content-Encoding"] == "gzip"
+    assert gz.json() == plain.json()
+    tag = plain.headers["ETag"].strip('"')
+    assert gz.headers["ETag"] == f'"{tag}-gz"'
+
+    # tag varian mana pun cocok untuk encoding mana pun
+    for enc, inm in (("identity", gz.headers["ETag"]), ("gzip", plain.headers["ETag"]), ("gzip", f'W/"{tag}"')):
+        r = client.get(url, headers={"Accept-Encoding": enc, "If-None-Match": inm})
+        assert r.status_code == 304
+        assert r.content == b""
+        assert r.headers["ETag"] == f'"{tag}"'
+    assert client.get(url, headers={"If-None-Match": '"lain"'}).status_code == 200
+
+def test_missing_and_invalid_doc(client):
+    assert client.get("/v1/challenges/000000000000").status_code == 404
+    assert client.get("/quiz/bad..id").status_code == 400
@@ -0,0 +1,26 @@
+def _new(client, key, seed, **extra):
+    body = {"type": "numerical", "seed": seed, "use_llm": False, "adaptive": False, **extra}
+    return client.post("/v1/challenges/new", json=body, headers={"Idempotency-Key": key})
+
+def test_replay_returns_stored_response(client):
+    first = _new(client, "idem-replay", 500)
+    again = _new(client, "idem-replay", 500)
+    assert first.status_code == again.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.json() == first.json()
+    assert again.headers.get("X-Request-ID")
+    # tanpa kunci: request baru, dokumen baru
+    plain = client.post("/v1/challenges/new", json={"type": "numerical", "seed": 500, "use_llm": False, "adaptive": False})
+    assert plain.json()["challengeId"] != first.json()["challengeId"]
+
+def test_same_key_different_body_is_422(client):
+    assert _new(client, "idem-mismatch", 501).status_code == 200
+    r = _new(client, "idem-mismatch", 502)
+    assert r.status_code == 422
+    assert "error" in r.json()
+
+def test_key_length_validated(client):
+    r = _new(client, "x" * 256, 504)
+    assert r.status_code == 400
+    assert "Idempotency-Key" in r.json()["error"]
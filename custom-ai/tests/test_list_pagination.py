@@ -0,0 +1,34 @@
+def _pages(client, url, params, limit):
+    ids, cursor = [], None
+    while True:
+        r = client.get(url, params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200, r.text
+        body = r.json()
+        ids += [c["challengeId"] for c in body["items"]]
+        cursor = body["nextCursor"]
+        if cursor is None:
+            return ids
+
+def test_cursor_walks_every_doc_once_newest_first(client, new_challenge):
+    made = [new_challenge(100 + i, "pager") for i in range(7)]
+    ids = _pages(client, "/v1/challenges", {"player_name": "pager"}, 3)
+    assert ids == made[::-1]
+
+def test_second_filter_checked_per_doc(client, new_challenge):
+    num = new_challenge(200, "mixer", "numerical")
+    new_challenge(201, "mixer", "memory")
+    r = client.get("/v1/challenges", params={"player_name": "mixer", "type": "numerical"})
+    assert [c["challengeId"] for c in r.json()["items"]] == [num]
+
+def test_cursor_rejected_for_other_filter(client, new_challenge):
+    for i in range(3):
+        new_challenge(300 + i, "cur-a")
+    cursor = client.get("/v1/challenges", params={"player_name": "cur-a", "limit": 1}).json()["nextCursor"]
+    assert cursor
+    r = client.get("/v1/challenges", params={"player_name": "cur-b", "limit": 1, "cursor": cursor})
+    assert r.status_code == 400
+    assert "cursor" in r.json()["error"]
+
+def test_bad_cursor_and_limit(client):
+    assert client.get("/v1/challenges", params={"cursor": "bukan-cursor"}).status_code == 400
+    assert client.get("/v1/challenges", params={"limit": 0}).status_code == 400
@@ -0,0 +1,49 @@
+import random
+
+import main
+
+def _walks(grid, start, max_steps):
+    # semua jalur 1..max_steps langkah tanpa balik langsung ke sel sebelumnya
+    out, stack = [], [[tuple(start)]]
+    while stack:
+        p = stack.pop()
+        if len(p) > 1:
+            out.append(p)
+        if len(p) - 1 == max_steps:
+            continue
+        for n in main._maze_neighbors(grid, *p[-1]):
+            if len(p) < 2 or n != p[-2]:
+                stack.append(p + [n])
+    return out
+
+def _brute_count(render):
+    return sum(main._maze_check_path(render, [list(c) for c in p])
+               for p in _walks(render["grid"], render["start"], render["maxSteps"]))
+
+def test_solution_count_matches_brute_force():
+    for seed in range(40):
+        item = main._gen_num_maze(random.Random(seed), 0, grid=3, max_steps=4)
+        render = item["render"]
+        assert _brute_count(render) == item["solution"]["solutionCount"] == 1
+        assert main._maze_check_path(render, item["solution"]["pathCells"])
+
+def test_dp_counts_every_target_like_brute_force():
+    rnd = random.Random(7)
+    ops = ["+", "-", "×", "÷"]
+    for _ in range(20):
+        cells = [[rnd.randrange(1, 10) for _ in range(3)] for _ in range(3)]
+        edges = {"h": [[rnd.choice(ops) for _ in range(2)] for _ in range(3)],
+                 "v": [[rnd.choice(ops) for _ in range(3)] for _ in range(2)]}
+        start = [rnd.randrange(3), rnd.randrange(3)]
+        stats = main._maze_target_stats(main._maze_layers(cells, edges, start, 4))
+        for target in list(stats)[:5]:
+            render = {"grid": 3, "cells": cells, "edges": edges, "start": start, "target": target, "maxSteps": 4}
+            assert _brute_count(render) == stats[target]["count"]
+
+def test_check_path_rejects_invalid_paths():
+    item = main._gen_num_maze(random.Random(3), 0, grid=3, max_steps=4)
+    render, path = item["render"], item["solution"]["pathCells"]
+    assert not main._maze_check_path(render, path[:-1])
+    assert not main._maze_check_path(render, path + [path[-2]])
+    assert not main._maze_check_path(render, [[9, 9]])
+    assert not main._maze_check_path(render, "bukan jalur")
@@ -0,0 +1,28 @@
+import main
+
+def _chat(client):
+    return client.post("/chat/completion", data={"text": "Apa itu fotosintesis?"})
+
+def test_chat_admitted(client):
+    r = _chat(client)
+    assert r.status_code == 200, r.text
+
+def test_queue_full_is_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setitem(main.GEMINI_QUEUE_LIMITS, "interactive", 0)
+    before = main._gemini_scheduler.stats()["classes"]["interactive"]["rejected"]
+    r = _chat(client)
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
+    assert r.json()["priority"] == "interactive"
+    assert r.json()["reason"] == "antrean penuh"
+    assert main._gemini_scheduler.stats()["classes"]["interactive"]["rejected"] == before + 1
+
+def test_wait_timeout_is_429_with_retry_after(client, monkeypatch):
+    # semua slot terpakai: tiket menunggu sampai batas kelas lalu ditolak
+    monkeypatch.setitem(main.GEMINI_MAX_WAIT, "interactive", 0.2)
+    monkeypatch.setattr(main._gemini_scheduler, "_running", main.GEMINI_MAX_CONCURRENCY)
+    r = _chat(client)
+    assert r.status_code == 429
+    assert int(r.headers["Retry-After"]) >= 1
+    assert r.json()["reason"] == "waktu tunggu habis"
+    assert main._gemini_scheduler.stats()["classes"]["interactive"]["queueDepth"] == 0